@@ -0,0 +1,3 @@
+# fmt: off
+if 1: import neoprint as _np; _np.setup()  # noqa
+# fmt: on
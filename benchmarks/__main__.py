@@ -0,0 +1,17 @@
+"""
+usage:
+    python -m benchmarks run -o result.json
+    python -m benchmarks run --packages 50 --modules 40 -n 5 -o result.json
+    python -m benchmarks compare result_a.json result_b.json
+"""
+
+from argsense import cli
+
+from .suite import compare
+from .suite import run
+
+cli.add_cmd(compare)
+cli.add_cmd(run)
+
+if __name__ == '__main__':
+    cli.run()
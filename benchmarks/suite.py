@@ -0,0 +1,295 @@
+"""
+time graph build, cache and export on a synthetic project.
+each phase runs in a fresh interpreter against the current checkout, so the
+in-memory caches don't leak between phases, and "cold" really starts with an
+empty cache root.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import typing as tp
+from statistics import median
+
+from lk_utils import fs
+
+from .synthetic import DEFAULT_PARAMS
+from .synthetic import T as T0
+from .synthetic import generate
+
+
+class T(T0):
+    Phase = tp.Literal[
+        'cold_build',
+        'warm_build',
+        'changed_build',
+        'first_export',
+        'noop_export',
+    ]
+    #   cold_build: build module graphs with an empty cache root.
+    #   warm_build: build again, nothing changed.
+    #   changed_build: build after one module in the closure is modified.
+    #   first_export: export to an empty target.
+    #   noop_export: export again, nothing changed.
+    Timing = tp.TypedDict('Timing', {'seconds': float, 'wall': float})
+    #   seconds: time of the measured call, the interpreter startup and
+    #       `import tree_shaking` are excluded.
+    #   wall: wall-clock time of the subprocess.
+    Report = tp.TypedDict(
+        'Report',
+        {
+            'python': str,
+            'commit': str,
+            'runs': int,
+            'params': T0.Params,
+            'options': tp.Dict[str, tp.Any],
+            'project': tp.Dict[str, int],
+            'phases': tp.Dict[
+                Phase,
+                tp.TypedDict(  # ty: ignore
+                    'PhaseReport',
+                    {
+                        'median': float,
+                        'min': float,
+                        'wall': float,
+                        'runs': tp.List[float],
+                    },
+                ),
+            ],
+        },
+    )
+    #   commit: `git describe --always --dirty` of the checkout, empty if git
+    #       is not available.
+    #   options: the options passed to `build_module_graphs`.
+    #   project: {'files': int, 'size': int}
+    #   phases: {phase: {'median': seconds, 'min': seconds, 'wall': seconds,
+    #       'runs': [seconds, ...]}}
+    #       wall is the median of the wall-clock times.
+
+
+PHASES: tp.Tuple[T.Phase, ...] = (
+    'cold_build',
+    'warm_build',
+    'changed_build',
+    'first_export',
+    'noop_export',
+)
+
+_REPO_ROOT = fs.parent(fs.xpath('.'))
+
+
+def run(
+    output: str = '',
+    runs: int = 3,
+    root: str = '',
+    workers: int = 0,
+    scanner_backend: str = 'ast',
+    packages: int = DEFAULT_PARAMS['packages'],
+    modules: int = DEFAULT_PARAMS['modules'],
+    fan_out: int = DEFAULT_PARAMS['fan_out'],
+    depth: int = DEFAULT_PARAMS['depth'],
+    cycles: int = DEFAULT_PARAMS['cycles'],
+    data_files: int = DEFAULT_PARAMS['data_files'],
+    data_size: int = DEFAULT_PARAMS['data_size'],
+    seed: int = DEFAULT_PARAMS['seed'],
+) -> T.Report:
+    """
+    params:
+        output (-o): a json file to save the report. if not given, print it.
+        runs (-n): each round starts over with an empty cache root and an
+            empty export target.
+        root (-r): where to generate the project. if not given, a temporary
+            directory is used and removed after the benchmark.
+        workers (-w): see `tree_shaking.build_module_graphs`.
+        scanner_backend (-s): see `tree_shaking.build_module_graphs`.
+        packages: the params of the synthetic project, see
+            `synthetic.T.Params`.
+        modules:
+        fan_out:
+        depth:
+        cycles:
+        data_files:
+        data_size:
+        seed:
+    """
+    options = {'workers': workers, 'scanner_backend': scanner_backend}
+    params: T.Params = {
+        'packages': packages,
+        'modules': modules,
+        'fan_out': fan_out,
+        'depth': depth,
+        'cycles': cycles,
+        'data_files': data_files,
+        'data_size': data_size,
+        'seed': seed,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        project = generate(root or '{}/project'.format(tmp), **params)
+        print(
+            'generated {} files ({})'.format(
+                project['files'], fs.pretty_size(project['size'])
+            ),
+            ':v2',
+        )
+        timings = {x: [] for x in PHASES}
+        changeable = project['changeable_file']
+        with open(changeable, 'rb') as f:
+            original = f.read()
+        try:
+            for i in range(runs):
+                print('round {}/{}'.format(i + 1, runs), ':i')
+                for phase, x in _run_round(
+                    project, '{}/cache_{}'.format(tmp, i), options, original
+                ):
+                    timings[phase].append(x)
+        finally:
+            with open(changeable, 'wb') as f:
+                f.write(original)
+
+    report: T.Report = {
+        'python': sys.version,
+        'commit': _get_commit(),
+        'runs': runs,
+        'params': params,
+        'options': options,
+        'project': {'files': project['files'], 'size': project['size']},
+        'phases': {
+            phase: {
+                'median': median(x['seconds'] for x in timings[phase]),
+                'min': min(x['seconds'] for x in timings[phase]),
+                'wall': median(x['wall'] for x in timings[phase]),
+                'runs': [x['seconds'] for x in timings[phase]],
+            }
+            for phase in PHASES
+        },
+    }
+    for phase, x in report['phases'].items():
+        print(':v2', '{:<14} {:>9.3f}s'.format(phase, x['median']))
+    if output:
+        fs.dump(report, output)
+        print('saved report to {}'.format(output), ':v4')
+    else:
+        sys.stdout.write(json.dumps(report, indent=2) + '\n')
+    return report
+
+
+def compare(report_a: str, report_b: str) -> None:
+    """
+    compare two reports phase by phase, e.g. of two commits.
+    """
+    a: T.Report = fs.load(report_a)
+    b: T.Report = fs.load(report_b)
+    if (a['params'], a['options']) != (b['params'], b['options']):
+        print(
+            'the reports are generated with different params',
+            (a['params'], a['options']),
+            (b['params'], b['options']),
+            ':v6',
+        )
+    print(':v2', '{} -> {}'.format(a['commit'] or '?', b['commit'] or '?'))
+    for phase in PHASES:
+        x = a['phases'][phase]['median']
+        y = b['phases'][phase]['median']
+        print(
+            ':v2',
+            '{:<14} {:>9.3f}s -> {:>9.3f}s  ({:+.1%})'.format(
+                phase, x, y, (y - x) / x if x else 0
+            ),
+        )
+
+
+# ------------------------------------------------------------------------------
+
+# runs in the child interpreter.
+_BOOTSTRAP = """
+import json
+import sys
+import time
+phase, config_file, options, report = sys.argv[1:5]
+import tree_shaking
+start = time.perf_counter()
+if phase.endswith('_export'):
+    tree_shaking.dump_tree_from_config_file(config_file)
+else:
+    tree_shaking.build_module_graphs(config_file, **json.loads(options))
+with open(report, 'w') as f:
+    f.write(repr(time.perf_counter() - start))
+"""
+
+
+def _run_round(
+    project: T.Project, cache_root: str, options: dict, original: bytes
+) -> tp.Iterator[tp.Tuple[T.Phase, T.Timing]]:
+    os.mkdir(cache_root)
+    config_file = project['config_file']
+    changeable = project['changeable_file']
+    target = '{}/dist/minideps'.format(fs.parent(config_file))
+    if fs.exist(target):
+        fs.remove_tree(target)
+    with open(changeable, 'wb') as f:
+        f.write(original)
+
+    for phase in PHASES:
+        if phase == 'changed_build':
+            with open(changeable, 'ab') as f:
+                f.write(b'\nCHANGED = True\n')
+            # the default revision strategy is mtime, make sure the change is
+            # visible even if the file system has a coarse mtime resolution.
+            t = os.stat(changeable).st_mtime + 2
+            os.utime(changeable, (t, t))
+        yield phase, _run_phase(phase, config_file, cache_root, options)
+
+
+def _run_phase(
+    phase: T.Phase, config_file: str, cache_root: str, options: dict
+) -> T.Timing:
+    with tempfile.TemporaryDirectory() as tmp:
+        report_file = '{}/report.txt'.format(tmp)
+        start = time.perf_counter()
+        proc = subprocess.run(
+            (
+                sys.executable,
+                '-c',
+                _BOOTSTRAP,
+                phase,
+                config_file,
+                json.dumps(options),
+                report_file,
+            ),
+            cwd=fs.parent(config_file),
+            env={
+                **os.environ,
+                'PYTHONPATH': os.pathsep.join(
+                    filter(None, (_REPO_ROOT, os.getenv('PYTHONPATH')))
+                ),
+                'TREE_SHAKING_CACHE_ROOT': cache_root,
+            },
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        wall = time.perf_counter() - start
+        if proc.returncode != 0 or not os.path.exists(report_file):
+            raise Exception(
+                'benchmark phase failed', phase, proc.returncode, proc.stderr
+            )
+        with open(report_file) as f:
+            seconds = float(f.read())
+    print(':v1', '{:<14} {:>9.3f}s'.format(phase, seconds))
+    return {'seconds': seconds, 'wall': wall}
+
+
+def _get_commit() -> str:
+    try:
+        return subprocess.run(
+            ('git', 'describe', '--always', '--dirty'),
+            cwd=_REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
@@ -0,0 +1,208 @@
+"""
+generate a synthetic project for benchmarks: a fake site-packages, an entry
+script which imports every package, and a config file.
+
+layout:
+    <root>
+    |- dist
+    |- site-packages
+    |   |- pkg000
+    |   |   |- __init__.py
+    |   |   |- mod000.py
+    |   |   |- sub1
+    |   |   |   |- __init__.py
+    |   |   |   |- mod001.py
+    |   |   |   |- sub2
+    |   |   |       |- ...
+    |   |   |- data
+    |   |       |- file000.bin
+    |   |       |- ...
+    |   |- pkg001
+    |   |- ...
+    |- src
+    |   |- main.py
+    |- tree_shaking.yaml
+"""
+
+import os
+import random
+import typing as tp
+
+from lk_utils import fs
+
+
+class T:
+    Params = tp.TypedDict(
+        'Params',
+        {
+            'packages': int,
+            'modules': int,
+            'fan_out': int,
+            'depth': int,
+            'cycles': int,
+            'data_files': int,
+            'data_size': int,
+            'seed': int,
+        },
+    )
+    #   packages: number of top level packages.
+    #   modules: number of modules in each package (`__init__.py` excluded).
+    #   fan_out: number of imports in each module. some of them are relative
+    #       imports to the same package, the others are absolute imports to
+    #       the previous packages.
+    #   depth: subpackage nesting depth. module `i` lives at level
+    #       `i % (depth + 1)`, the deepest relative import has `depth + 1`
+    #       dots.
+    #   cycles: number of back edges (import cycles) in each package.
+    #   data_files: number of files in the "data" directory of each package.
+    #   data_size: size of each data file, in bytes.
+    #   seed: the random seed. the same params generate the same tree.
+    Project = tp.TypedDict(
+        'Project',
+        {'config_file': str, 'changeable_file': str, 'files': int, 'size': int},
+    )
+    #   changeable_file: a module in the closure of the entry, benchmarks
+    #       modify it to measure an incremental rebuild.
+    #   files: number of generated files.
+    #   size: total size of generated files, in bytes.
+
+
+DEFAULT_PARAMS: T.Params = {
+    'packages': 20,
+    'modules': 30,
+    'fan_out': 4,
+    'depth': 3,
+    'cycles': 2,
+    'data_files': 10,
+    'data_size': 16384,
+    'seed': 0,
+}
+
+
+def generate(root: str, **params) -> T.Project:
+    """
+    params:
+        root: an empty or non-existent directory.
+        **params: see `T.Params`. missing ones are taken from
+            `DEFAULT_PARAMS`.
+    """
+    p: T.Params = {**DEFAULT_PARAMS, **params}  # type: ignore
+    assert not (fs.exist(root) and os.listdir(root)), ('not empty', root)
+    rand = random.Random(p['seed'])
+    root = fs.abspath(root)
+    stats = {'files': 0, 'size': 0}
+
+    def dump(path: str, data: tp.Union[str, bytes]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode()
+        with open(path, 'wb') as f:
+            f.write(data)
+        stats['files'] += 1
+        stats['size'] += len(data)
+
+    for i in range(p['packages']):
+        pkg = 'pkg{:03}'.format(i)
+        pkg_dir = '{}/site-packages/{}'.format(root, pkg)
+        # `parts[j]`: the subpackage path of module j, relative to `pkg_dir`.
+        parts = [
+            ['sub{}'.format(k) for k in range(1, j % (p['depth'] + 1) + 1)]
+            for j in range(p['modules'])
+        ]
+        edges = {j: set() for j in range(p['modules'])}
+        for j in range(1, p['modules']):
+            for _ in range(p['fan_out']):
+                edges[j].add(rand.randrange(j))
+        for _ in range(p['cycles']):
+            if p['modules'] > 1:
+                j = rand.randrange(p['modules'] - 1)
+                edges[j].add(rand.randrange(j + 1, p['modules']))
+
+        for j in range(p['modules']):
+            lines = []
+            for k in sorted(edges[j]):
+                lines.append(_relative_import(parts[j], parts[k], k))
+            if i > 0 and j > 0:
+                x = rand.randrange(i)
+                y = rand.randrange(p['modules'])
+                lines.append(
+                    'from {} import {}'.format(
+                        '.'.join(('pkg{:03}'.format(x), *parts[y])),
+                        'mod{:03}'.format(y),
+                    )
+                )
+            dump(
+                '/'.join((pkg_dir, *parts[j], 'mod{:03}.py'.format(j))),
+                _module_source(lines, j),
+            )
+        for k in range(p['depth'] + 1):
+            # each `__init__.py` imports the first module at its level.
+            dump(
+                '/'.join(
+                    (pkg_dir, *('sub{}'.format(x) for x in range(1, k + 1)))
+                )
+                + '/__init__.py',
+                'from . import mod{:03}\n'.format(k)
+                if k < p['modules']
+                else '',
+            )
+        for j in range(p['data_files']):
+            dump(
+                '{}/data/file{:03}.bin'.format(pkg_dir, j),
+                rand.randbytes(p['data_size']),
+            )
+
+    dump(
+        '{}/src/main.py'.format(root),
+        ''.join('import pkg{:03}\n'.format(i) for i in range(p['packages'])),
+    )
+    dump('{}/tree_shaking.yaml'.format(root), _CONFIG)
+    os.makedirs('{}/dist'.format(root), exist_ok=True)
+    return {
+        'config_file': '{}/tree_shaking.yaml'.format(root),
+        'changeable_file': '{}/site-packages/pkg000/mod000.py'.format(root),
+        'files': stats['files'],
+        'size': stats['size'],
+    }
+
+
+# ------------------------------------------------------------------------------
+
+_CONFIG = """\
+root: .
+search_paths:
+  - site-packages
+  - src
+entries:
+  - src/main.py
+export:
+  source: site-packages
+  target: dist/minideps
+"""
+
+
+def _module_source(imports: tp.List[str], index: int) -> str:
+    return '{}\n\nVALUE = {}\n\n\n{}'.format(
+        '\n'.join(imports),
+        index,
+        ''.join(
+            'def func{}(x: int) -> int:\n'
+            '    """\n'
+            '    docstring of func{}.\n'
+            '    """\n'
+            '    y = x * {} + VALUE\n'
+            '    return y\n\n\n'.format(k, k, k)
+            for k in range(10)
+        ),
+    )
+
+
+def _relative_import(src: tp.List[str], dst: tp.List[str], index: int) -> str:
+    common = 0
+    for a, b in zip(src, dst):
+        if a != b:
+            break
+        common += 1
+    return 'from {}{} import mod{:03}'.format(
+        '.' * (len(src) - common + 1), '.'.join(dst[common:]), index
+    )
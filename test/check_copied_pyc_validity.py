@@ -0,0 +1,58 @@
+"""
+step 1:
+    source folder   target folder
+    |- a.py         |- a.py  # copied (or hard linked) from source.a
+                    |- __pycache__
+                       |- a.cpython-3xx.pyc  # compiled from source.a
+step 2:
+    touch source.a (content unchanged), export again.
+step 3:
+    - is target pyc still valid for target.a?
+"""
+
+import os
+import time
+from importlib._bootstrap_external import _classify_pyc
+from importlib._bootstrap_external import _validate_timestamp_pyc
+from importlib.util import cache_from_source
+
+from lk_utils import fs
+from lk_utils import timestamp
+
+from tree_shaking.export import _compile_source
+from tree_shaking.export import _materialize_file
+
+test_root = fs.xpath('_test_root_{}'.format(timestamp('hns')))
+print(fs.basename(test_root), ':v1')
+
+fs.make_dir(test_root)
+fs.make_dir(test_root + '/source')
+fs.make_dir(test_root + '/target')
+
+a0 = f'{test_root}/source/a.py'
+a1 = f'{test_root}/target/a.py'
+fs.dump('print("aaa")\n', a0)
+os.utime(a0, (time.time() - 1000,) * 2)
+
+
+def export(materialize: str) -> bool:
+    _materialize_file(a0, a1, materialize)  # type: ignore
+    pyc = cache_from_source(a1)
+    fs.make_dir(fs.parent(pyc))
+    assert not _compile_source((a0, pyc, None, 0))
+    data = fs.load(pyc, 'binary')
+    st = os.stat(a1)
+    try:
+        _classify_pyc(data, 'a', {})
+        _validate_timestamp_pyc(data, int(st.st_mtime), st.st_size, 'a', {})
+    except ImportError:
+        return False
+    return True
+
+
+for mode in ('copy', 'copy_if_changed', 'hardlink'):
+    print(mode, export(mode), ':i')
+    os.utime(a0, (time.time() - 500,) * 2)  # touch only
+    print(mode, export(mode), ':i')
+
+fs.remove_tree(test_root)
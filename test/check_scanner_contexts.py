@@ -0,0 +1,50 @@
+"""
+scan the same file with the `ast` and `fast` backends, they must agree on the
+context of every import, especially the `if` tests that look like
+`TYPE_CHECKING` but are not.
+"""
+
+from lk_utils import fs
+from lk_utils import timestamp
+
+from tree_shaking.scanner import Scanner
+from tree_shaking.scanner import _dump_node
+
+test_root = fs.xpath('_test_root_{}'.format(timestamp('hns')))
+print(fs.basename(test_root), ':v1')
+
+fs.make_dir(test_root)
+file = f'{test_root}/a.py'
+fs.dump(
+    '\n'.join(
+        (
+            'import typing',
+            'from typing import TYPE_CHECKING',
+            'a = True',
+            'if TYPE_CHECKING:',
+            '    import m1',
+            'if typing.TYPE_CHECKING:',
+            '    import m2',
+            'if not TYPE_CHECKING:',
+            '    import m3',
+            'if a and TYPE_CHECKING:',
+            '    import m4',
+            'if a or typing.TYPE_CHECKING:',
+            '    import m5',
+            '',
+        )
+    ),
+    file,
+)
+
+results = {}
+for backend in ('ast', 'fast'):
+    results[backend] = tuple(
+        _dump_node(n, c)
+        for n, _, c in Scanner(backend).scan(file)  # type: ignore
+    )
+    print(backend, results[backend], ':l')
+assert results['ast'] == results['fast'], results
+print('backends agree', ':v4')
+
+fs.remove_tree(test_root)
@@ -1,23 +1,66 @@
 from argsense import cli
 
+from .bench import bench
+from .cache import manage_cache
+from .cache import migrate_cache
+from .dynamic_analyzer import trace_script
 from .export import dump_tree_from_config_file
 from .graph import build_module_graphs
+from .watch import watch
 
+cli.add_cmd(bench)
 cli.add_cmd(build_module_graphs)
+cli.add_cmd(manage_cache, name='cache')
+cli.add_cmd(migrate_cache)
+cli.add_cmd(trace_script)
+cli.add_cmd(watch)
 
 
-def dump_tree(config_file: str, dir_o: str = '', dry_run: int = 0) -> None:
+def dump_tree(
+    config_file: str,
+    dir_o: str = '',
+    dry_run: int = 0,
+    content_hash: bool = False,
+    workers: int = 0,
+    precompile: str = '',
+    optimize: int = 0,
+    dce: str = '',
+    minify: str = '',
+    report: str = '',
+    profile: str = '',
+    materialize: str = 'symlink',
+) -> None:
     """
     params:
         dir_o (-o):
         dry_run (-d):
+        content_hash: compare source files by content hash instead of mtime.
+        workers (-w): run file operations in a pool of N threads.
+        precompile (-c): '', 'pycache' or 'sourceless'.
+        optimize (-O):
+        dce: '', 'conservative' or 'aggressive'.
+        minify (-m): '', 'keep_lines' or 'compact'.
+        report (-r): save per-phase timings and counters to this json file.
+        profile (-p): '', 'cpu', 'memory' or 'all'.
+        materialize: 'symlink', 'hardlink', 'copy' or 'copy_if_changed'.
     """
     dump_tree_from_config_file(
         config_file,
         dir_o,
         dry_run=dry_run,  # type: ignore
+        content_hash=content_hash,
+        workers=workers,
+        precompile=precompile,  # type: ignore
+        optimize=optimize,
+        dce=dce,  # type: ignore
+        minify=minify,  # type: ignore
+        report=report,
+        profile=profile,  # type: ignore
+        materialize=materialize,  # type: ignore
     )
 
 
+cli.add_cmd(dump_tree)
+
 if __name__ == '__main__':
     cli.run()
@@ -0,0 +1,113 @@
+"""
+run a script with audit hooks, record the modules it imports and the files it
+opens.
+this file is executed by path in a child interpreter (see
+`dynamic_analyzer.trace_script`), it must not import `tree_shaking` or any
+third party package, otherwise they would be recorded as well.
+
+usage:
+    python _tracer.py <record_file> <script> [args...]
+"""
+
+import json
+import os
+import sys
+import typing as tp
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self._active = False
+        self._dll_dirs = {}
+        #   {path: None, ...}
+        self._files = {}
+        #   {path: None, ...}
+        self._imports = {}
+        #   {module_name: None, ...}
+
+    def start(self) -> None:
+        if not self._active:
+            self._active = True
+            # audit hooks cannot be removed, `stop` only deactivates it.
+            sys.addaudithook(self._hook)
+
+    def stop(self) -> None:
+        self._active = False
+
+    def collect(self) -> tp.List[tp.Tuple[str, str, bool]]:
+        """
+        returns: [(module_name, path, isdir), ...]
+            module_name is empty for data files and dll directories.
+        """
+        out = {}
+        for name in (*self._imports, *tuple(sys.modules)):
+            if path := _get_module_file(name):
+                out.setdefault(_normpath(path), (name, False))
+        for path in self._files:
+            out.setdefault(path, ('', False))
+        for path in self._dll_dirs:
+            out.setdefault(path, ('', True))
+        return [(name, path, isdir) for path, (name, isdir) in out.items()]
+
+    def _hook(self, event: str, args: tuple) -> None:
+        if not self._active:
+            return
+        if event == 'open':
+            path, mode, flags = args
+            if isinstance(path, (str, bytes)) and _is_read_only(mode, flags):
+                path = _normpath(os.fsdecode(path))
+                if '/__pycache__/' not in path:
+                    self._files[path] = None
+        elif event == 'import':
+            self._imports[args[0]] = None
+        elif event == 'ctypes.dlopen':
+            if isinstance(args[0], (str, bytes)):
+                path = os.fsdecode(args[0])
+                if os.path.isabs(path) or '/' in path or '\\' in path:
+                    self._files[_normpath(path)] = None
+        elif event == 'os.add_dll_directory':
+            self._dll_dirs[_normpath(os.fsdecode(args[0]))] = None
+
+
+def _get_module_file(name: str) -> str:
+    if (module := sys.modules.get(name)) is None:
+        # imported but removed later, or failed to import.
+        try:
+            from importlib.util import find_spec
+
+            spec = find_spec(name)
+        except Exception:
+            return ''
+        return spec.origin if spec and spec.has_location else ''
+    return getattr(module, '__file__', None) or ''
+
+
+def _is_read_only(mode: tp.Optional[str], flags: int) -> bool:
+    if isinstance(mode, str):
+        return not any(x in mode for x in 'wax')
+    return not flags & (os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+
+
+def _normpath(path: str) -> str:
+    return os.path.abspath(path).replace('\\', '/')
+
+
+def main() -> None:
+    record_file, script, *args = sys.argv[1:]
+    script = os.path.abspath(script)
+    sys.argv = [script, *args]
+    sys.path[0] = os.path.dirname(script)
+    import runpy
+
+    tracer = Tracer()
+    tracer.start()
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        tracer.stop()
+        with open(record_file, 'w', encoding='utf-8') as f:
+            json.dump(tracer.collect(), f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,500 @@
+import hashlib
+import io
+import os
+import struct
+import tarfile
+import time
+import typing as tp
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import neoprint as np
+from lk_utils import fs
+
+from .cache import cache_maker
+from .manifest import SourceManifest
+from .path_typing import T as T0
+
+
+class T(T0):
+    ArchivePath = str  # an absolute path ends with '.zip' or '.tar.zst'.
+    Member = tp.Tuple[str, int, int, int, int, int, int, int]
+    #   (stamp, offset, length, method, crc, csize, usize, mode)
+    #       stamp: see `_get_stamp`.
+    #       offset: offset of the local header in the archive.
+    #       length: length of the local header and the compressed data.
+    #       method: 0 (stored) or 8 (deflated).
+    #       csize, usize: compressed and uncompressed size.
+    #       mode: unix file mode, e.g. 0o100644.
+    Records = tp.TypedDict(
+        'Records',
+        {
+            'archive': tp.Tuple[int, int],
+            'fingerprint': str,
+            'members': tp.Dict[T0.RelFilePath, Member],
+        },
+    )
+    #   archive: (size, mtime_ns) of the archive file when it was written. if
+    #       it doesn't match, the archive was touched by others, the records
+    #       are not trusted.
+    #   fingerprint: see `export.T.Records`.
+    #   members: only for zip. tar.zst doesn't support partial update.
+
+
+ZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+_LIMIT = 0xFFFFFFFF  # beyond this, zip64 extensions are needed.
+
+
+def is_archive(path: str) -> bool:
+    return path.endswith(('.zip', '.tar.zst'))
+
+
+def dump_archive(
+    root_i: T.AbsDirPath,
+    file_o: T.ArchivePath,
+    manifest: SourceManifest,
+    fingerprint: str,
+    content_hash: bool = False,
+    dry_run: bool = False,
+    workers: int = 0,
+    overrides: tp.Optional[tp.Dict[T.RelFilePath, bytes]] = None,
+) -> None:
+    """
+    write the resources stamped by `manifest` into an archive, streamed from
+    the source files directly, no intermediate tree is created.
+    members are sorted by path, timestamps and owners are fixed (see
+    `_get_epoch`), so the same file set always produces the same bytes.
+    for zip, an existing archive is updated incrementally: unchanged members
+    are copied as raw bytes from the old archive, only changed members are
+    compressed again. for tar.zst, the archive is rewritten if anything
+    changed.
+    `overrides` are written with the given content instead of the source
+    files, see `export._dump_single_source`.
+    """
+    overrides = overrides or {}
+    records_key = '{};{}'.format(root_i, file_o) + ':0'
+    members = sorted(manifest.entries)
+    stamps = {r: _get_stamp(manifest.entries[r], content_hash) for r in members}
+    for r, data in overrides.items():
+        stamps[r] = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    records0: tp.Optional[T.Records] = None
+    if dry_run != 2 and fs.exist(file_o):
+        records0 = cache_maker.get_cache(records_key, 'last_dumped_archives')
+        if records0 and records0['archive'] != _get_archive_stat(file_o):
+            print('archive was modified by others, rebuild it', ':v6')
+            records0 = None
+    if records0 and records0['fingerprint'] == fingerprint:
+        if not dry_run:
+            manifest.save()
+        print('nothing changed, skip export', ':v4')
+        return
+
+    old = records0['members'] if records0 else {}
+    if dry_run:
+        with np.scope():
+            for r in members:
+                if r not in old:
+                    print(':i2v4', '[dry run] add member: {}'.format(r))
+                elif old[r][0] != stamps[r] or file_o.endswith('.tar.zst'):
+                    print(':i2v6', '[dry run] update member: {}'.format(r))
+            for r in sorted(old.keys() - stamps.keys()):
+                print(':i2v8', '[dry run] drop member: {}'.format(r))
+        print('export done', ':ptv4')
+        return
+
+    fs.make_dir(fs.parent(file_o))
+    temp_file = file_o + '.tmp'
+    try:
+        if file_o.endswith('.zip'):
+            new = _write_zip(
+                root_i,
+                temp_file,
+                members,
+                stamps,
+                file_o,
+                old,
+                workers,
+                overrides,
+            )
+        else:
+            _write_tar_zst(root_i, temp_file, members, workers, overrides)
+            new = {}
+        os.replace(temp_file, file_o)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+    records1: T.Records = {
+        'archive': _get_archive_stat(file_o),
+        'fingerprint': fingerprint,
+        'members': new,
+    }
+    cache_maker.save_cache(records_key, 'last_dumped_archives', records1)
+    manifest.save()
+    print('export done', ':ptv4')
+
+
+# ------------------------------------------------------------------------------
+# zip
+
+
+def _write_zip(
+    root_i: T.AbsDirPath,
+    file_o: T.AbsFilePath,
+    members: tp.Sequence[T.RelFilePath],
+    stamps: tp.Dict[T.RelFilePath, str],
+    old_file: T.AbsFilePath,
+    old_members: tp.Dict[T.RelFilePath, T.Member],
+    workers: int,
+    overrides: tp.Dict[T.RelFilePath, bytes],
+) -> tp.Dict[T.RelFilePath, T.Member]:
+    dostime, dosdate = _get_dos_datetime()
+    todo = [r for r in members if old_members.get(r, ('',))[0] != stamps[r]]
+    print(
+        ':v2',
+        'write zip: {} members, {} to compress'.format(len(members), len(todo)),
+    )
+
+    def compress(r: T.RelFilePath) -> tp.Tuple[bytes, int, int, int, int]:
+        path = '{}/{}'.format(root_i, r)
+        if r in overrides:
+            data = overrides[r]
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+        mode = 0o100000 | (os.stat(path).st_mode & 0o777)
+        crc = zlib.crc32(data)
+        c = zlib.compressobj(ZIP_LEVEL, zlib.DEFLATED, -15)
+        packed = c.compress(data) + c.flush()
+        if len(packed) < len(data):
+            return packed, 8, crc, len(data), mode
+        return data, 0, crc, len(data), mode
+
+    out = {}
+    central = []
+    with (
+        open(file_o, 'wb') as f,
+        open(old_file, 'rb') if old_members else _NullFile() as old,
+        _Pool(workers) as pool,
+    ):
+        compressed = pool.imap(compress, todo)
+        for r in members:
+            offset = f.tell()
+            name = r.encode('utf-8')
+            if r in old_members and old_members[r][0] == stamps[r]:
+                _, offset0, length, method, crc, csize, usize, mode = (
+                    old_members[r]
+                )
+                old.seek(offset0)
+                _copy_bytes(old, f, length)
+            else:
+                data, method, crc, usize, mode = next(compressed)
+                csize = len(data)
+                f.write(
+                    _pack_local_header(
+                        name, method, crc, csize, usize, dostime, dosdate
+                    )
+                )
+                f.write(data)
+                length = f.tell() - offset
+            out[r] = (
+                stamps[r],
+                offset,
+                length,
+                method,
+                crc,
+                csize,
+                usize,
+                mode,
+            )
+            central.append(
+                _pack_central_header(
+                    name,
+                    method,
+                    crc,
+                    csize,
+                    usize,
+                    dostime,
+                    dosdate,
+                    mode,
+                    offset,
+                )
+            )
+
+        cd_offset = f.tell()
+        for x in central:
+            f.write(x)
+        f.write(
+            _pack_end_records(len(central), f.tell() - cd_offset, cd_offset)
+        )
+    return out
+
+
+def _pack_local_header(
+    name: bytes,
+    method: int,
+    crc: int,
+    csize: int,
+    usize: int,
+    dostime: int,
+    dosdate: int,
+) -> bytes:
+    extra = b''
+    version = 20
+    if csize >= _LIMIT or usize >= _LIMIT:
+        extra = struct.pack('<HHQQ', 1, 16, usize, csize)
+        csize = usize = _LIMIT
+        version = 45
+    return (
+        struct.pack(
+            '<IHHHHHIIIHH',
+            0x04034B50,
+            version,
+            0x800,  # utf-8 names
+            method,
+            dostime,
+            dosdate,
+            crc,
+            csize,
+            usize,
+            len(name),
+            len(extra),
+        )
+        + name
+        + extra
+    )
+
+
+def _pack_central_header(
+    name: bytes,
+    method: int,
+    crc: int,
+    csize: int,
+    usize: int,
+    dostime: int,
+    dosdate: int,
+    mode: int,
+    offset: int,
+) -> bytes:
+    # the zip64 extra field holds only the values that overflow, in this
+    # order.
+    values = []
+    if usize >= _LIMIT:
+        values.append(usize)
+        usize = _LIMIT
+    if csize >= _LIMIT:
+        values.append(csize)
+        csize = _LIMIT
+    if offset >= _LIMIT:
+        values.append(offset)
+        offset = _LIMIT
+    if values:
+        extra = struct.pack(
+            '<HH{}Q'.format(len(values)), 1, 8 * len(values), *values
+        )
+        version = 45
+    else:
+        extra = b''
+        version = 20
+    return (
+        struct.pack(
+            '<IHHHHHHIIIHHHHHII',
+            0x02014B50,
+            (3 << 8) | version,  # made by unix
+            version,
+            0x800,
+            method,
+            dostime,
+            dosdate,
+            crc,
+            csize,
+            usize,
+            len(name),
+            len(extra),
+            0,  # comment length
+            0,  # disk number
+            0,  # internal attributes
+            mode << 16,
+            offset,
+        )
+        + name
+        + extra
+    )
+
+
+def _pack_end_records(count: int, cd_size: int, cd_offset: int) -> bytes:
+    out = b''
+    if count >= 0xFFFF or cd_size >= _LIMIT or cd_offset >= _LIMIT:
+        eocd64_offset = cd_offset + cd_size
+        out += struct.pack(
+            '<IQHHIIQQQQ',
+            0x06064B50,
+            44,
+            (3 << 8) | 45,
+            45,
+            0,
+            0,
+            count,
+            count,
+            cd_size,
+            cd_offset,
+        )
+        out += struct.pack('<IIQI', 0x07064B50, 0, eocd64_offset, 1)
+    out += struct.pack(
+        '<IHHHHIIH',
+        0x06054B50,
+        0,
+        0,
+        min(count, 0xFFFF),
+        min(count, 0xFFFF),
+        min(cd_size, _LIMIT),
+        min(cd_offset, _LIMIT),
+        0,
+    )
+    return out
+
+
+# ------------------------------------------------------------------------------
+# tar.zst
+
+
+def _write_tar_zst(
+    root_i: T.AbsDirPath,
+    file_o: T.AbsFilePath,
+    members: tp.Sequence[T.RelFilePath],
+    workers: int,
+    overrides: tp.Dict[T.RelFilePath, bytes],
+) -> None:
+    print(':v2', 'write tar.zst: {} members'.format(len(members)))
+    epoch = _get_epoch()
+    with (
+        _open_zstd_writer(file_o, workers) as z,
+        tarfile.open(fileobj=z, mode='w|', format=tarfile.PAX_FORMAT) as tar,
+    ):
+        for r in members:
+            path = '{}/{}'.format(root_i, r)
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                info = tarfile.TarInfo(r)
+                info.size = st.st_size
+                info.mode = st.st_mode & 0o777
+                info.mtime = epoch
+                if r in overrides:
+                    info.size = len(overrides[r])
+                    tar.addfile(info, io.BytesIO(overrides[r]))
+                else:
+                    tar.addfile(info, f)
+
+
+def _open_zstd_writer(file_o: T.AbsFilePath, workers: int) -> tp.BinaryIO:
+    try:
+        from compression import zstd  # python 3.14+
+    except ImportError:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                'exporting to ".tar.zst" requires python 3.14+ or the '
+                '"zstandard" package'
+            )
+        return zstandard.ZstdCompressor(
+            level=ZSTD_LEVEL, threads=workers if workers > 1 else 0
+        ).stream_writer(open(file_o, 'wb'))
+    options = {zstd.CompressionParameter.compression_level: ZSTD_LEVEL}
+    if workers > 1:
+        options[zstd.CompressionParameter.nb_workers] = workers
+    return zstd.ZstdFile(file_o, 'w', options=options)
+
+
+# ------------------------------------------------------------------------------
+
+
+class _NullFile:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *_) -> None:
+        pass
+
+
+class _Pool:
+    """
+    maps a function over items in a thread pool, yields results in order.
+    zlib releases the GIL while compressing, so threads scale. the look-ahead
+    is bounded, so only a few compressed members are held in memory.
+    if `workers` is 0 or 1, items are processed in the calling thread.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self._ahead = max(1, workers) * 2
+        self._pool = (
+            ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        )
+
+    def __enter__(self) -> '_Pool':
+        return self
+
+    def __exit__(self, *_) -> None:
+        if self._pool:
+            self._pool.shutdown(cancel_futures=True)
+
+    def imap(
+        self, func: tp.Callable[[str], tp.Any], items: tp.Iterable[str]
+    ) -> tp.Iterator[tp.Any]:
+        if self._pool is None:
+            yield from map(func, items)
+            return
+        items = iter(items)
+        pending = deque()
+        for x in items:
+            pending.append(self._pool.submit(func, x))
+            if len(pending) >= self._ahead:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for x in items:
+                pending.append(self._pool.submit(func, x))
+                break
+            yield result
+
+
+def _copy_bytes(src: tp.BinaryIO, dst: tp.BinaryIO, length: int) -> None:
+    while length > 0:
+        chunk = src.read(min(length, 1024 * 1024))
+        if not chunk:
+            raise EOFError('the old archive is truncated')
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def _get_archive_stat(file: T.AbsFilePath) -> tp.Tuple[int, int]:
+    st = os.stat(file)
+    return st.st_size, st.st_mtime_ns
+
+
+def _get_dos_datetime() -> tp.Tuple[int, int]:
+    t = time.gmtime(_get_epoch())
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00:00
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def _get_epoch() -> int:
+    """
+    the fixed timestamp of all members. respects "SOURCE_DATE_EPOCH" (see
+    https://reproducible-builds.org/specs/source-date-epoch/).
+    """
+    return int(os.getenv('SOURCE_DATE_EPOCH', '0'))
+
+
+def _get_stamp(entry: tp.Tuple[int, int, str], content_hash: bool) -> str:
+    if content_hash or entry[1] < 0:  # `entry[1] < 0`: read from RECORD.
+        return '{}-{}'.format(entry[0], entry[2])
+    return '{}-{}'.format(entry[0], entry[1])
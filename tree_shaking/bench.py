@@ -0,0 +1,304 @@
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import typing as tp
+from statistics import median
+
+from lk_utils import fs
+
+from . import archive
+from .config import T as T0
+from .config import parse_config
+
+
+class T(T0):
+    Variant = tp.Literal['original', 'shaken']
+    Run = tp.TypedDict(
+        'Run',
+        {
+            'wall_ms': float,
+            'import_us': int,
+            'rss_kb': tp.Optional[int],
+            'opens': int,
+            'listdirs': int,
+            'stats': int,
+            'modules': tp.Dict[str, int],
+        },
+    )
+    #   wall_ms: wall-clock time of the subprocess, including the interpreter
+    #       startup.
+    #   import_us: sum of the "self" import times.
+    #   rss_kb: peak resident set size. None if the platform is not supported.
+    #   opens: 'open' audit events, the files opened by python code and the
+    #       import system.
+    #   listdirs: 'os.listdir' and 'os.scandir' audit events.
+    #   stats: stat calls made by the import system (the path finders).
+    #   modules: {module: cumulative_us, ...}
+    #       parsed from `-X importtime`.
+    Summary = tp.Dict[str, tp.Optional[float]]
+    #   median of each numeric field in `Run`.
+    Report = tp.TypedDict(
+        'Report',
+        {
+            'python': str,
+            'runs': int,
+            'entries': tp.Dict[
+                str,
+                tp.TypedDict(  # ty: ignore
+                    'EntryReport',
+                    {
+                        'original': Summary,
+                        'shaken': Summary,
+                        'delta': Summary,
+                        'modules': tp.Dict[str, Summary],
+                    },
+                ),
+            ],
+        },
+    )
+    #   entries: {relpath: entry_report, ...}
+    #       delta: shaken - original.
+    #       modules: {module: {'original': us, 'shaken': us, 'delta': us}}
+    #           median cumulative import time of each module. a module that
+    #           is missing in one variant has None there.
+
+
+def bench(
+    config_file: str,
+    runs: int = 5,
+    output: str = '',
+    run_main: bool = False,
+    target: str = '',
+) -> T.Report:
+    """
+    compare the startup of each entry between the original search paths and
+    the exported tree.
+    each entry is run in a fresh interpreter (`-X importtime -E -S`), the
+    variants are interleaved run by run, a warm-up run of each variant is
+    discarded. for the shaken variant, the export source in search paths is
+    replaced by the export target. with `-S`, the interpreter's own
+    site-packages and ".pth" files are not loaded, only the given search
+    paths and the standard library are visible.
+    params:
+        runs (-n):
+        output (-o): a json file to save the report. if not given, print it.
+        run_main (-m): run entries as "__main__". by default the entry is
+            executed under another name, so the `if __name__ == '__main__'`
+            block is skipped and only the startup (imports) is measured.
+        target (-t): the exported tree to compare with. defaults to the
+            export target of the config.
+    """
+    cfg = parse_config(config_file)
+    source = cfg['export']['source']
+    target = fs.abspath(target) if target else cfg['export']['target']
+    assert source and target, 'export source and target are required'
+    assert fs.exist(target), ('export the tree before benchmarking', target)
+    if archive.is_archive(target):
+        raise NotImplementedError(
+            'benchmarking an archive is not supported', target
+        )
+
+    # `config.parse_config` stores search paths in reversed order.
+    original = list(reversed(cfg['search_paths']))
+    shaken = [target if p == source else p for p in original]
+
+    report: T.Report = {'python': sys.version, 'runs': runs, 'entries': {}}
+    for entry in cfg['entries']:
+        relpath = fs.relpath(entry, cfg['root'])
+        print('bench {}'.format(relpath), ':i')
+        results = {'original': [], 'shaken': []}
+        for i in range(runs + 1):
+            for variant, paths in (('original', original), ('shaken', shaken)):
+                x = _run(entry, paths, run_main, cfg['root'])
+                if i > 0:
+                    results[variant].append(x)
+        report['entries'][relpath] = _summarize(
+            results['original'], results['shaken']
+        )
+        a = report['entries'][relpath]['original']
+        b = report['entries'][relpath]['shaken']
+        print(
+            ':v2',
+            'wall: {:.1f} -> {:.1f} ms, import: {} -> {} us, '
+            'opens: {} -> {}, stats: {} -> {}'.format(
+                a['wall_ms'],
+                b['wall_ms'],
+                a['import_us'],
+                b['import_us'],
+                a['opens'],
+                b['opens'],
+                a['stats'],
+                b['stats'],
+            ),
+        )
+
+    if output:
+        fs.dump(report, output)
+        print('saved report to {}'.format(output), ':v4')
+    else:
+        sys.stdout.write(json.dumps(report, indent=2) + '\n')
+    return report
+
+
+# ------------------------------------------------------------------------------
+
+# runs in the child interpreter. it imports nothing before the entry runs, so
+# the import times and counters of the entry are not shifted by it.
+_BOOTSTRAP = """
+import sys
+entry, paths, name, report = sys.argv[1:5]
+sys.path[:] = [entry.rsplit('/', 1)[0], *paths.split('\\n'), *sys.path[1:]]
+sys.argv = [entry]
+with open(entry, 'rb') as f:
+    code = compile(f.read(), entry, 'exec')
+counts = {'opens': 0, 'listdirs': 0, 'stats': 0}
+def _hook(event, args):
+    if event == 'open':
+        counts['opens'] += 1
+    elif event == 'os.listdir' or event == 'os.scandir':
+        counts['listdirs'] += 1
+_ext = sys.modules['_frozen_importlib_external']
+_path_stat = _ext._path_stat
+def _counted_path_stat(path):
+    counts['stats'] += 1
+    return _path_stat(path)
+_ext._path_stat = _counted_path_stat
+sys.addaudithook(_hook)
+try:
+    exec(code, {'__name__': name, '__file__': entry})
+except SystemExit:
+    pass
+finally:
+    _ext._path_stat = _path_stat
+    snapshot = dict(counts)
+    sys.stderr.write('-- bench end --\\n')
+    sys.stderr.flush()
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+except ImportError:
+    import ctypes
+    from ctypes import wintypes
+    class _Counters(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD),
+            ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+    c = _Counters()
+    c.cb = ctypes.sizeof(c)
+    ok = ctypes.windll.psapi.GetProcessMemoryInfo(
+        ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(c), c.cb
+    )
+    rss = c.PeakWorkingSetSize // 1024 if ok else None
+snapshot['rss_kb'] = rss
+with open(report, 'w') as f:
+    f.write(repr(snapshot))
+"""
+
+_FIELDS = ('wall_ms', 'import_us', 'rss_kb', 'opens', 'listdirs', 'stats')
+_IMPORTTIME = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(\S.*)$')
+
+
+def _run(
+    entry: T.NormPath,
+    paths: tp.List[T.NormPath],
+    run_main: bool,
+    cwd: T.NormPath,
+) -> T.Run:
+    with tempfile.TemporaryDirectory() as tmp:
+        report_file = '{}/report.txt'.format(tmp)
+        start = time.perf_counter()
+        proc = subprocess.run(
+            (
+                sys.executable,
+                '-X',
+                'importtime',
+                '-E',
+                '-S',
+                '-c',
+                _BOOTSTRAP,
+                entry,
+                '\n'.join(paths),
+                '__main__' if run_main else '__bench__',
+                report_file,
+            ),
+            cwd=cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        wall = (time.perf_counter() - start) * 1000
+        if proc.returncode != 0 or not os.path.exists(report_file):
+            raise Exception(
+                'entry failed to run', entry, proc.returncode, proc.stderr
+            )
+        with open(report_file) as f:
+            counts = ast.literal_eval(f.read())
+
+    modules = {}
+    import_us = 0
+    for line in proc.stderr.splitlines():
+        if line == '-- bench end --':
+            break
+        if m := _IMPORTTIME.match(line):
+            import_us += int(m.group(1))
+            modules[m.group(3)] = int(m.group(2))
+    return {
+        'wall_ms': wall,
+        'import_us': import_us,
+        'rss_kb': counts['rss_kb'],
+        'opens': counts['opens'],
+        'listdirs': counts['listdirs'],
+        'stats': counts['stats'],
+        'modules': modules,
+    }
+
+
+def _summarize(
+    original: tp.List[T.Run], shaken: tp.List[T.Run]
+) -> tp.Dict[str, tp.Any]:
+    def summary(runs: tp.List[T.Run]) -> T.Summary:
+        out = {}
+        for k in _FIELDS:
+            values = [x[k] for x in runs if x[k] is not None]
+            out[k] = median(values) if values else None
+        return out
+
+    def delta(
+        a: tp.Optional[float], b: tp.Optional[float]
+    ) -> tp.Optional[float]:
+        return None if a is None or b is None else b - a
+
+    a = summary(original)
+    b = summary(shaken)
+    modules = {}
+    names = dict.fromkeys(
+        m for runs in (original, shaken) for x in runs for m in x['modules']
+    )
+    for m in names:
+        x = [r['modules'][m] for r in original if m in r['modules']]
+        y = [r['modules'][m] for r in shaken if m in r['modules']]
+        x = median(x) if x else None
+        y = median(y) if y else None
+        modules[m] = {'original': x, 'shaken': y, 'delta': delta(x, y)}
+    return {
+        'original': a,
+        'shaken': b,
+        'delta': {k: delta(a[k], b[k]) for k in a},
+        'modules': modules,
+    }
@@ -1,10 +1,18 @@
 import atexit
+import hashlib
 import os
+import pickle
+import sqlite3
+import time
 import typing as tp
+import zlib
+from collections import defaultdict
 
 from lk_utils import fs
 from lk_utils import uuid
 
+from .instrument import instrument
+
 
 class T:
     RevisionNumber = str
@@ -18,9 +26,59 @@ class T:
     #   file path, and ':2' for directory path.
     #   trick: if you mark a dir path with ':1', it will read the folder mtime
     #   instead of recursively reading all subfiles' mtimes.
+    #   the revision of ':1' and ':2' factors is mtime based by default, it
+    #   can be switched to content hash based, see `T.RevisionStrategy`.
     #   see also `_CacheMaker:_parse_source_factors`.
     AnySourceFactors = tp.Union[SourceFactor, tp.Iterable[SourceFactor]]
     SourceId = str
+    Thread = str
+    Key = tp.Tuple[SourceId, Thread]
+    RevisionStrategy = tp.Literal['mtime', 'hash']
+    #   mtime: modification time. (recursive max mtime for ':2' factors.)
+    #   hash: content hash. for ':1' files, size + blake2b digest; for ':1'
+    #       dirs, digest of the entry names; for ':2' dirs, digest of all
+    #       relative paths and file digests.
+    #       it survives fresh checkouts and container rebuilds which reset
+    #       mtimes. digests are memoized per (inode, size, mtime), so an
+    #       unchanged file is hashed only once.
+    Backend = tp.Literal['files', 'sqlite']
+    #   files: one pickle file per key, `<cache_root>/watch_files/<source_id>
+    #       /<thread>.pkl`.
+    #   sqlite: all keys in one database, `<cache_root>/watch_files.db`.
+    EvictionPolicy = tp.TypedDict(
+        'EvictionPolicy', {'max_size': int, 'ttl': float, 'interval': float}
+    )
+    #   max_size: bytes. the least recently used entries are evicted until
+    #       the total size is under it. 0 means no limit.
+    #   ttl: days. entries not used for longer are evicted. 0 means no limit.
+    #   interval: days. the automatic eviction (at exit) runs at most once in
+    #       it.
+    ThreadStats = tp.TypedDict(
+        'ThreadStats',
+        {
+            'entries': int,
+            'bytes': int,
+            'hits': int,
+            'misses': int,
+            'last_access': float,
+        },
+    )
+    #   hits, misses: accumulated over all runs since the ledger is created.
+    #   last_access: unix time, 0 if unknown.
+    GcResult = tp.TypedDict(
+        'GcResult',
+        {'entries': int, 'bytes': int, 'evicted': int, 'evicted_bytes': int},
+    )
+    #   entries, bytes: before eviction.
+    VerifyResult = tp.Dict[
+        tp.Literal['ok', 'stale', 'orphaned', 'broken', 'untracked'], int
+    ]
+    #   stale: its revision doesn't match the source factors any more, it
+    #       will miss.
+    #   orphaned: a file or directory of its source factors is gone.
+    #   broken: cannot be loaded.
+    #   untracked: not in the ledger (e.g. written by an old version), its
+    #       source factors are unknown.
 
 
 def _init_cache_root() -> str:
@@ -45,54 +103,508 @@ cache_root = _init_cache_root()
 
 # ------------------------------------------------------------------------------
 
-_CACHE_VERSION = '0'
+_CACHE_VERSION = '2'
 #   a simple string of digit, if we change it (usually increment it), all
 #   existing cache files will be invalidated.
 #   TODO: we may remove `_CacheMaker.invalidate_cache` method, and use this
 #   mechanism instead.
 
 
+class _FileStore:
+    def __init__(self, cache_root: str) -> None:
+        self._root = '{}/watch_files'.format(cache_root)
+
+    def locate(self, key: T.Key) -> str:
+        return '{}/{}/{}.pkl'.format(self._root, *key)
+
+    def load(
+        self, key: T.Key
+    ) -> tp.Optional[tp.Tuple[T.RevisionNumber, tp.Any]]:
+        if fs.exist(file := self.locate(key)):
+            return fs.load(file)
+        return None
+
+    def load_many(
+        self, keys: tp.Iterable[T.Key]
+    ) -> tp.Dict[T.Key, tp.Tuple[T.RevisionNumber, tp.Any]]:
+        return {k: x for k in keys if (x := self.load(k)) is not None}
+
+    def dump(self, key: T.Key, revision: T.RevisionNumber, data: tp.Any) -> str:
+        file = self.locate(key)
+        if not fs.exist(fs.parent(file)):
+            fs.make_dir(fs.parent(file))
+        fs.dump((revision, data), file)
+        return file
+
+    def delete(self, key: T.Key) -> None:
+        if fs.exist(file := self.locate(key)):
+            fs.remove(file)
+            try:
+                # the last entry of the source, don't leave an empty folder.
+                os.rmdir(fs.parent(file))
+            except OSError:
+                pass
+
+    def keys(self) -> tp.Iterator[T.Key]:
+        for d in fs.find_dirs(self._root):
+            for f in fs.find_files(d.path, '.pkl'):
+                yield d.name, f.stem
+
+    def scan(self) -> tp.Iterator[tp.Tuple[T.Key, int, tp.Optional[float]]]:
+        """
+        yields `(key, size, mtime)` of all entries.
+        """
+        with os.scandir(self._root) as it0:
+            for d in it0:
+                if not d.is_dir():
+                    continue
+                with os.scandir(d.path) as it1:
+                    for f in it1:
+                        if f.name.endswith('.pkl'):
+                            st = f.stat()
+                            yield (
+                                (d.name, f.name[:-4]),
+                                st.st_size,
+                                st.st_mtime,
+                            )
+
+    def size(self, key: T.Key) -> int:
+        return os.path.getsize(self.locate(key))
+
+    def compact(self) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+
+_DELETED = object()
+#   a pending delete in `_SqliteStore`. the cached data itself may be None.
+
+
+class _SqliteStore:
+    """
+    all cache entries in one database file, to avoid tens of thousands of tiny
+    files under "watch_files".
+    writes are buffered and committed in batches (also at exit). values can
+    be compressed with zlib.
+    """
+
+    _BATCH_SIZE = 500
+
+    def __init__(self, cache_root: str, compress_level: int = 0) -> None:
+        self._compress_level = compress_level
+        self._conn = None
+        self._db = '{}/watch_files.db'.format(cache_root)
+        self._pending = {}
+        #   {key: (revision, data) or _DELETED, ...}
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # connect lazily. worker processes (see `Finder.prefetch`) don't
+            # touch the cache.
+            self._conn = sqlite3.connect(self._db)
+            self._conn.execute('pragma journal_mode = wal')
+            self._conn.execute('pragma synchronous = normal')
+            self._conn.execute(
+                'create table if not exists caches ('
+                '   source_id text,'
+                '   thread text,'
+                '   revision text,'
+                '   compressed integer,'
+                '   data blob,'
+                '   primary key (source_id, thread)'
+                ') without rowid'
+            )
+        return self._conn
+
+    def locate(self, key: T.Key) -> str:
+        return '{}#{}/{}'.format(self._db, *key)
+
+    def load(
+        self, key: T.Key
+    ) -> tp.Optional[tp.Tuple[T.RevisionNumber, tp.Any]]:
+        return self.load_many((key,)).get(key)
+
+    def load_many(
+        self, keys: tp.Iterable[T.Key]
+    ) -> tp.Dict[T.Key, tp.Tuple[T.RevisionNumber, tp.Any]]:
+        out = {}
+        todo = []
+        for k in keys:
+            if k in self._pending:
+                if self._pending[k] is not _DELETED:
+                    out[k] = self._pending[k]
+            else:
+                todo.append(k)
+        for i in range(0, len(todo), 400):
+            chunk = todo[i : i + 400]
+            for (
+                source_id,
+                thread,
+                revision,
+                compressed,
+                data,
+            ) in self.conn.execute(
+                'select source_id, thread, revision, compressed, data '
+                'from caches where {}'.format(
+                    ' or '.join(
+                        ('(source_id = ? and thread = ?)',) * len(chunk)
+                    )
+                ),
+                tuple(x for k in chunk for x in k),
+            ):
+                out[(source_id, thread)] = (
+                    revision,
+                    pickle.loads(zlib.decompress(data) if compressed else data),
+                )
+        return out
+
+    def dump(self, key: T.Key, revision: T.RevisionNumber, data: tp.Any) -> str:
+        self._pending[key] = (revision, data)
+        if len(self._pending) >= self._BATCH_SIZE:
+            self.flush()
+        return self.locate(key)
+
+    def delete(self, key: T.Key) -> None:
+        self._pending[key] = _DELETED
+
+    def keys(self) -> tp.Iterator[T.Key]:
+        self.flush()
+        yield from self.conn.execute('select source_id, thread from caches')
+
+    def scan(self) -> tp.Iterator[tp.Tuple[T.Key, int, tp.Optional[float]]]:
+        """
+        yields `(key, size, None)` of all entries. the mtime is unknown.
+        """
+        self.flush()
+        for source_id, thread, size in self.conn.execute(
+            'select source_id, thread, length(data) from caches'
+        ):
+            yield (source_id, thread), size, None
+
+    def size(self, key: T.Key) -> int:
+        self.flush()
+        for (x,) in self.conn.execute(
+            'select length(data) from caches where source_id = ? and '
+            'thread = ?',
+            key,
+        ):
+            return x
+        raise KeyError(key)
+
+    def compact(self) -> None:
+        self.flush()
+        self.conn.execute('vacuum')
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        upserts = []
+        deletes = []
+        for key, x in self._pending.items():
+            if x is _DELETED:
+                deletes.append(key)
+            else:
+                revision, data = x
+                blob = pickle.dumps(data)
+                if self._compress_level:
+                    blob = zlib.compress(blob, self._compress_level)
+                upserts.append(
+                    (*key, revision, 1 if self._compress_level else 0, blob)
+                )
+        with self.conn:
+            self.conn.executemany(
+                'insert or replace into caches values (?, ?, ?, ?, ?)', upserts
+            )
+            self.conn.executemany(
+                'delete from caches where source_id = ? and thread = ?', deletes
+            )
+        self._pending.clear()
+
+
+class _ContentHasher:
+    def __init__(self, cache_root: str) -> None:
+        self._dirty = False
+        self._file = '{}/content_hashes.pkl'.format(cache_root)
+        self._memo = None
+        #   {path: (inode, size, mtime_ns, digest), ...}
+
+    def hash_file(self, path: str) -> str:
+        if self._memo is None:
+            self._memo = fs.load(self._file) if fs.exist(self._file) else {}
+        st = os.stat(path)
+        stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if (x := self._memo.get(path)) and x[:3] == stamp:
+            return x[3]
+        with open(path, 'rb') as f:
+            digest = hashlib.file_digest(
+                f, lambda: hashlib.blake2b(digest_size=16)
+            ).hexdigest()
+        digest = '{}-{}'.format(st.st_size, digest)
+        self._memo[path] = (*stamp, digest)
+        self._dirty = True
+        return digest
+
+    def hash_dir(self, path: str, recursive: bool) -> str:
+        hasher = hashlib.blake2b(digest_size=16)
+        if recursive:
+            for f in sorted(fs.findall_files(path), key=lambda x: x.relpath):
+                hasher.update(
+                    '{}:{};'.format(f.relpath, self.hash_file(f.path)).encode()
+                )
+        else:
+            for name in sorted(os.listdir(path)):
+                hasher.update((name + ';').encode())
+        return hasher.hexdigest()
+
+    def save(self) -> None:
+        if self._dirty:
+            fs.dump(self._memo, self._file)
+            self._dirty = False
+
+
+class _Ledger:
+    """
+    bookkeeping of cache entries for eviction and statistics, in
+    "<cache_root>/cache_ledger.db":
+        - the source factors and the last access time of each entry.
+        - the hits and misses of each thread.
+    accesses are collected in memory and written at exit (`flush`). the
+    entries which are not in the ledger, e.g. written by an old version, are
+    adopted by `_CacheMaker.collect_garbage`.
+    """
+
+    def __init__(self, cache_root: str) -> None:
+        self._accessed = {}
+        #   {key: atime, ...}
+        self._conn = None
+        self._counts = defaultdict(lambda: [0, 0])
+        #   {thread: [hits, misses], ...}
+        self._db = '{}/cache_ledger.db'.format(cache_root)
+        self._deleted = set()
+        self._saved = {}
+        #   {key: factors, ...}
+        #       factors: source factors joined by line breaks.
+
+    @property
+    def active(self) -> bool:
+        """
+        if anything is recorded since the last flush.
+        """
+        return bool(self._accessed or self._counts or self._deleted)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # connect lazily, like `_SqliteStore`.
+            self._conn = sqlite3.connect(self._db, timeout=30)
+            self._conn.execute('pragma journal_mode = wal')
+            self._conn.execute(
+                'create table if not exists entries ('
+                '   source_id text,'
+                '   thread text,'
+                '   factors text,'
+                '   atime real,'
+                '   primary key (source_id, thread)'
+                ') without rowid'
+            )
+            self._conn.execute(
+                'create table if not exists threads ('
+                '   thread text primary key,'
+                '   hits integer,'
+                '   misses integer'
+                ')'
+            )
+        return self._conn
+
+    def hit(self, key: T.Key) -> None:
+        self._accessed[key] = time.time()
+        self._counts[key[1]][0] += 1
+
+    def miss(self, thread: T.Thread) -> None:
+        self._counts[thread][1] += 1
+
+    def save(self, key: T.Key, factors: tp.Iterable[T.SourceFactor]) -> None:
+        self._accessed[key] = time.time()
+        self._saved[key] = '\n'.join(factors)
+        self._deleted.discard(key)
+
+    def delete(self, key: T.Key) -> None:
+        self._accessed.pop(key, None)
+        self._saved.pop(key, None)
+        self._deleted.add(key)
+
+    def adopt(self, atimes: tp.Dict[T.Key, float]) -> None:
+        """
+        add entries with unknown source factors.
+        """
+        with self.conn:
+            self.conn.executemany(
+                'insert or ignore into entries values (?, ?, null, ?)',
+                ((*k, v) for k, v in atimes.items()),
+            )
+
+    def entries(self) -> tp.Dict[T.Key, tp.Tuple[tp.Optional[str], float]]:
+        """
+        `{key: (factors, atime), ...}`, factors may be None.
+        """
+        self.flush()
+        return {
+            (source_id, thread): (factors, atime)
+            for source_id, thread, factors, atime in self.conn.execute(
+                'select source_id, thread, factors, atime from entries'
+            )
+        }
+
+    def threads(self) -> tp.Dict[T.Thread, tp.Tuple[int, int]]:
+        """
+        `{thread: (hits, misses), ...}`
+        """
+        self.flush()
+        return {
+            thread: (hits, misses)
+            for thread, hits, misses in self.conn.execute(
+                'select thread, hits, misses from threads'
+            )
+        }
+
+    def flush(self) -> None:
+        if not self.active:
+            return
+        with self.conn:
+            self.conn.executemany(
+                'insert into entries values (?, ?, ?, ?) '
+                'on conflict (source_id, thread) do update set '
+                '   factors = coalesce(excluded.factors, factors),'
+                '   atime = excluded.atime',
+                (
+                    (*k, self._saved.get(k), v)
+                    for k, v in self._accessed.items()
+                ),
+            )
+            self.conn.executemany(
+                'delete from entries where source_id = ? and thread = ?',
+                self._deleted,
+            )
+            self.conn.executemany(
+                'insert into threads values (?, ?, ?) '
+                'on conflict (thread) do update set '
+                '   hits = hits + excluded.hits,'
+                '   misses = misses + excluded.misses',
+                ((k, *v) for k, v in self._counts.items()),
+            )
+        self._accessed.clear()
+        self._counts.clear()
+        self._deleted.clear()
+        self._saved.clear()
+
+
+def _init_eviction_policy() -> T.EvictionPolicy:
+    """
+    environment variables:
+        TREE_SHAKING_CACHE_MAX_SIZE: e.g. '500M', '2G'. see `_parse_size`.
+        TREE_SHAKING_CACHE_TTL: days.
+        TREE_SHAKING_CACHE_GC_INTERVAL: days, default 1.
+    if neither max size nor ttl is set, entries are not evicted
+    automatically. see also `T.EvictionPolicy`.
+    """
+    return {
+        'max_size': _parse_size(os.getenv('TREE_SHAKING_CACHE_MAX_SIZE', '')),
+        'ttl': float(os.getenv('TREE_SHAKING_CACHE_TTL', '') or 0),
+        'interval': float(os.getenv('TREE_SHAKING_CACHE_GC_INTERVAL', '') or 1),
+    }
+
+
+def _init_revision_strategies() -> tp.Dict[str, T.RevisionStrategy]:
+    """
+    environment variable `TREE_SHAKING_CACHE_REVISION`:
+        'mtime' (default) or 'hash' for all factor types, or per type, e.g.
+        'file=hash,dir=mtime'. 'file' is for ':1' factors, 'dir' for ':2'.
+    """
+    out: tp.Dict[str, T.RevisionStrategy] = {':1': 'mtime', ':2': 'mtime'}
+    raw = os.getenv('TREE_SHAKING_CACHE_REVISION', '')
+    for item in filter(None, raw.split(',')):
+        if '=' in item:
+            k, v = item.split('=')
+            out[{'file': ':1', 'dir': ':2'}[k.strip()]] = v.strip()
+        else:
+            out[':1'] = out[':2'] = item.strip()  # type: ignore
+    assert all(v in ('mtime', 'hash') for v in out.values()), out
+    return out
+
+
+def _init_store(cache_root: str) -> tp.Union[_FileStore, _SqliteStore]:
+    """
+    environment variables:
+        TREE_SHAKING_CACHE_BACKEND: 'files' (default) or 'sqlite'.
+        TREE_SHAKING_CACHE_COMPRESS: zlib level 0-9 for 'sqlite' backend.
+            0 (default) means no compression.
+    """
+    backend: T.Backend = os.getenv(  # type: ignore
+        'TREE_SHAKING_CACHE_BACKEND', 'files'
+    )
+    if backend == 'files':
+        return _FileStore(cache_root)
+    elif backend == 'sqlite':
+        return _SqliteStore(
+            cache_root, int(os.getenv('TREE_SHAKING_CACHE_COMPRESS', '0'))
+        )
+    else:
+        raise ValueError('unknown cache backend', backend)
+
+
 class _CacheMaker:
     def __init__(self, cache_root: str) -> None:
         self._bad_mode = False
         self._cache_root = cache_root
+        self._hasher = _ContentHasher(cache_root)
+        self._ledger = _Ledger(cache_root)
         self._quick_fetches = {}
-        self._sanitized_files = set()
-        self._tobe_deleted_files = set()
-        atexit.register(self._delete_outdated_files)
+        self._revision_strategies = _init_revision_strategies()
+        self._sanitized_keys = set()
+        self._store = _init_store(cache_root)
+        self._tobe_deleted_keys = set()
+        atexit.register(self._on_exit)
 
+    @instrument.timed('cache')
     def is_cached(
         self, source_factors: T.AnySourceFactors, thread: str
     ) -> bool:
         source_id, revision = self._parse_source_factors(source_factors)
-        file = '{}/watch_files/{}/{}.pkl'.format(
-            self._cache_root, source_id, thread
-        )
-        if file in self._tobe_deleted_files:
-            return False
-        elif self._bad_mode and file not in self._sanitized_files:
-            return False
-        else:
-            file = '{}/watch_files/{}/{}.pkl'.format(
-                self._cache_root, source_id, thread
-            )
-            if fs.exist(file):
-                last_revision = fs.load(file)[0]
-                if last_revision == revision:
-                    return True
-                else:
-                    self._tobe_deleted_files.add(file)
-                    return False
-            else:
-                return False
+        if self._load(key := (source_id, thread), revision) is not None:
+            self._ledger.hit(key)
+            return True
+        self._ledger.miss(thread)
+        return False
+
+    def set_revision_strategy(
+        self,
+        file: tp.Optional[T.RevisionStrategy] = None,
+        dir: tp.Optional[T.RevisionStrategy] = None,
+    ) -> None:
+        """
+        file: for ':1' factors.
+        dir: for ':2' factors.
+        notice: switching strategy changes all revisions, existing cache
+        entries of that factor type will miss once.
+        """
+        if file:
+            assert file in ('mtime', 'hash')
+            self._revision_strategies[':1'] = file
+        if dir:
+            assert dir in ('mtime', 'hash')
+            self._revision_strategies[':2'] = dir
 
     def invalidate_cache(self) -> None:
         """
         mark all existing cache files invalid.
         """
         self._bad_mode = True
-        self._sanitized_files.clear()
+        self._sanitized_keys.clear()
 
+    @instrument.timed('cache')
     def get_cache(
         self,
         source_factors: T.AnySourceFactors,
@@ -105,29 +617,64 @@ class _CacheMaker:
         you should not use generic `if data: ...` to check it.
         """
         source_id, revision = self._parse_source_factors(source_factors)
+        key = (source_id, thread)
+        if persistent and key in self._quick_fetches:
+            instrument.count_cache(thread, True)
+            self._ledger.hit(key)
+            return self._quick_fetches[key]
+        if (x := self._load(key, revision)) is not None:
+            instrument.count_cache(thread, True)
+            self._ledger.hit(key)
+            if persistent:
+                self._quick_fetches[key] = x[0]
+            return x[0]
+        instrument.count_cache(thread, False)
+        self._ledger.miss(thread)
+        return None
 
-        if persistent and (source_id, thread) in self._quick_fetches:
-            return self._quick_fetches[(source_id, thread)]
-
-        file = '{}/watch_files/{}/{}.pkl'.format(
-            self._cache_root, source_id, thread
-        )
-        if file in self._tobe_deleted_files:
-            return None
-        if self._bad_mode and file not in self._sanitized_files:
-            return None
-        if fs.exist(file):
-            last_revision, data = fs.load(file)
-            if last_revision == revision:
+    @instrument.timed('cache')
+    def get_many_caches(
+        self,
+        many_source_factors: tp.Iterable[T.AnySourceFactors],
+        thread: str,
+        persistent: bool = False,
+    ) -> tp.List[tp.Optional[tp.Any]]:
+        """
+        batched version of `get_cache`. the returned list is in the same
+        order as `many_source_factors`.
+        """
+        parsed = tuple(map(self._parse_source_factors, many_source_factors))
+        todo = []
+        for source_id, _ in parsed:
+            key = (source_id, thread)
+            if persistent and key in self._quick_fetches:
+                continue
+            if key in self._tobe_deleted_keys:
+                continue
+            if self._bad_mode and key not in self._sanitized_keys:
+                continue
+            todo.append(key)
+        found = self._store.load_many(todo)
+        out = []
+        for source_id, revision in parsed:
+            key = (source_id, thread)
+            if persistent and key in self._quick_fetches:
+                self._ledger.hit(key)
+                out.append(self._quick_fetches[key])
+            elif (x := self._check(key, revision, found.get(key))) is not None:
+                self._ledger.hit(key)
                 if persistent:
-                    self._quick_fetches[(source_id, thread)] = data
-                return data
+                    self._quick_fetches[key] = x[0]
+                out.append(x[0])
             else:
-                self._tobe_deleted_files.add(file)
-                return None
-        else:
-            return None
+                self._ledger.miss(thread)
+                out.append(None)
+        if instrument.enabled:
+            for x in out:
+                instrument.count_cache(thread, x is not None)
+        return out
 
+    @instrument.timed('cache')
     def save_cache(
         self,
         source_factors: T.AnySourceFactors,
@@ -135,31 +682,256 @@ class _CacheMaker:
         data: tp.Any,
         persistent: bool = False,
     ) -> str:
+        """
+        returns the location of saved entry, for display only.
+        """
         source_id, revision = self._parse_source_factors(source_factors)
-        file = '{}/watch_files/{}/{}.pkl'.format(
-            self._cache_root, source_id, thread
+        key = (source_id, thread)
+        location = self._store.dump(key, revision, data)
+        self._ledger.save(
+            key,
+            (source_factors,)
+            if isinstance(source_factors, str)
+            else source_factors,
         )
-        if not fs.exist(fs.parent(file)):
-            fs.make_dir(fs.parent(file))
-        fs.dump((revision, data), file)
         if self._bad_mode:
-            self._sanitized_files.add(file)
-        if file in self._tobe_deleted_files:
-            self._tobe_deleted_files.remove(file)
+            self._sanitized_keys.add(key)
+        self._tobe_deleted_keys.discard(key)
         if persistent:
-            self._quick_fetches[(source_id, thread)] = data
-        return file
+            self._quick_fetches[key] = data
+        return location
+
+    def delete_cache(
+        self, source_factors: T.AnySourceFactors, thread: str
+    ) -> None:
+        """
+        mark the entry outdated, it will be removed at exit.
+        """
+        key = (self._get_source_id(source_factors), thread)
+        self._quick_fetches.pop(key, None)
+        self._tobe_deleted_keys.add(key)
+
+    def collect_garbage(
+        self, max_size: int = 0, ttl: float = 0, dry_run: bool = False
+    ) -> T.GcResult:
+        """
+        evict the entries not used for `ttl` days, then the least recently
+        used ones until the total size is under `max_size` bytes. 0 means no
+        limit.
+        the entries unknown to the ledger are adopted, their last access time
+        is taken from the file mtime ('files' backend) or now ('sqlite').
+        """
+        self._flush()
+        now = time.time()
+        known = self._ledger.entries()
+        adopted = {}
+        rows = []
+        for key, size, mtime in self._store.scan():
+            if key in known:
+                atime = known[key][1]
+            else:
+                atime = adopted[key] = mtime or now
+            rows.append((atime, key, size))
+        rows.sort()
+        total = sum(x[2] for x in rows)
+        out: T.GcResult = {
+            'entries': len(rows),
+            'bytes': total,
+            'evicted': 0,
+            'evicted_bytes': 0,
+        }
+        evicted = []
+        for atime, key, size in rows:
+            if (ttl and atime < now - ttl * 86400) or (
+                max_size and total > max_size
+            ):
+                evicted.append(key)
+                total -= size
+                out['evicted'] += 1
+                out['evicted_bytes'] += size
+            else:
+                break
+        if dry_run:
+            return out
+        for key in evicted:
+            self._quick_fetches.pop(key, None)
+            self._store.delete(key)
+            self._ledger.delete(key)
+            adopted.pop(key, None)
+        # the ones deleted by other means.
+        for key in known.keys() - {x[1] for x in rows}:
+            self._ledger.delete(key)
+        if adopted:
+            self._ledger.adopt(adopted)
+        self._flush()
+        if evicted:
+            self._store.compact()
+        return out
+
+    def get_stats(self) -> tp.Dict[T.Thread, T.ThreadStats]:
+        self._flush()
+        known = self._ledger.entries()
+        out = {}
+        for key, size, _ in self._store.scan():
+            if (x := out.get(key[1])) is None:
+                x = out[key[1]] = {
+                    'entries': 0,
+                    'bytes': 0,
+                    'hits': 0,
+                    'misses': 0,
+                    'last_access': 0.0,
+                }
+            x['entries'] += 1
+            x['bytes'] += size
+            if key in known:
+                x['last_access'] = max(x['last_access'], known[key][1])
+        for thread, (hits, misses) in self._ledger.threads().items():
+            if thread in out:
+                out[thread]['hits'] = hits
+                out[thread]['misses'] = misses
+        return dict(sorted(out.items()))
+
+    def verify(self, fix: bool = False) -> T.VerifyResult:
+        """
+        load every entry and check it against its source factors. see
+        `T.VerifyResult`.
+        params:
+            fix: delete the stale, orphaned and broken entries.
+        """
+        self._flush()
+        known = self._ledger.entries()
+        out = dict.fromkeys(
+            ('ok', 'stale', 'orphaned', 'broken', 'untracked'), 0
+        )
+        bad = []
+        for key, _, _ in self._store.scan():
+            try:
+                record = self._store.load(key)
+                assert isinstance(record, tuple) and len(record) == 2
+            except Exception as e:
+                print(':v6', 'broken cache entry', key, e)
+                out['broken'] += 1
+                bad.append(key)
+                continue
+            if (factors := known.get(key, (None,))[0]) is None:
+                out['untracked'] += 1
+                continue
+            factors = factors.split('\n')
+            if any(
+                not os.path.exists(x[:-2])
+                for x in factors
+                if x.endswith((':1', ':2'))
+            ):
+                out['orphaned'] += 1
+                bad.append(key)
+            elif self._parse_source_factors(factors)[1] != record[0]:
+                out['stale'] += 1
+                bad.append(key)
+            else:
+                out['ok'] += 1
+        if fix and bad:
+            for key in bad:
+                self._quick_fetches.pop(key, None)
+                self._store.delete(key)
+                self._ledger.delete(key)
+            self._flush()
+        return out
+
+    def get_size(self, source_factors: T.AnySourceFactors, thread: str) -> int:
+        return self._store.size((self._get_source_id(source_factors), thread))
+
+    def get_revision(self, factor: T.SourceFactor) -> str:
+        """
+        the revision of a single source factor, according to the revision
+        strategy of its type. raises `OSError` if the path doesn't exist.
+        """
+        path, type_ = factor[:-2], factor[-2:]
+        if type_ == ':0':
+            return path
+        if self._revision_strategies[type_] == 'mtime':
+            return str(fs.mtime(path, recursive=type_ == ':2'))
+        if type_ == ':1' and not os.path.isdir(path):
+            return self._hasher.hash_file(path)
+        return self._hasher.hash_dir(path, recursive=type_ == ':2')
+
+    def hash_file(self, path: str) -> str:
+        """
+        the content digest of a file, memoized by its inode, size and mtime.
+        """
+        return self._hasher.hash_file(path)
+
+    def _load(
+        self, key: T.Key, revision: T.RevisionNumber
+    ) -> tp.Optional[tp.Tuple[tp.Any]]:
+        """
+        returns a 1-tuple of data if hit, None if missed. (the data itself may
+        be None.)
+        """
+        if key in self._tobe_deleted_keys:
+            return None
+        if self._bad_mode and key not in self._sanitized_keys:
+            return None
+        return self._check(key, revision, self._store.load(key))
+
+    def _check(
+        self,
+        key: T.Key,
+        revision: T.RevisionNumber,
+        record: tp.Optional[tp.Tuple[T.RevisionNumber, tp.Any]],
+    ) -> tp.Optional[tp.Tuple[tp.Any]]:
+        if record is None:
+            return None
+        last_revision, data = record
+        if last_revision == revision:
+            return (data,)
+        self._tobe_deleted_keys.add(key)
+        return None
+
+    def _flush(self) -> None:
+        self._delete_outdated_files()
+        self._store.flush()
+        self._ledger.flush()
+
+    def _on_exit(self) -> None:
+        active = self._ledger.active
+        self._flush()
+        self._hasher.save()
+        if active:
+            # not in worker processes, which don't touch the cache.
+            self._evict_periodically()
+
+    def _evict_periodically(self) -> None:
+        policy = _init_eviction_policy()
+        if not (policy['max_size'] or policy['ttl']):
+            return
+        stamp = '{}/.last_gc'.format(self._cache_root)
+        if (
+            os.path.exists(stamp)
+            and time.time() - os.path.getmtime(stamp)
+            < policy['interval'] * 86400
+        ):
+            return
+        fs.dump('', stamp)
+        x = self.collect_garbage(policy['max_size'], policy['ttl'])
+        if x['evicted']:
+            print(
+                ':v',
+                'evicted {} cache entries ({})'.format(
+                    x['evicted'], fs.pretty_size(x['evicted_bytes'])
+                ),
+            )
 
     def _delete_outdated_files(self) -> None:
-        if self._tobe_deleted_files:
-            for file in self._tobe_deleted_files:
+        if self._tobe_deleted_keys:
+            for key in self._tobe_deleted_keys:
                 print(
                     ':v7i',
                     'remove outdated cache file',
-                    fs.relpath(file, self._cache_root),
+                    fs.relpath(self._store.locate(key), self._cache_root),
                 )
-                fs.remove(file)
-            self._tobe_deleted_files.clear()
+                self._store.delete(key)
+                self._ledger.delete(key)
+            self._tobe_deleted_keys.clear()
 
     def _parse_source_factors(
         self, factors: tp.Union[str, tp.Iterable[T.SourceFactor]]
@@ -167,25 +939,126 @@ class _CacheMaker:
         if isinstance(factors, str):
             factors = (factors,)
         assert all(x.endswith((':0', ':1', ':2')) for x in factors)
-        source_id = uuid(';'.join(x[:-2] for x in factors))
+        source_id = self._get_source_id(factors)
         revision = uuid(
-            ';'.join(
-                map(
-                    str,
-                    (
-                        x[:-2]
-                        if x.endswith(':0')
-                        else fs.mtime(x[:-2])
-                        if x.endswith(':1')
-                        else fs.mtime(x[:-2], recursive=True)
-                        for x in factors
-                    ),
-                )
-            )
-            + ';'
-            + _CACHE_VERSION
+            ';'.join(map(self.get_revision, factors)) + ';' + _CACHE_VERSION
         )
         return source_id, revision
 
+    @staticmethod
+    def _get_source_id(
+        factors: tp.Union[str, tp.Iterable[T.SourceFactor]],
+    ) -> T.SourceId:
+        if isinstance(factors, str):
+            factors = (factors,)
+        return uuid(';'.join(x[:-2] for x in factors))
+
 
 cache_maker = _CacheMaker(cache_root)
+
+
+def migrate_cache(compress_level: int = 0) -> None:
+    """
+    copy all entries from "watch_files" directory into "watch_files.db".
+    after migrating, set environment variable `TREE_SHAKING_CACHE_BACKEND` to
+    'sqlite' to use it. the old directory is kept, delete it manually.
+    """
+    src = _FileStore(cache_root)
+    dst = _SqliteStore(cache_root, compress_level)
+    count = 0
+    for key in src.keys():
+        if (x := src.load(key)) is not None:
+            dst.dump(key, *x)
+            count += 1
+    dst.flush()
+    print(
+        ':v4',
+        'migrated {} cache entries'.format(count),
+        '{}/watch_files.db'.format(cache_root),
+    )
+
+
+def manage_cache(
+    action: str,
+    max_size: str = '',
+    ttl: float = 0,
+    dry_run: bool = False,
+    fix: bool = False,
+) -> None:
+    """
+    params:
+        action: 'stats', 'gc' or 'verify'.
+            stats: entries, bytes and hit rates of each thread.
+            gc: evict entries by `max_size` and `ttl`, see
+                `_CacheMaker.collect_garbage`.
+            verify: check all entries against their sources, see
+                `_CacheMaker.verify`.
+        max_size (-s): for 'gc', e.g. '500M', '2G'. defaults to environment
+            variable `TREE_SHAKING_CACHE_MAX_SIZE`.
+        ttl (-t): for 'gc', days. defaults to environment variable
+            `TREE_SHAKING_CACHE_TTL`.
+        dry_run (-d): for 'gc', only tell what would be evicted.
+        fix: for 'verify', delete the stale, orphaned and broken entries.
+    """
+    if action == 'stats':
+        stats = cache_maker.get_stats()
+        print(':v2', 'cache root: {}'.format(cache_root))
+        for thread, x in stats.items():
+            print(
+                ':i2',
+                '{:<24} {:>9} entries {:>10} {:>7} hits{}'.format(
+                    thread,
+                    x['entries'],
+                    fs.pretty_size(x['bytes']),
+                    '{:.1%}'.format(x['hits'] / (x['hits'] + x['misses']))
+                    if x['hits'] + x['misses']
+                    else '-',
+                    time.strftime(
+                        '  (last used %Y-%m-%d)',
+                        time.localtime(x['last_access']),
+                    )
+                    if x['last_access']
+                    else '',
+                ),
+            )
+        print(
+            ':v2',
+            'total: {} entries, {}'.format(
+                sum(x['entries'] for x in stats.values()),
+                fs.pretty_size(sum(x['bytes'] for x in stats.values())),
+            ),
+        )
+    elif action == 'gc':
+        policy = _init_eviction_policy()
+        x = cache_maker.collect_garbage(
+            _parse_size(max_size) if max_size else policy['max_size'],
+            ttl or policy['ttl'],
+            dry_run,
+        )
+        print(
+            ':v4',
+            '{}{} of {} entries evicted, {} of {} freed'.format(
+                '[dry run] ' if dry_run else '',
+                x['evicted'],
+                x['entries'],
+                fs.pretty_size(x['evicted_bytes']),
+                fs.pretty_size(x['bytes']),
+            ),
+        )
+    elif action == 'verify':
+        x = cache_maker.verify(fix)
+        print(':v4' if x['ok'] == sum(x.values()) else ':v6', x)
+    else:
+        raise ValueError('unknown action', action)
+
+
+def _parse_size(text: str) -> int:
+    """
+    e.g. '1024', '500K', '500M', '2G', '1T'. the units are binary.
+    """
+    text = text.strip().upper().removesuffix('B')
+    if not text:
+        return 0
+    if text[-1] in 'KMGT':
+        return int(float(text[:-1]) * 1024 ** (' KMGT'.index(text[-1])))
+    return int(text)
@@ -3,7 +3,10 @@ from os.path import isabs as is_abspath
 
 from lk_utils import fs
 
+from . import dist_info
 from .cache import cache_maker
+from .dist_info import dist_index
+from .instrument import instrument
 from .path_scope import path_scope
 
 
@@ -19,6 +22,8 @@ class T:
     #       IPython     ipython
     #       lk-utils    lk_utils
     #       pillow      pil
+    ImportContext = tp.Literal['lazy', 'optional', 'type_checking']
+    #   see `scanner.T.Context`.
     NormPath = str  # absolute path.
     RelPath = str  # relative path, starts from `root`.
     SpecialPath = str  # '$venv' or `$venv/...`
@@ -30,6 +35,7 @@ class T:
             'search_paths': tp.List[tp.Union[RelPath, SpecialPath]],
             'entries': tp.List[RelPath],  # must ends with ".py"
             'ignores': tp.List[IgnoredName],
+            'exclude_imports': tp.List[ImportContext],
             'export': tp.Optional[
                 tp.TypedDict(  # ty: ignore
                     'ExportOption0',
@@ -48,6 +54,10 @@ class T:
     #       'entries': (script_path, ...),
     #       'ignores': (module_name, ...),
     #       #   module_name is case sensitive.
+    #       'exclude_imports': (import_context, ...),
+    #       #   the imports in these contexts are not followed. for example,
+    #       #   `['type_checking', 'optional']` drops the imports under
+    #       #   `if TYPE_CHECKING:` and in `try: ... except ImportError: ...`.
     #   }
 
     Config1 = tp.TypedDict(
@@ -57,6 +67,7 @@ class T:
             'search_paths': tp.List[NormPath],
             'entries': tp.Tuple[NormPath, ...],
             'ignores': tp.Union[tp.FrozenSet[str], tp.Tuple[str, ...]],
+            'exclude_imports': tp.FrozenSet[ImportContext],
             'export': tp.TypedDict(  # ty: ignore
                 'ExportOption1', {'source': NormPath, 'target': NormPath}
             ),
@@ -66,6 +77,7 @@ class T:
     Config = Config1
 
 
+@instrument.timed('config')
 def parse_config(file: str, **kwargs) -> T.Config:
     """
     file:
@@ -76,8 +88,17 @@ def parse_config(file: str, **kwargs) -> T.Config:
         /build/build_tool/_tree_shaking_model.yaml`.
     """
     cfg_file: str = fs.abspath(file)
-
-    if x := cache_maker.get_cache(cfg_file + ':1', 'config'):
+    dict0 = kwargs.get('export', {'source': '', 'target': ''})
+    overridden = bool(dict0['source'] or dict0['target'])
+
+    # an overridden config is neither taken from nor saved to the cache.
+    if not overridden and (
+        x := cache_maker.get_cache(cfg_file + ':1', 'config')
+    ):
+        # the cached config has scanned its search paths before, but the path
+        # scope lives in memory, restore it.
+        for p in x['search_paths']:
+            _add_search_path(p)
         return x
 
     cfg_dir: str = fs.parent(cfg_file)
@@ -87,6 +108,7 @@ def parse_config(file: str, **kwargs) -> T.Config:
         'search_paths': [],
         'entries': (),
         'ignores': (),
+        'exclude_imports': frozenset(),
         'export': {'source': '', 'target': ''},
     }
 
@@ -113,16 +135,19 @@ def parse_config(file: str, **kwargs) -> T.Config:
 
     for p in map(fmtpath, reversed(cfg0['search_paths'])):
         cfg1['search_paths'].append(p)
-        path_scope.add_scope(p)
+        _add_search_path(p)
 
     # 3
     cfg1['entries'] = tuple(map(fmtpath, cfg0['entries']))
 
     # 4
     cfg1['ignores'] = frozenset(cfg0.get('ignores', ()))
+    cfg1['exclude_imports'] = frozenset(cfg0.get('exclude_imports', ()))
+    assert cfg1['exclude_imports'] <= {'lazy', 'optional', 'type_checking'}, (
+        cfg1['exclude_imports']
+    )
 
     # 5
-    dict0 = kwargs.get('export', {'source': '', 'target': ''})
     dict1 = cfg0.get('export', {'source': '', 'target': ''})
     if src := (dict0['source'] or dict1['source']):  # type: ignore
         assert src in cfg0['search_paths']
@@ -135,10 +160,31 @@ def parse_config(file: str, **kwargs) -> T.Config:
         )
 
     # print(cfg1, ':ln')
-    cache_maker.save_cache(cfg_file + ':1', 'config', cfg1)
+    if not overridden:
+        cache_maker.save_cache(cfg_file + ':1', 'config', cfg1)
     return cfg1
 
 
+@instrument.timed('scope_scan')
+def _add_search_path(path: T.NormPath) -> None:
+    """
+    add `path` to `path_scope`.
+    the scanned snapshot is cached by the directory's own revision (not
+    recursive), it changes when a top-level module is added, removed or
+    renamed. so a warm start doesn't list the search path again, and only
+    the changed search paths are rescanned.
+    if `dist_info.enabled`, the kinds of the installed modules are read from
+    RECORD files, only the others are checked on disk.
+    """
+    if (x := cache_maker.get_cache(path + ':1', 'path_scope')) is None:
+        print(':v', 'scan search path', path)
+        x = path_scope.scan_scope(
+            path, dist_index.get_tops(path) if dist_info.enabled else None
+        )
+        cache_maker.save_cache(path + ':1', 'path_scope', x)
+    path_scope.add_snapshot(x)
+
+
 def _get_venv_root(working_root: str) -> T.NormPath:
     """
     find venv root (the "site-packages" folder).
@@ -0,0 +1,249 @@
+import typing as tp
+from dataclasses import dataclass
+
+from .dir_index import dir_index
+from .file_parser import FileParser
+from .finder import Finder
+from .finder import T as T0
+from .finder import _patched_imports
+from .patch import patch
+
+
+@dataclass(slots=True)
+class Node:
+    file: str
+    name: str  # module name of the file itself, e.g. 'a.b.c'.
+    top: str  # e.g. 'a'
+    imports: tp.Tuple[tp.Tuple[str, str], ...]
+    #   ((module_name, path), ...)
+    #       in source order. the globally ignored modules and the excluded
+    #       import contexts are excluded.
+    patched: tp.Tuple[str, ...]
+    #   (path, ...)
+    #       patched imports of `top`, see `finder._patched_imports`.
+
+
+class T(T0):
+    Node = Node
+
+
+class ModuleDag(Finder):
+    """
+    a module graph shared by all entries.
+    each file is parsed and resolved once per run, then every entry's
+    imports are collected by replaying the same depth-first visitation rule
+    as `Finder._get_all_imports` over the in-memory nodes. the replay must
+    keep the rule, because which alias names of a file get collected depends
+    on whether the file has been visited at that moment.
+    nodes are built lazily in the order of the replays, so the files are
+    parsed in the same order as the serial walk does.
+    for reachability queries, the graph is condensed into strongly
+    connected components, whose closures are stored as int bitsets.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._closures = None
+        #   {file: int, ...}
+        #       int: a bitset, bit i refers to `self._files[i]`.
+        self._files = []
+        self._nodes = {}
+        #   {file: node, ...}
+
+    @property
+    def nodes(self) -> tp.Dict[T.FilePath, T.Node]:
+        return self._nodes
+
+    def closure(self, file: T.FilePath) -> tp.FrozenSet[T.FilePath]:
+        """
+        all files reachable from `file` (including itself).
+        notice: `file` must be visited by `get_all_imports` before.
+        """
+        if self._closures is None:
+            self._closures = self._condense()
+        bits = self._closures[file]
+        files = self._files
+        out = []
+        while bits:
+            low = bits & -bits
+            out.append(files[low.bit_length() - 1])
+            bits ^= low
+        return frozenset(out)
+
+    def forget(self, files: tp.Iterable[T.FilePath]) -> None:
+        """
+        drop the nodes of `files`, they are built again when visited. the
+        caller should drop their parsing results as well if the files have
+        changed.
+        """
+        for f in files:
+            self._nodes.pop(f, None)
+        self._closures = None
+
+    def walk(
+        self, script: T.FilePath, include_self: bool = True
+    ) -> tp.Dict[T.ModuleName, T.FilePath]:
+        """
+        same as `get_all_imports`, but doesn't use the "all_imports" cache,
+        whose revision only tracks `script` itself. see also
+        `dependency.DependencyIndex`.
+        """
+        self._clear_holders()
+        return dict(self._get_all_imports(script, include_self))
+
+    def _get_all_imports(
+        self, script: T.FilePath, include_self: tp.Optional[bool] = True
+    ) -> tp.Iterator[tp.Tuple[T.ModuleName, T.FilePath]]:
+        # the visitation rule is the same as `Finder._get_all_imports`, but
+        # in a loop instead of recursion.
+        resolved = self._resolved_files
+        stack = [iter(((script, include_self),))]
+        while stack:
+            try:
+                file, include_self = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+            if file in resolved:
+                continue
+
+            node = self._get_node(file)
+            if include_self:
+                yield node.name, file
+
+            more_files = {}
+            init_flag = True if include_self in (True, None) else False
+            for module_name, path in node.imports:
+                if path in resolved:
+                    continue
+                yield module_name, path
+                if path.endswith(('.pyc', '.pyd')):
+                    continue
+                more_files[(path, None)] = None
+                if path.endswith('/__init__.py'):
+                    continue
+                possible_init_file = '{}/__init__.py'.format(
+                    path.rsplit('/', 1)[0]
+                )
+                if possible_init_file in resolved:
+                    continue
+                elif dir_index.exists(possible_init_file):
+                    more_files[(possible_init_file, init_flag)] = None
+                else:
+                    resolved.add(possible_init_file)
+
+            if node.patched and node.top not in self._patched_modules:
+                self._patched_modules.add(node.top)
+                for path in node.patched:
+                    more_files[(path, init_flag)] = None
+
+            resolved.add(file)
+            stack.append(iter(more_files))
+
+    def _get_node(self, file: T.FilePath) -> T.Node:
+        if (node := self._nodes.get(file)) is None:
+            parser = FileParser(file)
+            module_info = parser.module_info
+            assert module_info.full_name
+            imports = []
+            for module, path in parser.parse_imports():
+                if module.top.lower() in self._global_ignores:
+                    continue
+                if module.context in self._excluded_contexts:
+                    continue
+                self._references[module_info.full_name].add(module.full_name)
+                assert module.full_name
+                imports.append((module.full_name, path))
+            node = self._nodes[file] = Node(
+                file=file,
+                name=module_info.full_name,
+                top=module_info.top,
+                imports=tuple(imports),
+                patched=(
+                    tuple(_patched_imports(module_info))
+                    if module_info.top in patch
+                    else ()
+                ),
+            )
+            self._closures = None
+        return node
+
+    def _get_edges(self, node: T.Node) -> tp.Iterator[T.FilePath]:
+        for _, path in node.imports:
+            yield path
+            if not path.endswith(('.pyc', '.pyd', '/__init__.py')):
+                x = '{}/__init__.py'.format(path.rsplit('/', 1)[0])
+                if dir_index.exists(x):
+                    yield x
+        yield from node.patched
+
+    def _condense(self) -> tp.Dict[T.FilePath, int]:
+        """
+        tarjan's algorithm (iterative). it emits strongly connected
+        components in reverse topological order, so the closures of the
+        successors are ready before a component is emitted.
+        """
+        index_of = {}
+        for f in self._nodes:
+            index_of[f] = len(index_of)
+        for node in self._nodes.values():
+            for f in self._get_edges(node):
+                if f not in index_of:
+                    index_of[f] = len(index_of)  # a leaf, e.g. '*.pyd'.
+        self._files = list(index_of)
+        edges = [()] * len(index_of)
+        for f, node in self._nodes.items():
+            edges[index_of[f]] = tuple(
+                dict.fromkeys(index_of[x] for x in self._get_edges(node))
+            )
+
+        closures = [0] * len(index_of)
+        lowlink = [0] * len(index_of)
+        order = [-1] * len(index_of)
+        on_stack = [False] * len(index_of)
+        scc_stack = []
+        counter = 0
+        for root in range(len(index_of)):
+            if order[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                v, i = work.pop()
+                if i == 0:
+                    order[v] = lowlink[v] = counter
+                    counter += 1
+                    scc_stack.append(v)
+                    on_stack[v] = True
+                recurse = False
+                for j in range(i, len(edges[v])):
+                    w = edges[v][j]
+                    if order[w] == -1:
+                        work.append((v, j + 1))
+                        work.append((w, 0))
+                        recurse = True
+                        break
+                    elif on_stack[w]:
+                        lowlink[v] = min(lowlink[v], order[w])
+                if recurse:
+                    continue
+                if lowlink[v] == order[v]:
+                    members = []
+                    while True:
+                        w = scc_stack.pop()
+                        on_stack[w] = False
+                        members.append(w)
+                        if w == v:
+                            break
+                    bits = 0
+                    for w in members:
+                        bits |= 1 << w
+                    for w in members:
+                        for x in edges[w]:
+                            if not on_stack[x]:
+                                bits |= closures[x]
+                    for w in members:
+                        closures[w] = bits
+                if work:
+                    u = work[-1][0]
+                    lowlink[u] = min(lowlink[u], lowlink[v])
+        return {f: closures[i] for f, i in index_of.items()}
@@ -0,0 +1,136 @@
+import os
+import typing as tp
+from collections import defaultdict
+
+from .cache import cache_maker
+from .path_typing import T as T0
+
+
+class T(T0):
+    EntryPath = str
+    Factor = str  # a source factor, e.g. '/path/to/file.py:1'.
+    Revision = str
+    Vector = tp.Dict[Factor, Revision]
+    #   {factor: revision, ...}
+    #       the fingerprint vector of an entry. factors:
+    #       - every file in the closure of the entry.
+    #       - the parent directories of those files. their revision changes
+    #           when a module is added, removed or renamed, e.g. a missing
+    #           `__init__.py` that shows up.
+    #       - the search paths, the config file and the patch file.
+    Reasons = tp.Dict[EntryPath, tp.List[str]]
+    #   {entry: [reason, ...], ...}
+    #       entries that are not in it are up to date.
+
+
+_MISSING = '<missing>'
+
+
+class DependencyIndex:
+    """
+    tells which entries' module graphs are outdated.
+    each entry stores the fingerprint vector of all the files it touched
+    (thread 'module_graph_deps'). a reverse index `{factor: {entry, ...}}`
+    is built from the vectors, so every factor is checked only once however
+    many entries share it, and a change is mapped back to the affected
+    entries directly.
+    """
+
+    def __init__(self) -> None:
+        self.changed_paths = set()
+        #   {path, ...}
+        #       filled by `check`.
+        self._reverse = defaultdict(set)
+        #   {factor: {entry, ...}, ...}
+        self._vectors = {}
+        #   {entry: vector, ...}
+
+    def load(self, entries: tp.Iterable[T.EntryPath]) -> None:
+        for e in entries:
+            if (x := self._vectors.pop(e, None)) is not None:
+                for f in x:
+                    self._reverse[f].discard(e)
+            if (
+                x := cache_maker.get_cache(e + ':0', 'module_graph_deps')
+            ) is not None:
+                self._add(e, x)
+
+    def check(self, entries: tp.Iterable[T.EntryPath]) -> T.Reasons:
+        """
+        returns the outdated entries with reasons. see also `T.Reasons`.
+        the changed paths are kept in `self.changed_paths`.
+        """
+        self.changed_paths = set()
+        out = defaultdict(list)
+        for e in entries:
+            if e not in self._vectors:
+                out[e].append('no cached graph')
+        for f, affected in self._reverse.items():
+            if not affected:
+                continue
+            current = _get_revision(f)
+            for e in affected:
+                if self._vectors[e][f] != current:
+                    self.changed_paths.add(f[:-2])
+                    out[e].append('changed: {}'.format(f[:-2]))
+        return dict(out)
+
+    def invalidate_parsing_results(self, reasons: T.Reasons) -> None:
+        """
+        a file's parsing result is cached by the file itself, but its imports
+        are resolved against the directories they point to. when a directory
+        changed (a module was added, removed or renamed), drop the results of
+        the files which live in it or import from it, so they are parsed
+        again.
+        notice: imports that failed to resolve are not recorded in parsing
+        results, a newly added top-level module is not noticed by the files
+        that import it until they change.
+        """
+        if not self.changed_paths:
+            return
+        candidates = set()
+        for e in reasons:
+            for f in self._vectors.get(e, ()):
+                if f.endswith('.py:1'):
+                    candidates.add(f[:-2])
+        for f in sorted(candidates):
+            if not os.path.exists(f):
+                continue
+            if f.rsplit('/', 1)[0] in self.changed_paths:
+                stale = True
+            elif (
+                x := cache_maker.get_cache(
+                    f + ':1', 'ast_parsing_results', persistent=True
+                )
+            ) is None:
+                continue
+            else:
+                stale = any(
+                    path.rsplit('/', 1)[0] in self.changed_paths
+                    for _, path in x
+                )
+            if stale:
+                print(':v', 'drop parsing result', f)
+                cache_maker.delete_cache(f + ':1', 'ast_parsing_results')
+
+    def update(
+        self, entry: T.EntryPath, factors: tp.Iterable[T.Factor]
+    ) -> None:
+        vector = {f: _get_revision(f) for f in factors}
+        cache_maker.save_cache(entry + ':0', 'module_graph_deps', vector)
+        if (x := self._vectors.pop(entry, None)) is not None:
+            for f in x:
+                self._reverse[f].discard(entry)
+        self._add(entry, vector)
+
+    def _add(self, entry: T.EntryPath, vector: T.Vector) -> None:
+        self._vectors[entry] = vector
+        for f in vector:
+            self._reverse[f].add(entry)
+
+
+def _get_revision(factor: T.Factor) -> T.Revision:
+    try:
+        return cache_maker.get_revision(factor)
+    except OSError:
+        return _MISSING
@@ -0,0 +1,193 @@
+import os
+import typing as tp
+from stat import S_ISDIR
+
+_MISSING = 0
+_FILE = 1
+_DIR = 2
+
+
+class T:
+    Dirpath = str
+    Filepath = str
+    Kind = int  # see `_MISSING`, `_FILE`, `_DIR`.
+    Listing = tp.Tuple[tp.Dict[str, bool], tp.Dict[str, str]]
+    #   (names, modules)
+    #       names: {name: isdir, ...}
+    #       modules: {stem: filepath, ...}
+    #           files ending with '.py', '.pyc' or '.pyd'. stem is the name
+    #           before the first dot, e.g. '_cffi_backend' for
+    #           '_cffi_backend.cp312-win_amd64.pyd'. if a stem has several
+    #           files, the untagged ones win, in the order of `module_exts`.
+
+
+class DirIndex:
+    """
+    a per-run cache of directory listings and path stats.
+    module resolution asks the same directories again and again (every
+    unresolved import checks its parent package), the index makes each
+    directory being listed, and each path being stated, at most once.
+    """
+
+    module_exts = ('.py', '.pyc', '.pyd')
+
+    def __init__(self) -> None:
+        self._case_sensitive_devices = {}
+        #   {st_dev: bool, ...}
+        self._case_sensitive_dirs = {}
+        #   {dirpath: bool, ...}
+        self._kinds = {}
+        #   {path: kind, ...}
+        self._listings = {}
+        #   {dirpath: listing, ...}
+
+    def clear(self) -> None:
+        self._case_sensitive_devices.clear()
+        self._case_sensitive_dirs.clear()
+        self._kinds.clear()
+        self._listings.clear()
+
+    def forget(self, paths: tp.Iterable[str]) -> None:
+        """
+        drop what is known about `paths` (e.g. they are added, removed or
+        renamed), and the listings of their parent directories. if a path is
+        a directory, everything known under it is dropped as well.
+        """
+        paths = set(paths)
+        if not paths:
+            return
+        prefixes = tuple(p + '/' for p in paths)
+        for d in (self._case_sensitive_dirs, self._kinds, self._listings):
+            for k in [k for k in d if k in paths or k.startswith(prefixes)]:
+                del d[k]
+        for p in paths:
+            self._listings.pop(p.rsplit('/', 1)[0], None)
+
+    def exists(self, path: str) -> bool:
+        return self._get_kind(path) != _MISSING
+
+    def isdir(self, path: str) -> bool:
+        return self._get_kind(path) == _DIR
+
+    def find_module(
+        self, dirpath: T.Dirpath, name: str
+    ) -> tp.Optional[T.Filepath]:
+        """
+        find `<dirpath>/<name>/__init__.py` or `<dirpath>/<name>.<ext>`, name
+        is matched case sensitively (on case-insensitive file systems, a path
+        'foo.py' also exists as 'FOO.py', the listing tells the real one).
+        """
+        dirpath = os.path.abspath(dirpath).replace('\\', '/')
+        if self._is_case_sensitive(dirpath):
+            # stat results are exact here, no need to list the directory.
+            x = '{}/{}'.format(dirpath, name)
+            if self.isdir(x) and self.exists(x + '/__init__.py'):
+                return x + '/__init__.py'
+            for ext in self.module_exts:
+                if self._get_kind(x + ext) == _FILE:
+                    return x + ext
+            # abi tagged extensions (e.g. 'foo.cp312-win_amd64.pyd') cannot
+            # be guessed by name, ask the listing.
+            if (listing := self._get_listing(dirpath)) is None:
+                return None
+            return listing[1].get(name)
+        if (listing := self._get_listing(dirpath)) is None:
+            return None
+        names, modules = listing
+        if names.get(name) and self.exists(
+            x := '{}/{}/__init__.py'.format(dirpath, name)
+        ):
+            return x
+        return modules.get(name)
+
+    def _get_kind(self, path: str) -> T.Kind:
+        if (x := self._kinds.get(path)) is None:
+            try:
+                st = os.stat(path)
+            except (OSError, ValueError):
+                x = _MISSING
+            else:
+                x = _DIR if S_ISDIR(st.st_mode) else _FILE
+            self._kinds[path] = x
+        return x
+
+    def _get_listing(self, dirpath: T.Dirpath) -> tp.Optional[T.Listing]:
+        if dirpath in self._listings:
+            return self._listings[dirpath]
+        try:
+            entries = tuple(os.scandir(dirpath))
+        except (OSError, ValueError):
+            out = None
+        else:
+            names = {}
+            modules = {}
+            ranks = {}
+            for e in entries:
+                try:
+                    isdir = e.is_dir()
+                except OSError:
+                    isdir = False
+                names[e.name] = isdir
+                if not isdir and e.name.endswith(self.module_exts):
+                    stem, ext = e.name.split('.', 1)
+                    rank = self._get_ext_rank('.' + ext)
+                    if rank < ranks.get(stem, len(self.module_exts) + 1):
+                        modules[stem] = '{}/{}'.format(dirpath, e.name)
+                        ranks[stem] = rank
+                self._kinds.setdefault(
+                    '{}/{}'.format(dirpath, e.name), _DIR if isdir else _FILE
+                )
+            out = (names, modules)
+        self._listings[dirpath] = out
+        return out
+
+    def _get_ext_rank(self, ext: str) -> int:
+        """
+        the index of `ext` in `module_exts`, abi tagged suffixes (e.g.
+        '.cp312-win_amd64.pyd') rank last.
+        """
+        try:
+            return self.module_exts.index(ext)
+        except ValueError:
+            return len(self.module_exts)
+
+    def _is_case_sensitive(self, dirpath: T.Dirpath) -> bool:
+        """
+        probe once per device: swap the case of the last segment and stat it.
+        if it resolves to the same directory, the file system is case
+        insensitive; if it resolves to another entry or does not exist, it is
+        case sensitive. only the last segment is swapped, so the parent path
+        is the real one and the answer is about this file system, even if it
+        is mounted under one of the other kind (e.g. '/mnt/c' on wsl). if the
+        stat fails otherwise, we cannot tell, the caller falls back to
+        listing, and the device is not marked.
+        """
+        if (out := self._case_sensitive_dirs.get(dirpath)) is not None:
+            return out
+        try:
+            st = os.stat(dirpath)
+        except (OSError, ValueError):
+            out = False
+        else:
+            head, tail = dirpath.rsplit('/', 1)
+            if st.st_dev in self._case_sensitive_devices:
+                out = self._case_sensitive_devices[st.st_dev]
+            elif (swapped := tail.swapcase()) == tail:
+                # cannot tell from this path, fall back to listing.
+                out = False
+            else:
+                try:
+                    st1 = os.stat('{}/{}'.format(head, swapped))
+                except FileNotFoundError:
+                    out = True
+                    self._case_sensitive_devices[st.st_dev] = out
+                except (OSError, ValueError):
+                    out = False
+                else:
+                    out = not os.path.samestat(st, st1)
+                    self._case_sensitive_devices[st.st_dev] = out
+        self._case_sensitive_dirs[dirpath] = out
+        return out
+
+
+dir_index = DirIndex()
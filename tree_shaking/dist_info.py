@@ -0,0 +1,214 @@
+"""
+the installed distributions of a search path, read from their
+"*.dist-info/RECORD" files.
+"""
+
+import csv
+import os
+import typing as tp
+from fnmatch import fnmatchcase
+
+from lk_utils import fs
+
+from .cache import cache_maker
+from .path_scope import path_scope
+
+enabled = os.getenv('TREE_SHAKING_DIST_RECORDS', '') not in ('', '0')
+#   use the RECORD files as the file manifest of search paths: the top level
+#   modules, the files under installed packages and their digests are read
+#   from RECORD instead of walking and stating the disk. only the paths not
+#   listed in any RECORD are looked up on disk.
+#   notice: it trusts the installers, the files added to or modified in an
+#   installed package afterwards are not seen.
+
+
+class T:
+    AbsDirPath = str
+    AbsFilePath = str
+    Dist = str
+    #   '<name>==<version>', e.g. 'numpy==2.1.3'. name is normalized as in
+    #   the dist-info folder name, e.g. 'typing_extensions'.
+    Record = tp.Tuple[Dist, str, int]
+    #   (dist, digest, size)
+    #       digest: e.g. 'sha256=<urlsafe-base64>', empty if not recorded.
+    #       size: -1 if not recorded.
+    RelDirPath = str
+    RelFilePath = str  # relative to the search path.
+    RelPath = str
+    Index = tp.Dict[RelFilePath, Record]
+    Tree = tp.Dict[RelDirPath, tp.Dict[str, bool]]
+    #   {reldir: {name: isdir, ...}, ...}
+    #       reldir: '' for the search path itself. `__pycache__` folders are
+    #       excluded.
+
+
+class DistIndex:
+    """
+    maps the files of a search path (e.g. a site-packages) to the
+    distributions which installed them.
+    the index of a search path is built from all the RECORD files in it, and
+    cached by the revision of the search path folder (installing or removing
+    a distribution changes it, since a dist-info folder is added or removed).
+    files out of any RECORD (e.g. first-party sources, editable installs)
+    are not in the index.
+    a path is "owned" if its top level module (or dist-info folder) is
+    listed in a RECORD, the queries below return None for the paths not
+    owned, the caller should look them up on disk then.
+    """
+
+    def __init__(self) -> None:
+        self._indexes = {}
+        #   {search_path: index, ...}
+        self._trees = {}
+        #   {search_path: tree, ...}
+
+    def clear(self) -> None:
+        self._indexes.clear()
+        self._trees.clear()
+
+    def exists(
+        self, search_path: T.AbsDirPath, relpath: T.RelPath
+    ) -> tp.Optional[bool]:
+        tree = self._get_tree(search_path)
+        if relpath.split('/', 1)[0] not in tree['']:
+            return None
+        if '/' in relpath:
+            parent, name = relpath.rsplit('/', 1)
+        else:
+            parent, name = '', relpath
+        return name in tree.get(parent, ())
+
+    def find(
+        self, file: T.AbsFilePath
+    ) -> tp.Optional[tp.Tuple[T.RelFilePath, T.Record]]:
+        """
+        returns `(relpath, record)`, or None if `file` is not installed by a
+        distribution.
+        """
+        if (x := path_scope.find_top(file)) is None:
+            return None
+        root = x[0].rsplit('/', 1)[0]
+        relpath = file[len(root) + 1 :]
+        if (record := self.get_index(root).get(relpath)) is None:
+            return None
+        return relpath, record
+
+    def forget(self, search_path: T.AbsDirPath) -> None:
+        """
+        drop the index of `search_path` from memory, e.g. after distributions
+        are installed or removed. see `watch.Watcher`.
+        """
+        self._indexes.pop(search_path, None)
+        self._trees.pop(search_path, None)
+
+    def get_index(self, search_path: T.AbsDirPath) -> T.Index:
+        if (out := self._indexes.get(search_path)) is None:
+            out = cache_maker.get_cache(search_path + ':1', 'dist_index')
+            if out is None:
+                out = read_records(search_path)
+                cache_maker.save_cache(search_path + ':1', 'dist_index', out)
+            self._indexes[search_path] = out
+        return out
+
+    def get_tops(self, search_path: T.AbsDirPath) -> tp.Dict[str, bool]:
+        """
+        the top level names listed in RECORD files. see also
+        `path_scope.PathScope.scan_scope`.
+        """
+        return self._get_tree(search_path)['']
+
+    def glob(
+        self, search_path: T.AbsDirPath, pattern: str
+    ) -> tp.Optional[tp.List[T.RelPath]]:
+        """
+        the same as `glob.glob` but matches the owned paths only. the first
+        segment of `pattern` must be a literal name, otherwise returns None.
+        a trailing '/' matches directories only.
+        """
+        tree = self._get_tree(search_path)
+        top, *segs = pattern.rstrip('/').split('/')
+        if _is_magic(top) or top not in tree['']:
+            return None
+        out = [top]
+        for seg in segs:
+            matches = []
+            for d in out:
+                children = tree.get(d, ())
+                if not _is_magic(seg):
+                    if seg in children:
+                        matches.append('{}/{}'.format(d, seg))
+                    continue
+                for name in children:
+                    if name.startswith('.') and not seg.startswith('.'):
+                        continue
+                    if fnmatchcase(name, seg):
+                        matches.append('{}/{}'.format(d, name))
+            out = matches
+        if pattern.endswith('/'):
+            out = [x for x in out if x in tree]
+        return sorted(out)
+
+    def list_files(
+        self, search_path: T.AbsDirPath, reldir: T.RelDirPath
+    ) -> tp.Optional[tp.List[T.RelFilePath]]:
+        """
+        all files under `reldir` (recursively), or None if `reldir` is not
+        owned.
+        """
+        tree = self._get_tree(search_path)
+        if reldir.split('/', 1)[0] not in tree[''] or reldir not in tree:
+            return None
+        out = []
+        stack = [reldir]
+        while stack:
+            d = stack.pop()
+            for name, isdir in sorted(tree[d].items()):
+                if isdir:
+                    stack.append('{}/{}'.format(d, name))
+                else:
+                    out.append('{}/{}'.format(d, name))
+        return out
+
+    def _get_tree(self, search_path: T.AbsDirPath) -> T.Tree:
+        if (out := self._trees.get(search_path)) is None:
+            out = self._trees[search_path] = {'': {}}
+            for relpath in self.get_index(search_path):
+                *dirs, name = relpath.split('/')
+                if '__pycache__' in dirs:
+                    continue
+                parent = ''
+                for d in dirs:
+                    out[parent][d] = True
+                    parent = '{}/{}'.format(parent, d) if parent else d
+                    out.setdefault(parent, {})
+                out[parent].setdefault(name, False)
+        return out
+
+
+def read_records(search_path: T.AbsDirPath) -> T.Index:
+    out = {}
+    with os.scandir(search_path) as it:
+        dist_infos = sorted(
+            e.name for e in it if e.name.endswith('.dist-info') and e.is_dir()
+        )
+    for name in dist_infos:
+        file = '{}/{}/RECORD'.format(search_path, name)
+        if not fs.exist(file):
+            continue
+        dist = '=='.join(name[: -len('.dist-info')].split('-', 1))
+        with open(file, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith(('/', '../')):
+                    continue
+                relpath = row[0].replace('\\', '/')
+                digest = row[1] if len(row) > 1 else ''
+                size = int(row[2]) if len(row) > 2 and row[2] else -1
+                out[relpath] = (dist, digest, size)
+    return out
+
+
+def _is_magic(name: str) -> bool:
+    return any(x in name for x in '*?[')
+
+
+dist_index = DistIndex()
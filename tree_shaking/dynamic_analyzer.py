@@ -1,3 +1,4 @@
+import subprocess
 import sys
 import typing as tp
 
@@ -21,3 +22,50 @@ def grab_global_modules() -> tp.Iterator[tp.Tuple[str, str, bool]]:
                 yield mod.__name__, fs.normpath(mod.__path__[0]), True
         else:  # e.g. '_cython_runtime', '_cython_3_1_4'
             print(':v8n', 'mod has no __file__ attr', mod)
+
+
+def load_trace(file: str) -> tp.Iterator[tp.Tuple[str, str, bool]]:
+    """
+    load the record saved by `trace_script`.
+    yields: tuple[name, path, isdir]
+        name is empty for data files and dll directories.
+    """
+    for name, path, isdir in fs.load(file):
+        yield name, path, isdir
+
+
+def trace_script(
+    script: str, *args: str, output: str = 'trace.json'
+) -> tp.List[tp.Tuple[str, str, bool]]:
+    """
+    run `script` in a child interpreter with audit hooks (`import`, `open`,
+    `ctypes.dlopen` and `os.add_dll_directory`), record the modules it
+    imports and the files it opens, save the record to `output`.
+    unlike `grab_global_modules`, the record contains the data files (json
+    schemas, dlls, etc.) the app actually touched, and nothing imported by
+    tree_shaking itself. the record can be passed to
+    `export.dump_tree_from_modules` (`trace_file`), which exports them as file
+    level resources.
+    notice: exercise the features of the app during tracing, the files that
+    are not touched won't be recorded.
+    params:
+        *args: arguments passed to `script`.
+        output (-o):
+    """
+    output = fs.abspath(output)
+    proc = subprocess.run(
+        (
+            sys.executable,
+            fs.xpath('_tracer.py'),
+            output,
+            fs.abspath(script),
+            *args,
+        )
+    )
+    if not fs.exist(output):
+        raise Exception('tracing failed', script, proc.returncode)
+    if proc.returncode != 0:
+        print(':v6', 'script exited with code {}'.format(proc.returncode))
+    out = list(load_trace(output))
+    print(':v2', 'recorded {} paths, saved to {}'.format(len(out), output))
+    return out
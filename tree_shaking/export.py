@@ -1,32 +1,78 @@
+import errno
+import hashlib
+import os
+import py_compile
+import shutil
 import sys
+import threading
 import typing as tp
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from importlib.util import cache_from_source
 
 import neoprint as np
 from lk_utils import fs
+from lk_utils import uuid
 
+from . import archive
 from .cache import cache_maker
 from .config import parse_config
 from .dynamic_analyzer import grab_global_modules
+from .dynamic_analyzer import load_trace
 from .graph import T as T0
+from .instrument import instrument
+from .manifest import get_manifest
+from .minify import T as T3
+from .minify import minify_sources
 from .patch import ResourcePatch
 from .path_typing import T as T1
+from .symbols import T as T2
+from .symbols import shake_symbols
 
 
 class T(T1):
     Config = T0.Config
+    DeadCode = T2.Mode
+    Minify = T3.Mode
+    Profile = T0.Profile
     DryRun = tp.Union[bool, tp.Literal[0, 1, 2]]
     #   0: no dry run
     #   1: no actual file operations, only prints.
     #   2: same as 1, but disable incremental update
-
+    Materialize = tp.Literal['symlink', 'hardlink', 'copy', 'copy_if_changed']
+    #   how the resources are put into the target tree.
+    #   'symlink': link to the sources. the tree breaks when the sources are
+    #       moved or removed (e.g. the venv is rebuilt).
+    #   'hardlink': hard link the files, fall back to 'copy' if not possible
+    #       (e.g. across devices). notice the target files share the content
+    #       with the sources, editing one changes the other.
+    #   'copy': copy the files, see `_copy_file`.
+    #   'copy_if_changed': same as 'copy', but an existing target file is
+    #       kept if its size and content hash equal to the source's. it also
+    #       keeps the target mtimes, which avoids rewriting container layers.
+    #   except 'symlink', directory resources are exported file by file.
+    Precompile = tp.Literal['', 'pycache', 'sourceless']
+    #   '': no precompilation.
+    #   'pycache': compile '*.py' into '__pycache__/*.pyc' next to the
+    #       exported sources.
+    #   'sourceless': compile '*.py' into '*.pyc' in place of the sources,
+    #       the sources are not exported.
+
+    Overrides = T2.Overrides
     Records = tp.TypedDict(
         'Records',
         {
             'created_directories': tp.FrozenSet[T1.RelDirPath],
+            'fingerprint': str,
             'resource_records': tp.Dict[T1.RelPath, int],
         },
     )
+    #   resource_records: {relpath: stamp, ...}
+    #       see `manifest.SourceManifest.stamp`.
+    #   fingerprint: digest of all resource stamps. if it equals to the last
+    #       one, the export is skipped. it may be absent in old records.
     TodoDirs = tp.Union[tp.Set[T1.RelDirPath]]
     TodoFiles = tp.Union[tp.Set[T1.RelFilePath]]
 
@@ -40,27 +86,92 @@ def dump_tree_from_config_file(
     dry_run: T.DryRun = False,
     **kwargs,
 ) -> None:
-    cfg: T.Config = parse_config(
-        file_i, export={'source': single_source_entry, 'target': dir_o}
-    )
-    dump_tree_from_config(cfg, dry_run, **kwargs)
+    """
+    kwargs: see `dump_tree_from_config`.
+    """
+    with instrument.session(
+        kwargs.get('report', ''), kwargs.get('profile', ''), 'dump_tree'
+    ):
+        cfg: T.Config = parse_config(
+            file_i, export={'source': single_source_entry, 'target': dir_o}
+        )
+        dump_tree_from_config(cfg, dry_run, **kwargs)
 
 
-def dump_tree_from_config(config: T.Config, dry_run: T.DryRun = False) -> None:
+def dump_tree_from_config(
+    config: T.Config,
+    dry_run: T.DryRun = False,
+    content_hash: bool = False,
+    workers: int = 0,
+    precompile: T.Precompile = '',
+    optimize: int = 0,
+    dce: T.DeadCode = '',
+    minify: T.Minify = '',
+    report: str = '',
+    profile: T.Profile = '',
+    materialize: T.Materialize = 'symlink',
+) -> None:
+    """
+    params:
+        content_hash: compare source files by content hash instead of mtime.
+            it avoids re-linking files that were touched but not modified.
+        workers: if greater than 1, run file operations in a pool of N
+            threads, and compile sources in a pool of N processes. the
+            result is the same as serial mode.
+        precompile: see `T.Precompile`. sources are compiled by the current
+            interpreter, it should be the same version as the target one.
+            directory resources are exported file by file in this mode, so
+            nothing is written into the source tree.
+        optimize: optimization level of the compiled files, 0, 1 or 2.
+            for 'pycache' mode, level 1 and 2 are only loaded by an
+            interpreter running with `-O` and `-OO` respectively.
+        dce: dead code elimination, see `symbols.T.Mode`. unused top level
+            functions, classes and imports are removed from the exported
+            modules, the rewritten modules are written instead of linked.
+        minify: remove docstrings, comments and annotations from the
+            exported modules, see `minify.T.Mode`. directory resources are
+            not minified.
+        report: save per-phase timings and counters to this json file.
+            see `instrument.T.Report`.
+        profile: see `instrument.T.Profile`.
+        materialize: see `T.Materialize`. switching it puts all resources
+            again.
+    if the export target ends with ".zip" or ".tar.zst", the resources are
+    written into an archive instead of a tree, see `archive.dump_archive`.
+    `materialize` is ignored then.
+    """
     source = config['export']['source']  # an absolute path
     target = config['export']['target']  # a valid abspath
     print(source, target, ':nv2l')
     assert source and target
 
     if source:
-        files, dirs = _mount_resources(config, source, verbose=bool(dry_run))
-        _dump_single_source(
-            root_i=source,
-            root_o=target,
-            files_i=files,
-            dirs_i=dirs,
-            dry_run=dry_run,
-        )
+        with instrument.session(report, profile, 'dump_tree'):
+            files, dirs = _mount_resources(
+                config, source, verbose=bool(dry_run)
+            )
+            overrides = {}
+            if dce:
+                files, overrides = shake_symbols(config, source, files, dce)
+            if minify:
+                overrides = minify_sources(
+                    source, files, overrides, minify, workers
+                )
+            # not a decorator, the "export done" message shows its caller.
+            with instrument.phase('export'):
+                _dump_single_source(
+                    root_i=source,
+                    root_o=target,
+                    files_i=files,
+                    dirs_i=dirs,
+                    dry_run=dry_run,
+                    content_hash=content_hash,
+                    workers=workers,
+                    precompile=precompile,
+                    optimize=optimize,
+                    overrides=overrides,
+                    materialize=materialize,
+                )
     else:
         """
         memo:
@@ -97,13 +208,31 @@ def dump_tree_from_config(config: T.Config, dry_run: T.DryRun = False) -> None:
 
 
 def dump_tree_from_modules(
-    dir_o: T.AnyDirPath, dry_run: T.DryRun = False
+    dir_o: T.AnyDirPath,
+    dry_run: T.DryRun = False,
+    content_hash: bool = False,
+    workers: int = 0,
+    precompile: T.Precompile = '',
+    optimize: int = 0,
+    trace_file: T.AnyFilePath = '',
+    minify: T.Minify = '',
+    materialize: T.Materialize = 'symlink',
 ) -> None:
+    """
+    params:
+        trace_file: a record saved by `dynamic_analyzer.trace_script`. if
+            given, export the modules and data files in it (file by file).
+            otherwise, export the modules loaded in the current process.
+        other params: see `dump_tree_from_config`.
+    """
     assert sys.exec_prefix.endswith('.venv')
     root_i = fs.normpath('{}/Lib/site-packages'.format(sys.exec_prefix))
     root_o = fs.abspath(dir_o)
 
-    mods = tuple(grab_global_modules())
+    if trace_file:
+        mods = tuple(load_trace(trace_file))
+    else:
+        mods = tuple(grab_global_modules())
 
     files, dirs = set(), set()
     # patch = ResourcePatch(root_i)
@@ -121,6 +250,9 @@ def dump_tree_from_modules(
     dirs, files = _eliminate_overlapping_resources(
         dirs, files, verbose=bool(dry_run)
     )
+    overrides = {}
+    if minify:
+        overrides = minify_sources(root_i, files, overrides, minify, workers)
 
     _dump_single_source(
         root_i=root_i,
@@ -128,6 +260,12 @@ def dump_tree_from_modules(
         files_i=files,
         dirs_i=dirs,
         dry_run=dry_run,
+        content_hash=content_hash,
+        workers=workers,
+        precompile=precompile,
+        optimize=optimize,
+        overrides=overrides,
+        materialize=materialize,
     )
 
 
@@ -141,15 +279,27 @@ def _dump_single_source(
     dirs_i: tp.Iterable[T.RelPath] = (),
     # copy_files: bool = False,
     dry_run: T.DryRun = False,
+    content_hash: bool = False,
+    workers: int = 0,
+    precompile: T.Precompile = '',
+    optimize: int = 0,
+    overrides: tp.Optional[T.Overrides] = None,
+    materialize: T.Materialize = 'symlink',
 ) -> None:
+    """
+    params:
+        overrides: resources to be written with the given content instead
+            of linked. they are stamped by the content.
+    """
+    assert optimize in (0, 1, 2), optimize
+    assert materialize in tp.get_args(T.Materialize), materialize
+    if precompile and archive.is_archive(root_o):
+        raise ValueError(
+            'precompile is not supported for archive targets', root_o
+        )
     todo_relfiles = set(files_i)
     todo_reldirs = set(dirs_i)
-    tobe_created_reldirs = _analyze_dirs_tobe_created(
-        todo_relfiles, todo_reldirs
-    )
-    print(
-        len(todo_relfiles), len(todo_reldirs), len(tobe_created_reldirs), ':n'
-    )
+    overrides = overrides or {}
 
     def is_first_time_dump() -> bool:
         if dry_run == 2:
@@ -159,130 +309,346 @@ def _dump_single_source(
                 return False
         return True
 
-    if is_first_time_dump():
-        print('first time dump', ':v2')
-        fs.make_dir(root_o)
+    records_key = '{};{}'.format(root_i, root_o) + ':0'
+    manifest = get_manifest(root_i, content_hash)
+    res1 = manifest.stamp(todo_relfiles, todo_reldirs)
+    salt = 0
+    if archive.is_archive(root_o):
+        materialize = 'symlink'
+    if precompile:
+        # export directory resources file by file, so that the compiled
+        # files are not written into the source tree.
+        todo_relfiles = set(manifest.entries)
+        todo_reldirs = set()
+        salt = _get_precompile_salt(precompile, optimize)
+        res1 = {
+            k: v ^ salt if k.endswith('.py') else v
+            for k, v in manifest.stamp(todo_relfiles, ()).items()
+        }
+    if materialize != 'symlink':
+        # only files can be hard linked or copied.
+        todo_relfiles = set(manifest.entries)
+        todo_reldirs = set()
+        res1 = {
+            k: res1.get(k, v) ^ _get_materialize_salt(materialize)
+            for k, v in manifest.stamp(todo_relfiles, ()).items()
+        }
+    for r, data in overrides.items():
+        res1[r] = _get_content_stamp(data) ^ (salt if r.endswith('.py') else 0)
+    fingerprint = uuid(
+        ';'.join('{}:{}'.format(k, res1[k]) for k in sorted(res1))
+    )
 
-        tree1 = tobe_created_reldirs
-        for d in sorted(tree1):
-            # make directory
-            if dry_run:
-                print(':iv4', '[dry run] make dir: {}'.format(d))
-            else:
-                o = '{}/{}'.format(root_o, d)
-                fs.make_dir(o)
-
-        res1 = {}
-        for r in todo_relfiles:
-            res1[r] = tp.cast(int, fs.mtime('{}/{}'.format(root_i, r)))
-        for r in todo_reldirs:
-            res1[r] = tp.cast(
-                int, fs.mtime('{}/{}'.format(root_i, r), recursive=True)
-            )
-        for r in sorted(res1, reverse=True):
-            # add resource
-            if dry_run:
-                print(':i2v4', '[dry run] add res: {}'.format(r))
-            else:
-                i = '{}/{}'.format(root_i, r)
-                o = '{}/{}'.format(root_o, r)
-                fs.make_link(i, o, False)
-                # fs.make_link(i, o, True)
-                # if fs.exist(o):
-                #     print(
-                #         ':v8iln',
-                #         'target file exists! (this should not happen)',
-                #         i,
-                #         o,
-                #     )
-                # else:
-                #     fs.make_link(i, o, False)
+    if archive.is_archive(root_o):
+        archive.dump_archive(
+            root_i,
+            root_o,
+            manifest,
+            fingerprint,
+            content_hash,
+            dry_run,
+            workers,
+            overrides,
+        )
+        return
 
+    tobe_created_reldirs = _analyze_dirs_tobe_created(
+        todo_relfiles, todo_reldirs
+    )
+    print(
+        len(todo_relfiles), len(todo_reldirs), len(tobe_created_reldirs), ':n'
+    )
+
+    first_time = is_first_time_dump()
+    if first_time:
+        print('first time dump', ':v2')
+        fs.make_dir(root_o)
+        tree0 = frozenset()
+        res0 = {}
     else:
-        assert (
-            x := cache_maker.get_cache(
-                '{};{}'.format(root_i, root_o) + ':0', 'last_dumped_records'
-            )
-        )
+        assert (x := cache_maker.get_cache(records_key, 'last_dumped_records'))
         records0: T.Records = x
-
+        if records0.get('fingerprint') == fingerprint:
+            # neither the module graphs (they decide which resources to
+            # export) nor the sources have changed.
+            if not dry_run:
+                manifest.save()
+            print('nothing changed, skip export', ':v4')
+            return
         tree0 = records0['created_directories']
-        tree1 = tobe_created_reldirs
-        for d in sorted(tree1 - tree0):
-            # make directory
-            if dry_run:
-                print(':iv4', '[dry run] make dir: {}'.format(d))
-            else:
-                o = '{}/{}'.format(root_o, d)
-                fs.make_dir(o)
-        for d in sorted(tree0 - tree1):
-            # delete directory
-            if dry_run:
-                print(':iv8', '[dry run] drop dir: {}'.format(d))
-            else:
-                o = '{}/{}'.format(root_o, d)
-                if fs.exist(o):
-                    fs.remove_tree(o)
-                else:
-                    print('already removed?', d, ':v5')
-
         res0 = records0['resource_records']
-        res1 = {}
-        for r in todo_relfiles:
-            res1[r] = tp.cast(int, fs.mtime('{}/{}'.format(root_i, r)))
-        for r in sorted(todo_reldirs, reverse=True):
-            res1[r] = tp.cast(
-                int, fs.mtime('{}/{}'.format(root_i, r), recursive=True)
-            )
+
+    tree1 = tobe_created_reldirs
+    dirs_to_make = sorted(tree1 - tree0)
+    dirs_to_drop = sorted(tree0 - tree1)
+    res_to_add = [r for r in sorted(res1, reverse=True) if r not in res0]
+    res_to_update = [
+        r
+        for r in sorted(res1, reverse=True)
+        if r in res0 and res1[r] != res0[r]
+    ]
+    res_to_drop = [r for r in sorted(res0, reverse=True) if r not in res1]
+    res_to_compile = [
+        r
+        for r in res_to_add + res_to_update
+        if precompile and r.endswith('.py')
+    ]
+
+    if dry_run:
+        for d in dirs_to_make:
+            print(':iv4', '[dry run] make dir: {}'.format(d))
+        for d in dirs_to_drop:
+            print(':iv8', '[dry run] drop dir: {}'.format(d))
         with np.scope():
-            for r1 in sorted(res1, reverse=True):
-                if r1 not in res0:
-                    # add resource
-                    if dry_run:
-                        print(':i2v4', '[dry run] add res: {}'.format(r1))
-                    else:
-                        o = '{}/{}'.format(root_o, r1)
-                        fs.make_link('{}/{}'.format(root_i, r1), o, True)
+            for r in sorted(res_to_add + res_to_update, reverse=True):
+                if r in res0:
+                    print(':i2v6', '[dry run] update res: {}'.format(r))
                 else:
-                    t1 = res1[r1]
-                    t0 = res0[r1]
-                    if t1 != t0:
-                        # update resource
-                        if dry_run:
-                            print(
-                                ':i2v6', '[dry run] update res: {}'.format(r1)
-                            )
-                        else:
-                            o = '{}/{}'.format(root_o, r1)
-                            fs.make_link('{}/{}'.format(root_i, r1), o, True)
-            for r0 in sorted(res0, reverse=True):
-                if r0 not in res1:
-                    # delete resource
-                    if dry_run:
-                        print(':i2v8', '[dry run] drop res: {}'.format(r0))
-                    else:
-                        o = '{}/{}'.format(root_o, r0)
-                        if fs.exist(o):
-                            fs.remove(o)
-                        else:
-                            print('already removed?', r0, ':v5')
+                    print(':i2v4', '[dry run] add res: {}'.format(r))
+            for r in res_to_drop:
+                print(':i2v8', '[dry run] drop res: {}'.format(r))
+        if res_to_compile:
+            print(
+                ':v2',
+                '[dry run] compile {} sources'.format(len(res_to_compile)),
+            )
+        print('export done', ':ptv4')
+        return
+
+    def make_dir(d: T.RelDirPath) -> None:
+        fs.make_dir('{}/{}'.format(root_o, d))
 
-    if not dry_run:
+    def drop_dir(d: T.RelDirPath) -> None:
+        o = '{}/{}'.format(root_o, d)
+        if fs.exist(o):
+            fs.remove_tree(o)
+        else:
+            print('already removed?', d, ':v5')
+
+    def link_res(r: T.RelPath) -> None:
+        i = '{}/{}'.format(root_i, r)
+        if materialize != 'symlink':
+            _materialize_file(i, '{}/{}'.format(root_o, r), materialize)
+            return
+        fs.make_link(i, '{}/{}'.format(root_o, r), not first_time)
+        if instrument.enabled:
+            if os.path.isdir(i):
+                instrument.count('dirs_linked')
+            else:
+                instrument.count('files_linked')
+                instrument.count('bytes_linked', os.path.getsize(i))
+
+    def write_res(r: T.RelPath) -> None:
+        o = '{}/{}'.format(root_o, r)
+        # it may be a link to the source, don't write through it.
+        _remove_if_exists(o)
+        with open(o, 'wb') as f:
+            f.write(overrides[r])
+        instrument.count('files_written')
+        instrument.count('bytes_written', len(overrides[r]))
+
+    def put_res(r: T.RelPath) -> None:
+        outputs = _get_outputs(r, precompile, optimize)
+        if r.endswith('.py') and not first_time:
+            # the outputs of the last export may be in another form, e.g.
+            # precompile mode changed, or the last compilation failed.
+            for x in _get_all_outputs(r):
+                if x not in outputs:
+                    _remove_if_exists('{}/{}'.format(root_o, x))
+        if r in overrides:
+            # for 'sourceless' mode, it is written to be compiled, and
+            # removed after that.
+            write_res(r)
+        elif r in outputs:
+            link_res(r)
+
+    def drop_res(r: T.RelPath) -> None:
+        removed = False
+        for x in _get_all_outputs(r):
+            removed |= _remove_if_exists('{}/{}'.format(root_o, x))
+        if not removed:
+            print('already removed?', r, ':v5')
+
+    executor = _Executor(workers)
+    made_dirs = []
+    dropped_dirs = []
+    placed_res = []
+    compiled_res = []
+    dropped_res = []
+    try:
+        # resources are dropped first, a dropped resource may be replaced by
+        # a directory of the same path (e.g. switching precompile mode).
+        executor.run(drop_res, res_to_drop, dropped_res)
+        # removing a directory removes its sub directories as well.
+        executor.run(drop_dir, _get_topmost_dirs(dirs_to_drop), dropped_dirs)
+        # directories are made level by level, parents before children.
+        executor.run_levels(make_dir, dirs_to_make, made_dirs)
+        executor.run(put_res, res_to_add + res_to_update, placed_res)
+        if res_to_compile:
+            failed = _compile_sources(
+                root_i,
+                root_o,
+                res_to_compile,
+                precompile,
+                optimize,
+                workers,
+                compiled_res,
+                overrides,
+            )
+            if precompile == 'sourceless':
+                for r in set(res_to_compile) - set(failed):
+                    if r in overrides:
+                        _remove_if_exists('{}/{}'.format(root_o, r))
+                # fall back to the sources. the rewritten ones are in place.
+                executor.run(
+                    link_res,
+                    [r for r in failed if r not in overrides],
+                    compiled_res,
+                )
+                compiled_res.extend(r for r in failed if r in overrides)
+            else:
+                compiled_res.extend(failed)
+    except _ExecutorError as e:
+        # save what has been done, so the next run continues from here.
+        # the fingerprint is left empty, the next run won't be skipped.
+        dropped_dirs = set(dropped_dirs)
+        dropped_res = set(dropped_res)
+        compiling = set(res_to_compile)
         records1: T.Records = {
-            'created_directories': frozenset(tree1),
-            'resource_records': res1,
+            'created_directories': frozenset(
+                d
+                for d in (set(tree0) | set(made_dirs))
+                if not any(x in dropped_dirs for x in _grind_down_dirpath(d))
+            ),
+            'fingerprint': '',
+            'resource_records': {
+                **{r: res0[r] for r in res0 if r not in dropped_res},
+                **{r: res1[r] for r in placed_res if r not in compiling},
+                **{r: res1[r] for r in compiled_res},
+            },
         }
-        cache_maker.save_cache(
-            '{};{}'.format(root_i, root_o) + ':0',
-            'last_dumped_records',
-            records1,
+        cache_maker.save_cache(records_key, 'last_dumped_records', records1)
+        print(
+            ':v8',
+            'export failed, progress saved: {} dirs made, {} dirs dropped, '
+            '{} resources linked, {} resources compiled, '
+            '{} resources dropped'.format(
+                len(made_dirs),
+                len(dropped_dirs),
+                len(placed_res),
+                len(compiled_res),
+                len(dropped_res),
+            ),
         )
+        raise e.error
+    finally:
+        executor.shutdown()
+
+    records1: T.Records = {
+        'created_directories': frozenset(tree1),
+        'fingerprint': fingerprint,
+        'resource_records': res1,
+    }
+    cache_maker.save_cache(records_key, 'last_dumped_records', records1)
+    manifest.save()
     print('export done', ':ptv4')
 
 
 # ------------------------------------------------------------------------------
 
 
+class _ExecutorError(Exception):
+    def __init__(self, item: str, error: BaseException) -> None:
+        super().__init__(item, error)
+        self.item = item
+        self.error = error
+
+
+class _Executor:
+    """
+    runs file operations in a thread pool.
+    file operations are latency bound on network volumes and overlayfs, so
+    threads help even with the GIL. the pending tasks are bounded (a
+    semaphore), so a huge batch doesn't pile up futures in memory. if an
+    operation fails, no more tasks are submitted, the running ones are
+    waited, then `_ExecutorError` is raised.
+    if `workers` is 0 or 1, operations run in the calling thread.
+    """
+
+    def __init__(self, workers: int = 0, queue_size: int = 0) -> None:
+        self._error = None
+        self._lock = threading.Lock()
+        self._pool = (
+            ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        )
+        self._slots = threading.BoundedSemaphore(
+            queue_size or max(1, workers) * 4
+        )
+
+    def run(
+        self,
+        func: tp.Callable[[str], None],
+        items: tp.Iterable[str],
+        done: tp.List[str],
+    ) -> None:
+        """
+        run `func(item)` for each item, the succeeded items are appended to
+        `done`.
+        """
+        if self._pool is None:
+            for x in items:
+                try:
+                    func(x)
+                except Exception as e:
+                    raise _ExecutorError(x, e)
+                done.append(x)
+            return
+
+        def task(x: str) -> None:
+            try:
+                func(x)
+            except Exception as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = _ExecutorError(x, e)
+            else:
+                with self._lock:
+                    done.append(x)
+            finally:
+                self._slots.release()
+
+        futures = []
+        for x in items:
+            self._slots.acquire()
+            if self._error:
+                self._slots.release()
+                break
+            futures.append(self._pool.submit(task, x))
+        wait(futures)
+        if self._error:
+            raise self._error
+
+    def run_levels(
+        self,
+        func: tp.Callable[[T.RelDirPath], None],
+        dirs: tp.Iterable[T.RelDirPath],
+        done: tp.List[T.RelDirPath],
+    ) -> None:
+        """
+        run `func` on directories level by level, a level starts after the
+        upper level is done.
+        """
+        levels = defaultdict(list)
+        for d in dirs:
+            levels[d.count('/')].append(d)
+        for i in sorted(levels):
+            self.run(func, levels[i], done)
+
+    def shutdown(self) -> None:
+        if self._pool:
+            self._pool.shutdown()
+
+
 def _analyze_dirs_tobe_created(
     todo_relfiles: T.TodoFiles, todo_reldirs: T.TodoDirs
 ) -> T.TodoDirs:
@@ -300,6 +666,110 @@ def _analyze_dirs_tobe_created(
     return out
 
 
+def _compile_source(job: tp.Tuple[str, str, tp.Optional[str], int]) -> str:
+    """
+    returns error message if failed, or empty string.
+    """
+    file_i, file_o, display_path, optimize = job
+    try:
+        py_compile.compile(
+            file_i, file_o, display_path, doraise=True, optimize=optimize
+        )
+    except py_compile.PyCompileError as e:
+        return '{}: {}'.format(e.exc_type_name, e.exc_value)
+    return ''
+
+
+def _compile_sources(
+    root_i: T.AbsDirPath,
+    root_o: T.AbsDirPath,
+    relfiles: tp.Sequence[T.RelFilePath],
+    precompile: T.Precompile,
+    optimize: int,
+    workers: int,
+    done: tp.List[T.RelFilePath],
+    overrides: T.Overrides,
+) -> tp.List[T.RelFilePath]:
+    """
+    compile sources in a pool of `workers` processes. the compiled ones are
+    appended to `done`, the failed ones (e.g. python 2 syntax) are returned.
+    the overridden sources are compiled from the written ones in `root_o`.
+    """
+    jobs = [
+        (
+            '{}/{}'.format(root_o if r in overrides else root_i, r),
+            '{}/{}'.format(root_o, _get_outputs(r, precompile, optimize)[-1]),
+            r if precompile == 'sourceless' else None,
+            optimize,
+        )
+        for r in relfiles
+    ]
+    print(':v2', 'compile {} sources'.format(len(jobs)))
+    failed = []
+    try:
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = pool.map(
+                _compile_source,
+                jobs,
+                chunksize=max(1, len(jobs) // (workers * 4)),
+            )
+        else:
+            pool = None
+            results = map(_compile_source, jobs)
+        try:
+            for r, error in zip(relfiles, results):
+                if error:
+                    print(':v6', 'cannot compile {}: {}'.format(r, error))
+                    failed.append(r)
+                else:
+                    done.append(r)
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+    except Exception as e:
+        raise _ExecutorError('<compile>', e)
+    return failed
+
+
+def _copy_file(i: T.AbsFilePath, o: T.AbsFilePath) -> None:
+    """
+    copy the content in kernel space if possible: `os.copy_file_range` first
+    (it makes a reflink on btrfs / xfs, and a server side copy on nfs 4.2),
+    then `shutil.copyfile` (which uses `sendfile` on linux and `fcopyfile` on
+    macos), in case the former is not supported by the system or the file
+    systems. the permission bits and the times are copied as well, the
+    timestamp based pycs compiled from `i` must stay valid for `o`.
+    """
+    global _copy_file_range_ok
+    copied = False
+    with open(i, 'rb') as fi, open(o, 'wb') as fo:
+        if _copy_file_range_ok:
+            try:
+                while os.copy_file_range(fi.fileno(), fo.fileno(), 1 << 30):
+                    pass
+            except OSError as e:
+                if e.errno not in _COPY_FALLBACK_ERRNOS:
+                    raise
+                if e.errno == errno.ENOSYS:
+                    _copy_file_range_ok = False
+            else:
+                copied = True
+    if not copied:
+        shutil.copyfile(i, o)
+    shutil.copystat(i, o)
+
+
+_COPY_FALLBACK_ERRNOS = (
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+)
+_copy_file_range_ok = hasattr(os, 'copy_file_range')
+
+
 def _eliminate_overlapping_resources(
     reldirs: T.TodoDirs, relfiles: T.TodoFiles, verbose: bool = False
 ) -> tp.Tuple[T.TodoDirs, T.TodoFiles]:
@@ -354,6 +824,78 @@ def _eliminate_overlapping_resources(
     return reldirs, relfiles
 
 
+def _get_all_outputs(r: T.RelPath) -> tp.List[T.RelPath]:
+    """
+    all possible outputs of a resource, in any precompile mode.
+    """
+    if r.endswith('.py'):
+        return [
+            r,
+            r[:-3] + '.pyc',
+            *(cache_from_source(r, optimization=x or '') for x in (0, 1, 2)),
+        ]
+    return [r]
+
+
+def _get_content_stamp(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest())
+
+
+def _get_materialize_salt(materialize: T.Materialize) -> int:
+    """
+    mixed into the stamps of all resources (except for 'symlink' mode), so
+    they are put again when the mode changes. 'copy' and 'copy_if_changed'
+    have the same output.
+    """
+    if materialize == 'copy_if_changed':
+        materialize = 'copy'
+    return int.from_bytes(
+        hashlib.blake2b(materialize.encode(), digest_size=8).digest()
+    )
+
+
+def _get_outputs(
+    r: T.RelPath, precompile: T.Precompile, optimize: int
+) -> tp.List[T.RelPath]:
+    """
+    the last one is the compiled file, if `r` is to be compiled.
+    """
+    if precompile and r.endswith('.py'):
+        if precompile == 'pycache':
+            return [r, cache_from_source(r, optimization=optimize or '')]
+        assert precompile == 'sourceless'
+        return [r[:-3] + '.pyc']
+    return [r]
+
+
+def _get_precompile_salt(precompile: T.Precompile, optimize: int) -> int:
+    """
+    mixed into the stamps of the compiled sources, so they are compiled
+    again when the options or the interpreter change.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(
+            '{}:{}:{}'.format(
+                precompile, optimize, sys.implementation.cache_tag
+            ).encode(),
+            digest_size=8,
+        ).digest()
+    )
+
+
+def _get_topmost_dirs(dirs: tp.Iterable[T.RelDirPath]) -> tp.List[T.RelDirPath]:
+    """
+    exclude the dirs whose ancestor is also in `dirs`.
+    """
+    dirs = sorted(dirs)
+    all_ = set(dirs)
+    return [
+        d
+        for d in dirs
+        if not any(x in all_ for x in tuple(_grind_down_dirpath(d))[:-1])
+    ]
+
+
 def _grind_down_dirpath(path: str) -> tp.Iterator[str]:
     a, *b = path.split('/')
     yield a
@@ -362,6 +904,51 @@ def _grind_down_dirpath(path: str) -> tp.Iterator[str]:
         yield a
 
 
+def _materialize_file(
+    i: T.AbsFilePath, o: T.AbsFilePath, materialize: T.Materialize
+) -> None:
+    """
+    put a hard link or a copy of `i` at `o`, see `T.Materialize`. an existing
+    `o` is replaced, it may be a symlink to the source, so it is never
+    written through.
+    """
+    if materialize == 'copy_if_changed':
+        if (
+            not os.path.islink(o)
+            and os.path.isfile(o)
+            and not os.path.samefile(i, o)  # e.g. a hard link.
+            and os.path.getsize(o) == os.path.getsize(i)
+            and cache_maker.hash_file(o) == cache_maker.hash_file(i)
+        ):
+            # the source may be touched only, keep the times in sync for the
+            # pycs compiled from it.
+            shutil.copystat(i, o)
+            instrument.count('files_unchanged')
+            return
+    _remove_if_exists(o)
+    if materialize == 'hardlink':
+        try:
+            os.link(i, o)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+        else:
+            instrument.count('files_hardlinked')
+            return
+    _copy_file(i, o)
+    if instrument.enabled:
+        instrument.count('files_copied')
+        instrument.count('bytes_copied', os.path.getsize(o))
+
+
+def _remove_if_exists(path: T.AbsPath) -> bool:
+    if os.path.lexists(path):
+        fs.remove(path)
+        return True
+    return False
+
+
+@instrument.timed('mount')
 def _mount_resources(
     config: T.Config, source_root: T.AbsDirPath, verbose: bool = False
 ) -> tp.Tuple[T.TodoFiles, T.TodoDirs]:
@@ -371,7 +958,7 @@ def _mount_resources(
 
     for entry_path in config['entries']:
         graph: T.DumpedModuleGraph = cache_maker.get_cache(  # type: ignore
-            entry_path + ':1', 'module_graphs', persistent=True
+            entry_path + ':0', 'module_graphs', persistent=True
         )
         assert graph
 
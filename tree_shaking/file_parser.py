@@ -1,5 +1,6 @@
 import ast
 import atexit
+import os
 import typing as tp
 from contextlib import contextmanager
 
@@ -9,12 +10,16 @@ from lk_utils import fs
 
 from .cache import cache_maker
 from .cache import cache_root
+from .dist_info import dist_index
+from .instrument import instrument
 from .module import ModuleInfo
 from .module import ModuleInspector
 from .module import ModuleNotFound
 from .module import PathNotFound
 from .module import T as T0
 from .path_scope import path_scope
+from .scanner import T as T1
+from .scanner import scanner
 
 # devnote: currently, this is an empty tuple.
 DEFAULT_IGNORES = tuple(fs.load(fs.here('_cache/ignores.txt')).splitlines())
@@ -22,13 +27,23 @@ DEFAULT_IGNORES = tuple(fs.load(fs.here('_cache/ignores.txt')).splitlines())
 broken_modules = set()
 module_inspector = ModuleInspector(ignores=DEFAULT_IGNORES)
 new_parsing_triggered = Signal(str)
+prefetched_nodes = {}
+#   {file: ((node, line, context), ...), ...}
+#       filled by `Finder.prefetch`, consumed (popped) by
+#       `FileParser.parse_nodes`.
+shared_parsing = os.getenv('TREE_SHAKING_CACHE_SHARED', '') not in ('', '0')
+#   share the scan results of installed distributions across search paths,
+#   e.g. a fresh venv reuses the results of another venv which has the same
+#   version installed. see `get_shared_nodes`.
 
 
 class T(T0):
-    AstNode = tp.Union[ast.Import, ast.ImportFrom]
+    AstNode = T1.AstNode
+    Context = T1.Context
     ImportsInfo = tp.Iterable[tp.Tuple[T0.ModuleInfo, T0.FilePath]]
     #   ((module_info, path), ...)
     #       module_info: dataclass ModuleInfo
+    ScanResult = T1.ScanResult
 
 
 class FileParser:
@@ -36,25 +51,23 @@ class FileParser:
         self.file = file
         self.dir = fs.parent(file)
 
-        if self.file in path_scope.path_2_module:
+        if (x := path_scope.find_top(self.file)) is None:
+            raise Exception(
+                'file should be existed in registered path scopes', file
+            )
+        top_path, top_name = x
+        if top_path == self.file:
             self.base_dir = self.dir
             self.base_module_segs = ()
-        elif self.dir in path_scope.path_2_module:
+        elif top_path == self.dir:
             self.base_dir = self.dir
-            self.base_module_segs = (path_scope.path_2_module[self.dir],)
+            self.base_module_segs = (top_name,)
         else:
-            for top_path, top_name in path_scope.path_2_module.items():
-                if self.file.startswith(top_path + '/'):
-                    self.base_dir = top_path
-                    self.base_module_segs = (
-                        top_name,
-                        *self.dir[len(top_path) + 1 :].split('/'),
-                    )
-                    break
-            else:
-                raise Exception(
-                    'file should be existed in registered path scopes', file
-                )
+            self.base_dir = top_path
+            self.base_module_segs = (
+                top_name,
+                *self.dir[len(top_path) + 1 :].split('/'),
+            )
 
     @property
     def module_info(self) -> ModuleInfo:
@@ -81,10 +94,14 @@ class FileParser:
             )
         ) is not None:
             return x
+        if scanner.should_skip(self.file):
+            # do not cache it, the result depends on scanner options.
+            print(':v6', 'skip oversized file', self.file)
+            return ()
         new_parsing_triggered.emit(self.file)
         out = []
-        for node, line in self.parse_nodes(self.file):
-            for module in self._get_module_info(node, line):
+        for node, line, context in self.parse_nodes(self.file):
+            for module in self._get_module_info(node, line, context):
                 try:
                     path = self._get_module_path(module)
                 except (ModuleNotFound, PathNotFound):
@@ -114,19 +131,23 @@ class FileParser:
         )
         return out
 
-    def parse_nodes(self, file: str) -> tp.Iterator[tp.Tuple[T.AstNode, str]]:
+    def parse_nodes(
+        self, file: str
+    ) -> tp.Iterator[tp.Tuple[T.AstNode, str, T.Context]]:
+        if (x := prefetched_nodes.pop(file, None)) is not None:
+            yield from x
+            return
+        if shared_parsing:
+            if (x := get_shared_nodes((file,))[0]) is not None:
+                yield from x
+                return
         print(':vi', 'ast parsing file', file)
-        source_text = fs.load(file, 'plain')
-        source_lines = source_text.splitlines()
-        try:
-            tree = ast.parse(source_text, file)
-        except SyntaxError:
-            print(':v8', 'syntax error when parsing file', file)
-        else:
-            for node in ast.walk(tree):
-                if isinstance(node, (ast.Import, ast.ImportFrom)):
-                    line = source_lines[node.lineno - 1]
-                    yield node, line
+        instrument.count('files_parsed')
+        with instrument.phase('parse'):
+            nodes = scanner.scan(file)
+        if shared_parsing:
+            save_shared_nodes(file, nodes)
+        yield from nodes
 
     def _check_if_relative_import(self, line: str) -> int:
         x = line.lstrip().split()[1]
@@ -141,7 +162,7 @@ class FileParser:
         return dot_cnt
 
     def _get_module_info(
-        self, node: T.AstNode, line: str
+        self, node: T.AstNode, line: str, context: T.Context = 'hard'
     ) -> tp.Iterator[T.ModuleInfo]:  # noqa
         if dot_cnt := self._check_if_relative_import(line):
             if dot_cnt == 1:
@@ -169,6 +190,7 @@ class FileParser:
                     name2='',
                     level=dot_cnt,
                     base_dir=base_dir,
+                    context=context,
                 )
         if isinstance(node, ast.ImportFrom):
             for alias in node.names:
@@ -205,13 +227,54 @@ class FileParser:
                     name2=alias.name,
                     level=dot_cnt,
                     base_dir=base_dir,
+                    context=context,
                 )
 
+    @instrument.timed('resolve')
     def _get_module_path(self, module: T.ModuleInfo) -> T.FilePath:
         # assert '//' not in module_inspector.find_module_path(module), module
         return module_inspector.find_module_path(module)
 
 
+def get_shared_nodes(
+    files: tp.Sequence[T.FilePath],
+) -> tp.List[tp.Optional[T.ScanResult]]:
+    """
+    the scan results of `files` saved from any search path, as long as they
+    are installed by the same distribution version with the same content.
+    the results are in the same order as `files`, None for the missing ones
+    and the files not installed by a distribution.
+    notice: the results are relative (module names and import lines), they
+    are still resolved to paths per search path. to share them between
+    venvs, point `TREE_SHAKING_CACHE_ROOT` of the venvs to the same folder.
+    """
+    keys = tuple(map(_get_shared_key, files))
+    found = iter(
+        cache_maker.get_many_caches(
+            (x for x in keys if x), 'shared_parsing_results'
+        )
+    )
+    return [next(found) if x else None for x in keys]
+
+
+def save_shared_nodes(file: T.FilePath, nodes: T.ScanResult) -> None:
+    if scanner.should_skip(file):
+        return
+    if key := _get_shared_key(file):
+        cache_maker.save_cache(key, 'shared_parsing_results', nodes)
+
+
+def _get_shared_key(file: T.FilePath) -> tp.Optional[str]:
+    """
+    '<name>==<version>/<relpath>@<digest>:0', or None if `file` is not
+    installed by a distribution.
+    """
+    if (x := dist_index.find(file)) is None:
+        return None
+    relpath, (dist, _, _) = x
+    return '{}/{}@{}:0'.format(dist, relpath, cache_maker.hash_file(file))
+
+
 class ErrorRecords:
     def __init__(self) -> None:
         self._records = []
@@ -1,13 +1,25 @@
 import typing as tp
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
+import neoprint as np
 from lk_utils import fs
 
 from .cache import cache_maker
+from .dir_index import dir_index
 from .file_parser import DEFAULT_IGNORES
 from .file_parser import FileParser
 from .file_parser import T
+from .file_parser import get_shared_nodes
+from .file_parser import prefetched_nodes
+from .file_parser import save_shared_nodes
+from .file_parser import shared_parsing
+from .instrument import instrument
+from .module import ModuleInspector
+from .module import ModuleNotFound
+from .module import PathNotFound
 from .patch import patch
+from .scanner import scanner
 
 
 class Finder:
@@ -16,7 +28,14 @@ class Finder:
         global_ignores: tp.Union[
             tp.FrozenSet[T.ModuleName], tp.Tuple[T.ModuleName, ...]
         ] = DEFAULT_IGNORES,
+        excluded_contexts: tp.Iterable[T.Context] = (),
     ) -> None:
+        """
+        params:
+            excluded_contexts: imports in these contexts are not followed.
+                see `scanner.T.Context`.
+        """
+        self._excluded_contexts = frozenset(excluded_contexts)
         self._global_ignores = global_ignores
         self._patched_modules = set()
         self._references = defaultdict(set)
@@ -94,11 +113,15 @@ class Finder:
             assert self_module_name
             yield self_module_name, parser.file
 
-        more_files = set()
+        more_files = {}
+        #   an ordered set. the traversal order decides which alias names
+        #   get yielded, so it must not depend on hash seeds.
         for module, path in parser.parse_imports():
             # print(module, path)
             if module.top.lower() in self._global_ignores:
                 continue
+            if module.context in self._excluded_contexts:
+                continue
             self._references[self_module_name].add(module.full_name)
             if path in self._resolved_files:
                 continue
@@ -109,7 +132,7 @@ class Finder:
             if path.endswith(('.pyc', '.pyd')):
                 continue
             else:  # endswith '.py'
-                more_files.add((path, None))
+                more_files[(path, None)] = None
 
             if path.endswith('/__init__.py'):
                 continue
@@ -119,20 +142,20 @@ class Finder:
                 )
                 if possible_init_file in self._resolved_files:
                     continue
-                elif fs.exist(possible_init_file):
-                    more_files.add(
+                elif dir_index.exists(possible_init_file):
+                    more_files[
                         (
                             possible_init_file,
                             True if include_self in (True, None) else False,
                         )
-                    )
+                    ] = None
                 else:
                     self._resolved_files.add(possible_init_file)
 
         for path in self._more_imports(parser.module_info):
-            more_files.add(
+            more_files[
                 (path, True if include_self in (True, None) else False)
-            )
+            ] = None
 
         self._resolved_files.add(script)
 
@@ -146,25 +169,135 @@ class Finder:
 
     reset = _clear_holders
 
+    def prefetch(self, scripts: tp.Iterable[T.FilePath], workers: int) -> None:
+        """
+        parse the import graph of `scripts` in a process pool, ahead of
+        `get_all_imports`.
+        the frontier is expanded breadth-first: each round hands all unparsed
+        files to the workers, then resolves their imports (in this process)
+        to find the next round. parsed nodes are put into
+        `file_parser.prefetched_nodes`, the following serial walk consumes
+        them instead of parsing again. path resolution and cache writes are
+        still done by the serial walk, so its result doesn't change.
+        """
+        # a scratch inspector, resolving in another order must not affect the
+        # state of the global one.
+        inspector = ModuleInspector(ignores=DEFAULT_IGNORES)
+        patched_modules = set()
+        seen = set()
+        frontier = list(dict.fromkeys(scripts))
+
+        def expand(
+            file: T.FilePath, imports: T.ImportsInfo
+        ) -> tp.Iterator[T.FilePath]:
+            for module, path in imports:
+                if module.top.lower() in self._global_ignores:
+                    continue
+                if module.context in self._excluded_contexts:
+                    continue
+                if path in ('<stdlib>', '<ignored>'):
+                    continue
+                if path.endswith(('.pyc', '.pyd')):
+                    continue
+                yield path
+                if not path.endswith('/__init__.py'):
+                    x = '{}/__init__.py'.format(path.rsplit('/', 1)[0])
+                    if dir_index.exists(x):
+                        yield x
+            module_info = FileParser(file).module_info
+            if module_info.top not in patched_modules:
+                patched_modules.add(module_info.top)
+                yield from _patched_imports(module_info)
+
+        def resolve(parser: FileParser, nodes: T.ScanResult) -> T.ImportsInfo:
+            for node, line, context in nodes:
+                for module in parser._get_module_info(node, line, context):
+                    try:
+                        path = inspector.find_module_path(module)
+                    except (ModuleNotFound, PathNotFound):
+                        continue
+                    except Exception as e:
+                        e.add_note(
+                            np.format(parser.file, node.lineno, module, ':v8ln')
+                        )
+                        raise e
+                    yield module, path
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while frontier:
+                seen.update(frontier)
+                todo = []
+                next_frontier = []
+                for file, x in zip(
+                    frontier,
+                    cache_maker.get_many_caches(
+                        (x + ':1' for x in frontier),
+                        'ast_parsing_results',
+                        persistent=True,
+                    ),
+                ):
+                    if x is not None:
+                        next_frontier.extend(expand(file, x))
+                    elif file not in prefetched_nodes:
+                        todo.append(file)
+                if shared_parsing and todo:
+                    misses = []
+                    for file, nodes in zip(todo, get_shared_nodes(todo)):
+                        if nodes is None:
+                            misses.append(file)
+                        else:
+                            prefetched_nodes[file] = nodes
+                            next_frontier.extend(
+                                expand(file, resolve(FileParser(file), nodes))
+                            )
+                    todo = misses
+                print(
+                    ':v',
+                    'prefetch round: {} files, {} to parse'.format(
+                        len(frontier), len(todo)
+                    ),
+                )
+                instrument.count('files_parsed', len(todo))
+                for file, nodes in zip(
+                    todo,
+                    pool.map(
+                        scanner.scan,
+                        todo,
+                        chunksize=max(1, len(todo) // (workers * 4)),
+                    ),
+                ):
+                    prefetched_nodes[file] = nodes
+                    if shared_parsing:
+                        save_shared_nodes(file, nodes)
+                    next_frontier.extend(
+                        expand(file, resolve(FileParser(file), nodes))
+                    )
+                frontier = [
+                    x for x in dict.fromkeys(next_frontier) if x not in seen
+                ]
+
     def _more_imports(self, module: T.ModuleInfo) -> tp.Iterator[T.FilePath]:
         if module.top in patch:
             if module.top not in self._patched_modules:
                 self._patched_modules.add(module.top)
-                assert module.base_dir
-                # print(module.full_name, patch[module.top]['imports'], ':l')
-                for relpath in patch[module.top]['imports']:
-                    if relpath.endswith('/'):
-                        abspath = fs.normpath(
-                            '{}/{}/__init__.py'.format(
-                                module.base_dir, relpath.rstrip('/')
-                            )
-                        )
-                    elif relpath.endswith(('.pyc', '.pyd')):
-                        raise NotImplementedError
-                    elif relpath.endswith('.py'):
-                        abspath = fs.normpath(
-                            '{}/{}'.format(module.base_dir, relpath)
-                        )
-                    else:
-                        raise Exception(module, relpath)
-                    yield abspath
+                yield from _patched_imports(module)
+
+
+def _patched_imports(module: T.ModuleInfo) -> tp.Iterator[T.FilePath]:
+    if module.top in patch:
+        assert module.base_dir
+        # print(module.full_name, patch[module.top]['imports'], ':l')
+        for relpath in patch[module.top]['imports']:
+            if relpath.endswith('/'):
+                abspath = fs.normpath(
+                    '{}/{}/__init__.py'.format(
+                        module.base_dir, relpath.rstrip('/')
+                    )
+                )
+            elif relpath.endswith(('.pyc', '.pyd')):
+                raise NotImplementedError
+            elif relpath.endswith('.py'):
+                abspath = fs.normpath('{}/{}'.format(module.base_dir, relpath))
+            else:
+                raise Exception(module, relpath)
+            yield abspath
@@ -9,10 +9,19 @@ from .cache import cache_maker
 from .cache import cache_root
 from .config import T as T0
 from .config import parse_config
-from .finder import Finder
+from .dag import ModuleDag
+from .dependency import DependencyIndex
+from .dir_index import dir_index
+from .instrument import T as T2
+from .instrument import instrument
+from .patch import implicit_hooks_file
+from .scanner import T as T1
+from .scanner import scanner
 
 
 class T(T0):
+    Profile = T2.Profile
+    ScannerBackend = T1.Backend
     DumpedModuleGraph = tp.TypedDict(
         'DumpedModuleGraph',
         {'source_roots': tp.Dict[str, str], 'modules': tp.Dict[str, str]},
@@ -26,14 +35,69 @@ class T(T0):
     #   }
 
 
-def build_module_graphs(config_file: str) -> None:
+def build_module_graphs(
+    config_file: str,
+    workers: int = 0,
+    scanner_backend: T.ScannerBackend = 'ast',
+    size_limit: int = 0,
+    skip_oversize: bool = False,
+    report: str = '',
+    profile: T.Profile = '',
+) -> None:
+    """
+    params:
+        workers (-w): if greater than 0, parse files in a pool of N processes
+            before walking the graph. the result is the same as serial mode.
+        scanner_backend (-s): 'ast', 'fast' or 'check'.
+            see also `scanner.T.Backend`.
+        size_limit: flag (or skip, if `skip_oversize` is set) files larger
+            than this size in bytes. 0 means no limit.
+        report (-r): save per-phase timings and counters to this json file.
+            see `instrument.T.Report`.
+        profile (-p): '', 'cpu', 'memory' or 'all'.
+            see `instrument.T.Profile`.
+    """
+    with instrument.session(report, profile, 'build_module_graphs'):
+        _build_module_graphs(
+            config_file, workers, scanner_backend, size_limit, skip_oversize
+        )
+
+
+def _build_module_graphs(
+    config_file: str,
+    workers: int,
+    scanner_backend: T.ScannerBackend,
+    size_limit: int,
+    skip_oversize: bool,
+) -> None:
+    scanner.configure(
+        scanner_backend, size_limit, 'skip' if skip_oversize else 'flag'
+    )
+    dir_index.clear()
     cfg = parse_config(config_file)
-    finder = Finder(cfg['ignores'])
+    finder = ModuleDag(cfg['ignores'], cfg['exclude_imports'])
+
+    with instrument.phase('graph'):
+        deps = DependencyIndex()
+        deps.load(cfg['entries'])
+        outdated = deps.check(cfg['entries'])
+        for entry_path in cfg['entries']:
+            if entry_path not in outdated and not cache_maker.is_cached(
+                entry_path + ':0', 'module_graphs'
+            ):
+                outdated[entry_path] = ['no cached graph']
+        deps.invalidate_parsing_results(outdated)
+
+    if workers > 0 and outdated:
+        with instrument.phase('parse'):
+            finder.prefetch(tuple(outdated), workers)
 
     for entry_path in cfg['entries']:
         print('entry at {}'.format(fs.relpath(entry_path, cfg['root'])), ':i')
-        if not cache_maker.is_cached(entry_path + ':1', 'module_graphs'):
-            result = finder.get_all_imports(entry_path)
+        if entry_path in outdated:
+            with instrument.phase('graph'):
+                result = finder.walk(entry_path)
+                closure = finder.closure(entry_path)
             result = _reformat_paths(sorted(result.items()), cfg)
             # add refs info to result
             # refs = finder.references
@@ -41,7 +105,10 @@ def build_module_graphs(config_file: str) -> None:
             #   k: sorted(refs[k]) for k in sorted(refs.keys())
             # }
             file_c = cache_maker.save_cache(
-                entry_path + ':1', 'module_graphs', result
+                entry_path + ':0', 'module_graphs', result
+            )
+            deps.update(
+                entry_path, _get_dependency_factors(closure, cfg, config_file)
             )
 
             print(
@@ -49,12 +116,15 @@ def build_module_graphs(config_file: str) -> None:
                 tw.wrap(
                     """
                     entry: {}
+                    rebuilt because: {}
                     source_roots: 
                         {}
                     dumped_modules_count: {}
+                    reachable_files_count: {} (of {} in shared graph)
                     cache: {} ({})
                     """.format(
                         entry_path,
+                        _format_reasons(outdated[entry_path]),
                         tw.join(
                             (
                                 '{}: {}'.format(k, v)
@@ -63,15 +133,53 @@ def build_module_graphs(config_file: str) -> None:
                             indent=24,
                         ),
                         len(result['modules']),
+                        len(closure),
+                        len(finder.nodes),
                         '<tree_shaking_cache>/{}'.format(
                             fs.relpath(file_c, cache_root)
                         ),
-                        fs.filesize(file_c, str),
+                        fs.pretty_size(
+                            cache_maker.get_size(
+                                entry_path + ':0', 'module_graphs'
+                            )
+                        ),
                     ),
                     indent=4,
                     lstrip=False,
                 ),
             )
+        else:
+            print(':v', 'up to date')
+
+    print(
+        'rebuilt {} of {} entries'.format(len(outdated), len(cfg['entries'])),
+        ':v2',
+    )
+
+
+def _format_reasons(reasons: tp.List[str], limit: int = 3) -> str:
+    if len(reasons) > limit:
+        return '{} (and {} more)'.format(
+            '; '.join(reasons[:limit]), len(reasons) - limit
+        )
+    return '; '.join(reasons)
+
+
+def _get_dependency_factors(
+    files: tp.Iterable[str], config: T.Config, config_file: str
+) -> tp.Iterator[str]:
+    """
+    see `dependency.T.Vector`.
+    """
+    files = sorted(files)
+    for f in files:
+        yield f + ':1'
+    for d in sorted(set(f.rsplit('/', 1)[0] for f in files)):
+        yield d + ':1'
+    for p in config['search_paths']:
+        yield p + ':1'
+    yield fs.abspath(config_file) + ':1'
+    yield implicit_hooks_file + ':1'
 
 
 def _reformat_paths(
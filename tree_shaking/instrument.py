@@ -0,0 +1,307 @@
+"""
+per-phase timers, counters and optional profilers for `build_module_graphs`
+and `dump_tree`.
+instrumentation is off by default, the hooks in other modules cost a flag
+check then. a session (`instrument.session`) turns it on, and dumps a json
+report at the end.
+"""
+
+import cProfile
+import functools
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import typing as tp
+from collections import defaultdict
+from contextlib import contextmanager
+from contextlib import nullcontext
+
+from lk_utils import fs
+
+
+class T:
+    Phase = tp.Literal[
+        'config',
+        'scope_scan',
+        'parse',
+        'resolve',
+        'graph',
+        'mount',
+        'dce',
+        'minify',
+        'export',
+        'cache',
+    ]
+    #   config: `config.parse_config`, excluding `scope_scan`.
+    #   scope_scan: scan (or restore) the search paths.
+    #   parse: scan import statements of a file. with `workers`, the whole
+    #       prefetch (see `finder.Finder.prefetch`) counts here.
+    #   resolve: find the path of an imported module.
+    #   graph: walk the module graphs, excluding `parse` and `resolve`.
+    #   mount: collect resources to export from the module graphs.
+    #   dce: `symbols.shake_symbols`.
+    #   minify: `minify.minify_sources`.
+    #   export: file operations and compilation of the export.
+    #   cache: load and save cache entries (including pickling), it is
+    #       excluded from the other phases.
+    Profile = tp.Literal['', 'cpu', 'memory', 'all']
+    #   cpu: cProfile. memory: tracemalloc. all: both.
+    Report = tp.TypedDict(
+        'Report',
+        {
+            'name': str,
+            'python': str,
+            'total_seconds': float,
+            'phases': tp.Dict[str, tp.Dict[str, tp.Union[int, float]]],
+            'counters': tp.Dict[str, int],
+            'cache': tp.Dict[str, tp.Dict[str, int]],
+            'cpu': tp.List[tp.Dict[str, tp.Any]],
+            'memory': tp.Dict[str, tp.Any],
+        },
+    )
+    #   name: the function which opens the session.
+    #   phases: {phase: {'seconds': float, 'calls': int}, ...}
+    #       seconds is exclusive, the time of nested phases is not counted
+    #       in the outer one. 'other' is the time out of any phase.
+    #   counters: {name: int, ...}
+    #       files_parsed: files scanned for imports (not from cache).
+    #       fs.exist: calls of `lk_utils.fs.exist`.
+    #       os.listdir, os.scandir: calls of them.
+    #       files_linked, dirs_linked, bytes_linked: resources linked by the
+    #           export. bytes of linked directories are not counted.
+    #       files_written, bytes_written: resources written by the export,
+    #           see `export.T.Overrides`.
+    #       files_copied, bytes_copied, files_hardlinked, files_unchanged:
+    #           resources put by the export in other modes than 'symlink',
+    #           see `export.T.Materialize`.
+    #   cache: {thread: {'hits': int, 'misses': int}, ...}
+    #   cpu: top functions by self time, if cpu profiling is enabled.
+    #       [{'function': str, 'calls': int, 'tottime': float,
+    #       'cumtime': float}, ...]
+    #   memory: if memory profiling is enabled.
+    #       {'peak_kb': int, 'top': [{'where': str, 'size_kb': float,
+    #       'count': int}, ...]}
+
+
+class Instrument:
+    def __init__(self) -> None:
+        self.enabled = False
+        self._cache = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+        self._phases = defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+        self._stack = []
+        #   [[phase, start, nested_seconds], ...]
+        #       phases are measured in the main thread only.
+
+    @contextmanager
+    def session(
+        self, report: str = '', profile: T.Profile = '', name: str = ''
+    ) -> tp.Iterator[None]:
+        """
+        params:
+            report: a json file to save the report. if empty and `profile`
+                is not set, the session does nothing.
+            profile: see `T.Profile`. the cpu stats are also saved as
+                "<report>.prof" (for `snakeviz`, `pstats`, etc.).
+            name: shown in the report.
+        a session opened inside another one does nothing, the outer one
+        covers it.
+        """
+        assert profile in ('', 'cpu', 'memory', 'all'), profile
+        if self.enabled or not (report or profile):
+            yield
+            return
+        self._reset()
+        self.enabled = True
+        patches = self._patch_counters()
+        profiler = None
+        if profile in ('cpu', 'all'):
+            profiler = cProfile.Profile()
+        if profile in ('memory', 'all'):
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            if profiler:
+                profiler.enable()
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            total = time.perf_counter() - start
+            self.enabled = False
+            for obj, attr, func in patches:
+                setattr(obj, attr, func)
+            out = self._make_report(name, total)
+            # before the cpu stats, which allocate memory as well.
+            if tracemalloc.is_tracing():
+                out['memory'] = _summarize_memory()
+                tracemalloc.stop()
+            if profiler:
+                out['cpu'] = _summarize_cpu(profiler)
+                if report:
+                    profiler.dump_stats(report + '.prof')
+            self._show(out)
+            if report:
+                fs.dump(out, report)
+                print('saved instrument report to {}'.format(report), ':v4')
+
+    def phase(self, name: T.Phase) -> tp.ContextManager:
+        if self.enabled and threading.current_thread() is _MAIN_THREAD:
+            return _Phase(self, name)
+        return _NULL
+
+    def timed(self, name: T.Phase) -> tp.Callable[[tp.Callable], tp.Callable]:
+        """
+        a decorator, measures each call of the function as a phase.
+        """
+
+        def decorator(func: tp.Callable) -> tp.Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            with self._lock:
+                self._counters[name] += n
+
+    def count_cache(self, thread: str, hit: bool) -> None:
+        if self.enabled:
+            with self._lock:
+                self._cache[thread]['hits' if hit else 'misses'] += 1
+
+    def _make_report(self, name: str, total: float) -> T.Report:
+        phases = {k: dict(v) for k, v in sorted(self._phases.items())}
+        phases['other'] = {
+            'seconds': total - sum(x['seconds'] for x in phases.values()),
+            'calls': 1,
+        }
+        return {
+            'name': name,
+            'python': sys.version,
+            'total_seconds': total,
+            'phases': phases,
+            'counters': dict(sorted(self._counters.items())),
+            'cache': {k: dict(v) for k, v in sorted(self._cache.items())},
+            'cpu': [],
+            'memory': {},
+        }
+
+    def _patch_counters(self) -> tp.List[tp.Tuple[object, str, tp.Callable]]:
+        """
+        wrap the functions whose calls are counted. returns the originals to
+        restore.
+        """
+        out = []
+        for obj, attr, key in (
+            (fs, 'exist', 'fs.exist'),
+            (os, 'listdir', 'os.listdir'),
+            (os, 'scandir', 'os.scandir'),
+        ):
+            func = getattr(obj, attr)
+            setattr(obj, attr, self._counted(func, key))
+            out.append((obj, attr, func))
+        return out
+
+    def _counted(self, func: tp.Callable, key: str) -> tp.Callable:
+        counters = self._counters
+        lock = self._lock
+
+        def wrapper(*args, **kwargs):
+            with lock:
+                counters[key] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    def _reset(self) -> None:
+        self._cache.clear()
+        self._counters.clear()
+        self._phases.clear()
+        self._stack.clear()
+
+    @staticmethod
+    def _show(report: T.Report) -> None:
+        print(
+            ':v2',
+            'instrument ({}): {:.3f}s'.format(
+                report['name'], report['total_seconds']
+            ),
+        )
+        for k, v in sorted(
+            report['phases'].items(), key=lambda x: -x[1]['seconds']
+        ):
+            print(
+                ':i2',
+                '{:<12} {:>9.3f}s {:>8} calls'.format(
+                    k, v['seconds'], v['calls']
+                ),
+            )
+
+
+class _Phase:
+    __slots__ = ('_instrument', '_name')
+
+    def __init__(self, instrument: Instrument, name: T.Phase) -> None:
+        self._instrument = instrument
+        self._name = name
+
+    def __enter__(self) -> None:
+        self._instrument._stack.append([self._name, time.perf_counter(), 0.0])
+
+    def __exit__(self, *_) -> None:
+        name, start, nested = self._instrument._stack.pop()
+        elapsed = time.perf_counter() - start
+        x = self._instrument._phases[name]
+        x['seconds'] += elapsed - nested
+        x['calls'] += 1
+        if self._instrument._stack:
+            self._instrument._stack[-1][2] += elapsed
+
+
+def _summarize_cpu(
+    profiler: cProfile.Profile, limit: int = 30
+) -> tp.List[tp.Dict[str, tp.Any]]:
+    stats = pstats.Stats(profiler).stats  # type: ignore
+    top = sorted(stats.items(), key=lambda x: -x[1][2])[:limit]
+    return [
+        {
+            'function': '{}:{}({})'.format(*func),
+            'calls': nc,
+            'tottime': tt,
+            'cumtime': ct,
+        }
+        for func, (_, nc, tt, ct, _) in top
+    ]
+
+
+def _summarize_memory(limit: int = 20) -> tp.Dict[str, tp.Any]:
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    )
+    return {
+        'peak_kb': tracemalloc.get_traced_memory()[1] // 1024,
+        'top': [
+            {
+                'where': str(x.traceback),
+                'size_kb': round(x.size / 1024, 1),
+                'count': x.count,
+            }
+            for x in snapshot.statistics('lineno')[:limit]
+        ],
+    }
+
+
+_MAIN_THREAD = threading.main_thread()
+_NULL = nullcontext()
+
+instrument = Instrument()
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import typing as tp
+
+from . import dist_info
+from .cache import cache_maker
+from .dist_info import dist_index
+from .path_typing import T as T0
+
+
+class T(T0):
+    Entry = tp.Tuple[int, int, str]
+    #   (size, mtime_ns, digest)
+    #       mtime_ns: -1 if the entry is read from a RECORD file.
+    #       digest: blake2b hex digest of the content, or empty string if
+    #       content hash is not enabled. for the entries read from RECORD
+    #       files, it is the recorded digest, e.g. 'sha256=<...>'.
+    Entries = tp.Dict[T0.RelFilePath, Entry]
+    Stamp = int
+    Stamps = tp.Dict[T0.RelPath, Stamp]
+
+
+class SourceManifest:
+    """
+    a persisted manifest of the source files under `root`, used to tell which
+    exported resources have changed.
+    a file resource is stamped by its entry, a directory resource is stamped
+    by all the files (and sub directory names) under it. the manifest is
+    refreshed incrementally: the directories are walked with `os.scandir` in
+    one pass, only the files whose size or mtime changed get hashed again.
+    a resident manifest (see `keep`) also keeps the stamps between exports,
+    only the paths reported by `touch` are visited again.
+    if `dist_info.enabled` and `root` is a search path, the files listed in
+    RECORD files are stamped by their recorded digests, and the directories
+    owned by distributions are expanded from RECORD files. neither is read
+    from disk.
+    """
+
+    def __init__(self, root: T.AbsDirPath, content_hash: bool = False) -> None:
+        self.root = root
+        self._changed = False
+        self._content_hash = content_hash
+        self._entries0: T.Entries = (
+            cache_maker.get_cache(root + ':0', 'source_manifest') or {}
+        )
+        self._entries1: T.Entries = {}
+        self._index = {}
+        #   see `dist_info.T.Index`, it is loaded by `stamp`.
+        self._members0 = {}
+        self._members1 = {}
+        #   {reldir: (relfile, ...), ...}
+        #       the files under a directory resource, when it is stamped.
+        self._stamps0: T.Stamps = {}
+        self._stamps1: T.Stamps = {}
+        #   the stamps of the last saved export, and of the current one.
+
+    @property
+    def entries(self) -> T.Entries:
+        """
+        entries of all the files visited by `stamp`, including the files
+        under directory resources. (`__pycache__` folders are excluded.)
+        """
+        return self._entries1
+
+    @property
+    def last_entries(self) -> T.Entries:
+        """
+        entries of the last saved export.
+        """
+        return self._entries0
+
+    def keep(self) -> None:
+        """
+        make the manifest resident: `get_manifest` returns it for the same
+        root, and the stamps of the last saved export are reused as is.
+        notice: the caller must report every change under `root` by `touch`,
+        see `watch.Watcher`.
+        """
+        _residents[(self.root, self._content_hash)] = self
+
+    def touch(self, relpaths: tp.Iterable[T.RelPath]) -> None:
+        """
+        forget the stamps of `relpaths`, their parent directories and the
+        paths under them, they are stamped again by the next `stamp`.
+        """
+        drop = set()
+        prefixes = []
+        for r in relpaths:
+            prefixes.append(r + '/')
+            drop.add(r)
+            while '/' in r:
+                r = r.rsplit('/', 1)[0]
+                drop.add(r)
+        if drop:
+            prefixes = tuple(prefixes)
+            for k in tuple(self._stamps0):
+                if k in drop or k.startswith(prefixes):
+                    del self._stamps0[k]
+
+    def stamp(
+        self, files: tp.Iterable[T.RelFilePath], dirs: tp.Iterable[T.RelDirPath]
+    ) -> T.Stamps:
+        out = {}
+        if dist_info.enabled:
+            self._index = dist_index.get_index(self.root)
+        for r in files:
+            if (x := self._stamps0.get(r)) is not None:
+                self._entries1[r] = self._entries0[r]
+            else:
+                x = _to_stamp(self._get_entry_text(r, None))
+            out[r] = self._stamps1[r] = x
+        for r in dirs:
+            if (x := self._stamps0.get(r)) is not None:
+                for f in self._members0[r]:
+                    self._entries1[f] = self._entries0[f]
+                self._members1[r] = self._members0[r]
+            else:
+                x = self._stamp_dir(r)
+            out[r] = self._stamps1[r] = x
+        return out
+
+    def save(self) -> None:
+        if self._changed or self._entries0.keys() != self._entries1.keys():
+            cache_maker.save_cache(
+                self.root + ':0', 'source_manifest', self._entries1
+            )
+            self._changed = False
+        self._entries0, self._entries1 = self._entries1, {}
+        self._members0, self._members1 = self._members1, {}
+        self._stamps0, self._stamps1 = self._stamps1, {}
+
+    def _get_entry_text(
+        self, relpath: T.RelFilePath, entry: tp.Optional[os.DirEntry]
+    ) -> str:
+        if (record := self._index.get(relpath)) and record[1]:
+            x = (record[2], -1, record[1])
+            if self._entries0.get(relpath) != x:
+                self._changed = True
+            self._entries1[relpath] = x
+            return '{}-{}'.format(x[0], x[2])
+        st = entry.stat() if entry else os.stat(self.root + '/' + relpath)
+        if (
+            (x := self._entries0.get(relpath))
+            and x[0] == st.st_size
+            and x[1] == st.st_mtime_ns
+            and (x[2] or not self._content_hash)
+        ):
+            pass
+        else:
+            x = (
+                st.st_size,
+                st.st_mtime_ns,
+                self._hash(relpath) if self._content_hash else '',
+            )
+            self._changed = True
+        self._entries1[relpath] = x
+        if self._content_hash:
+            return '{}-{}'.format(x[0], x[2])
+        return '{}-{}'.format(x[0], x[1])
+
+    def _hash(self, relpath: T.RelFilePath) -> str:
+        with open(self.root + '/' + relpath, 'rb') as f:
+            return hashlib.file_digest(
+                f, lambda: hashlib.blake2b(digest_size=16)
+            ).hexdigest()
+
+    def _stamp_dir(self, reldir: T.RelDirPath) -> T.Stamp:
+        hasher = hashlib.blake2b(digest_size=8)
+        if self._index and (
+            members := dist_index.list_files(self.root, reldir)
+        ):
+            for r in members:
+                hasher.update(
+                    '{}:{}\n'.format(r, self._get_entry_text(r, None)).encode()
+                )
+            self._members1[reldir] = tuple(members)
+            return int.from_bytes(hasher.digest())
+        members = []
+        stack = [reldir]
+        while stack:
+            d = stack.pop()
+            with os.scandir(self.root + '/' + d) as it:
+                entries = sorted(it, key=lambda e: e.name)
+            for e in entries:
+                r = d + '/' + e.name
+                if e.is_dir():
+                    if e.name == '__pycache__':
+                        continue
+                    hasher.update('{}/\n'.format(r).encode())
+                    stack.append(r)
+                else:
+                    members.append(r)
+                    hasher.update(
+                        '{}:{}\n'.format(r, self._get_entry_text(r, e)).encode()
+                    )
+        self._members1[reldir] = tuple(members)
+        return int.from_bytes(hasher.digest())
+
+
+def get_manifest(
+    root: T.AbsDirPath, content_hash: bool = False
+) -> SourceManifest:
+    """
+    the resident manifest of `root` if there is one, otherwise a new one.
+    """
+    if (x := _residents.get((root, content_hash))) is not None:
+        return x
+    return SourceManifest(root, content_hash)
+
+
+_residents = {}
+#   {(root, content_hash): manifest, ...}
+
+
+def _to_stamp(text: str) -> T.Stamp:
+    return int.from_bytes(
+        hashlib.blake2b(text.encode(), digest_size=8).digest()
+    )
@@ -0,0 +1,332 @@
+"""
+minify exported sources: docstrings, comments and annotations are removed.
+the result is checked by parsing it again, if it fails (which is a bug), the
+original source is used.
+"""
+
+import ast
+import bisect
+import hashlib
+import io
+import re
+import tokenize
+import typing as tp
+from concurrent.futures import ProcessPoolExecutor
+
+from .cache import cache_maker
+from .instrument import instrument
+from .path_typing import T as T0
+
+
+class T(T0):
+    Mode = tp.Literal['', 'keep_lines', 'compact']
+    #   '': disabled.
+    #   'keep_lines': removed parts are replaced by blank lines, line numbers
+    #       in tracebacks still match the original sources.
+    #   'compact': blank lines are dropped as well.
+    #   notice: docstrings are removed unless the module itself uses
+    #   `__doc__`. packages that read them from another module (e.g. cli
+    #   help texts built by click or argsense) lose their help texts, leave
+    #   minify disabled for them.
+    Overrides = tp.Dict[T0.RelFilePath, bytes]
+    #   see `symbols.T.Overrides`.
+    Edit = tp.Tuple[int, int, str]
+    #   (start, end, replacement)
+    #       start, end: offsets in the source text.
+
+
+_CODING = re.compile(r'^[ \t\f]*#.*?coding[:=]')
+_LINE = re.compile(r'[^\n]*\n|[^\n]+$')
+_SEPARATOR = re.compile(r'\s*:\s*')
+_TRAILING_SPACES = re.compile(r'[ \t]+(?=[,):])')
+# annotations are kept if the module may read them at runtime.
+_UNSAFE_FOR_ANNOTATIONS = (
+    '__annotations__',
+    'dataclass',
+    'get_annotations',
+    'get_type_hints',
+    'NamedTuple',
+    'pydantic',
+    'signature',
+    'singledispatch',
+    'TypedDict',
+)
+_VERSION = '2'
+#   increase it if the output of `minify_source` changes.
+
+
+@instrument.timed('minify')
+def minify_sources(
+    root_i: T.AbsDirPath,
+    files: tp.Iterable[T.RelFilePath],
+    overrides: T.Overrides,
+    mode: T.Mode,
+    workers: int = 0,
+) -> T.Overrides:
+    """
+    minify the '*.py' in `files`, the overridden ones are minified from their
+    overridden content.
+    returns a new `overrides` dict, including the minified sources.
+    the results are cached by the source revision (and the overridden
+    content), so an incremental export only minifies the changed files.
+    """
+    assert mode in ('keep_lines', 'compact'), mode
+    out = dict(overrides)
+    relfiles = sorted(r for r in files if r.endswith('.py'))
+    tags = []
+    for r in relfiles:
+        tag = '{}:{}'.format(mode, _VERSION)
+        if r in overrides:
+            tag += (
+                ':' + hashlib.blake2b(overrides[r], digest_size=16).hexdigest()
+            )
+        tags.append(tag)
+
+    todo = []
+    for r, tag, x in zip(
+        relfiles,
+        tags,
+        cache_maker.get_many_caches(
+            ('{}/{}:1'.format(root_i, r) for r in relfiles), 'minified_sources'
+        ),
+    ):
+        if x is not None and x[0] == tag:
+            if x[1] is not None:
+                out[r] = x[1]
+        else:
+            todo.append((r, tag))
+    print(
+        ':v2',
+        'minify: {} sources, {} cached'.format(
+            len(relfiles), len(relfiles) - len(todo)
+        ),
+    )
+    if not todo:
+        return out
+
+    jobs = [
+        ('{}/{}'.format(root_i, r), overrides.get(r), mode == 'keep_lines')
+        for r, _ in todo
+    ]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(
+                pool.map(
+                    _minify_file,
+                    jobs,
+                    chunksize=max(1, len(jobs) // (workers * 4)),
+                )
+            )
+    else:
+        results = list(map(_minify_file, jobs))
+    for (r, tag), data in zip(todo, results):
+        if data is not None:
+            out[r] = data
+        cache_maker.save_cache(
+            '{}/{}:1'.format(root_i, r), 'minified_sources', (tag, data)
+        )
+    return out
+
+
+def minify_source(data: bytes, keep_lines: bool = True) -> bytes:
+    """
+    remove docstrings, comments and annotations.
+    docstrings are kept if the module uses `__doc__`, annotations are kept
+    for decorated functions, class level variables, or if the module may
+    read annotations at runtime (see `_UNSAFE_FOR_ANNOTATIONS`). the shebang
+    and the encoding declaration are kept.
+    """
+    encoding = tokenize.detect_encoding(io.BytesIO(data).readline)[0]
+    text = data.decode(encoding)
+    try:
+        tree = ast.parse(text)
+        tokens = tuple(tokenize.generate_tokens(io.StringIO(text).readline))
+    except (SyntaxError, ValueError, tokenize.TokenError):
+        return data
+
+    lines = _LINE.findall(text)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+
+    def offset(row: int, col: int, in_bytes: bool = True) -> int:
+        # ast uses utf-8 byte offsets, tokenize uses character offsets.
+        if in_bytes and not lines[row - 1].isascii():
+            col = len(lines[row - 1].encode()[:col].decode(errors='ignore'))
+        return starts[row - 1] + col
+
+    edits: tp.List[T.Edit] = []
+    for t in tokens:
+        if t.type == tokenize.COMMENT:
+            if t.start[0] == 1 and t.string.startswith('#!'):
+                continue
+            if t.start[0] <= 2 and _CODING.match(t.line):
+                continue
+            start = offset(*t.start, False)
+            # with the whitespace before it.
+            while start > starts[t.start[0] - 1] and text[start - 1] in ' \t':
+                start -= 1
+            edits.append((start, offset(*t.end, False), ''))
+    if '__doc__' not in text:
+        edits.extend(_get_docstring_edits(tree, offset))
+    if not any(x in text for x in _UNSAFE_FOR_ANNOTATIONS):
+        arrows = [
+            offset(*t.start, False)
+            for t in tokens
+            if t.type == tokenize.OP and t.string == '->'
+        ]
+        edits.extend(
+            _get_annotation_edits(tree, text, offset, arrows, keep_lines)
+        )
+
+    out = []
+    pos = 0
+    for start, end, repl in sorted(edits):
+        if start < pos:
+            # inside the last edit, e.g. a comment in a removed annotation.
+            continue
+        out.append(text[pos:start])
+        # in 'keep_lines' mode, only the statements and the contents of
+        # brackets span multiple lines (see `_get_annotation_edits`), so the
+        # line breaks can be kept.
+        out.append(repl + '\n' * text.count('\n', start, end) * keep_lines)
+        pos = end
+    out.append(text[pos:])
+    new_text = ''.join(out)
+    try:
+        if not keep_lines:
+            new_text = _drop_blank_lines(new_text)
+        ast.parse(new_text)
+    except (SyntaxError, tokenize.TokenError) as e:
+        print(':v6', 'minified source is broken, use the original', e)
+        return data
+    return new_text.encode(encoding)
+
+
+# -----------------------------------------------------------------------------
+
+
+def _drop_blank_lines(text: str) -> str:
+    """
+    drop whitespace-only lines, except those inside multi-line strings.
+    """
+    kept_rows = set()
+    for t in tokenize.generate_tokens(io.StringIO(text).readline):
+        if t.end[0] > t.start[0]:
+            kept_rows.update(range(t.start[0] + 1, t.end[0] + 1))
+    return ''.join(
+        line
+        for i, line in enumerate(_LINE.findall(text), 1)
+        if line.strip() or i in kept_rows
+    )
+
+
+def _get_annotation_edits(
+    tree: ast.Module,
+    text: str,
+    offset: tp.Callable[[int, int], int],
+    arrows: tp.List[int],
+    keep_lines: bool,
+) -> tp.List[T.Edit]:
+    """
+    annotations of undecorated functions, and of module / function level
+    variables with a value.
+    """
+
+    def remove(start: int, node: ast.expr, pattern: re.Pattern) -> None:
+        end = offset(node.end_lineno, node.end_col_offset)
+        # the gap is checked to skip parenthesized annotations, whose
+        # parentheses are not in the node range.
+        if pattern.fullmatch(text, start, offset(node.lineno, node.col_offset)):
+            # with the whitespace around it (`def f(x) -> int :`, `x: int ,
+            # y`), except the one before a default value (`x: int = 1`).
+            while text[start - 1] in ' \t':
+                start -= 1
+            if m := _TRAILING_SPACES.match(text, end):
+                end = m.end()
+            edits.append((start, end, ''))
+
+    edits = []
+    class_level = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            class_level.update(id(x) for x in node.body)
+        elif (
+            isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            and not node.decorator_list
+        ):
+            a = node.args
+            for arg in (
+                *a.posonlyargs,
+                *a.args,
+                a.vararg,
+                *a.kwonlyargs,
+                a.kwarg,
+            ):
+                if arg and arg.annotation:
+                    remove(
+                        offset(arg.lineno, arg.col_offset) + len(arg.arg),
+                        arg.annotation,
+                        _SEPARATOR,
+                    )
+            if node.returns and not (
+                # a line break out of brackets is a syntax error.
+                keep_lines and node.returns.end_lineno != node.lineno
+            ):
+                x = offset(node.returns.lineno, node.returns.col_offset)
+                if i := bisect.bisect_left(arrows, x):
+                    remove(arrows[i - 1], node.returns, re.compile(r'->\s*'))
+        elif (
+            isinstance(node, ast.AnnAssign)
+            and node.value
+            and node.simple
+            and id(node) not in class_level
+            and not (keep_lines and node.annotation.end_lineno != node.lineno)
+        ):
+            remove(
+                offset(node.target.end_lineno, node.target.end_col_offset),
+                node.annotation,
+                _SEPARATOR,
+            )
+    return edits
+
+
+def _get_docstring_edits(
+    tree: ast.Module, offset: tp.Callable[[int, int], int]
+) -> tp.Iterator[T.Edit]:
+    for node in ast.walk(tree):
+        if not isinstance(
+            node,
+            (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef),
+        ):
+            continue
+        body = node.body
+        if not (
+            body
+            and isinstance(x := body[0], ast.Expr)
+            and isinstance(x.value, ast.Constant)
+            and isinstance(x.value.value, str)
+        ):
+            continue
+        if len(body) > 1 and body[1].lineno == x.end_lineno:
+            # shares its line with the next statement.
+            continue
+        yield (
+            offset(x.lineno, x.col_offset),
+            offset(x.end_lineno, x.end_col_offset),
+            'pass' if len(body) == 1 and node is not tree else '',
+        )
+
+
+def _minify_file(
+    job: tp.Tuple[str, tp.Optional[bytes], bool],
+) -> tp.Optional[bytes]:
+    """
+    returns None if nothing is removed.
+    """
+    file, data, keep_lines = job
+    if data is None:
+        with open(file, 'rb') as f:
+            data = f.read()
+    out = minify_source(data, keep_lines)
+    return None if out == data else out
@@ -4,6 +4,7 @@ from functools import cached_property
 
 from lk_utils import fs
 
+from .dir_index import dir_index
 from .path_scope import path_scope
 
 # fmt: off
@@ -95,6 +96,7 @@ class ModuleInfo:
     level: int  # e.g. 1
     base_dir: tp.Optional[str]  # e.g. '<path/to/a>'
     full_name: tp.Optional[str] = None  # e.g. 'a.b.c.d'
+    context: str = 'hard'  # see `scanner.T.Context`.
 
     # def __str__(self) -> str:
     #     return self.id
@@ -126,10 +128,18 @@ class ModuleInspector:
     module_name_2_file: tp.Dict[T.ModuleId, T.FilePath]
 
     def __init__(self, ignores: tp.Iterable[str] = ()) -> None:
+        self._ignores = tuple(ignores)
         self.module_name_2_file = {}
+        self.clear()
+
+    def clear(self) -> None:
+        """
+        forget the resolved modules, e.g. after modules are added or removed.
+        """
+        self.module_name_2_file.clear()
         for name in KNOWN_STDLIB_MODULE_NAMES:
             self.module_name_2_file[name] = '<stdlib>'
-        for name in ignores:
+        for name in self._ignores:
             self.module_name_2_file[name] = '<ignored>'
         for name, (path, isdir) in path_scope.module_2_path.items():
             if not isdir:
@@ -264,27 +274,19 @@ class ModuleInspector:
         if case_sensitive:
             # https://stackoverflow.com/questions/3692261/in-python-how-can-i-get-the-correctly-cased-path-for-a-file
             a, b = possible_path.rsplit('/', 1)
-            if fs.isdir(a):
-                for d in fs.find_dirs(a):
-                    if d.name == b:
-                        if fs.exist(x := f'{d.path}/__init__.py'):
-                            return x
-                for f in fs.find_files(a, ('.py', '.pyc', '.pyd')):
-                    # if f.stem == b:
-                    #     return f.path
-                    if f.name.startswith(b + '.'):
-                        return f.path
+            if dir_index.isdir(a):
+                return dir_index.find_module(a, b)
             else:
                 for ext in ('.py', '.pyc', '.pyd'):
-                    if fs.exist(x := a + ext):
+                    if dir_index.exists(x := a + ext):
                         return x
         else:
-            if fs.isdir(possible_path):
-                if fs.exist(x := f'{possible_path}/__init__.py'):
+            if dir_index.isdir(possible_path):
+                if dir_index.exists(x := f'{possible_path}/__init__.py'):
                     return x
             else:
                 for ext in ('.py', '.pyc', '.pyd'):
-                    if fs.exist(x := possible_path + ext):
+                    if dir_index.exists(x := possible_path + ext):
                         return x
 
 
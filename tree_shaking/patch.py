@@ -3,6 +3,8 @@ from glob import glob
 
 from lk_utils import fs
 
+from . import dist_info
+from .dist_info import dist_index
 from .path_typing import T as T0
 
 
@@ -81,18 +83,19 @@ class ResourcePatch:
         suffix = '/' if relpath.endswith('/') else ''
 
         if '*' in relpath:
-            candidates = glob('{}/{}'.format(base_dir, relpath))
+            candidates = self._glob('{}/{}'.format(base_dir, relpath))
             if len(candidates) == 0 and nullable:
                 return ''
             elif len(candidates) == 1:
-                if fs.exist(candidates[0]):
-                    return fs.normpath(candidates[0]) + suffix
+                if self._exists(x := fs.normpath(candidates[0])):
+                    return x + suffix
             else:
                 # currently we don't allow multiple candidates. i think it's
                 # fine to unlock this behavior. let me review this case later.
                 raise Exception(relpath, candidates, nullable)
         else:
-            if fs.exist(x := fs.normpath('{}/{}'.format(base_dir, relpath))):
+            x = fs.normpath('{}/{}'.format(base_dir, relpath))
+            if self._exists(x):
                 return x + suffix
         
         if nullable:
@@ -100,6 +103,34 @@ class ResourcePatch:
         else:
             raise Exception(base_dir, relpath)
 
+    def _exists(self, path: T.AbsPath) -> bool:
+        if dist_info.enabled and path.startswith(self._source_root + '/'):
+            if (
+                x := dist_index.exists(
+                    self._source_root, path[len(self._source_root) + 1 :]
+                )
+            ) is not None:
+                return x
+        return fs.exist(path)
+
+    def _glob(self, pattern: str) -> tp.List[str]:
+        """
+        the owned paths (see `dist_info.DistIndex`) are matched against
+        RECORD files, others are globbed on disk.
+        """
+        if dist_info.enabled:
+            x = fs.normpath(pattern)
+            if x.startswith(self._source_root + '/'):
+                if (
+                    out := dist_index.glob(
+                        self._source_root,
+                        x[len(self._source_root) + 1 :]
+                        + ('/' if pattern.endswith('/') else ''),
+                    )
+                ) is not None:
+                    return ['{}/{}'.format(self._source_root, r) for r in out]
+        return glob(pattern)
+
 
 implicit_hooks_file = fs.here('patches/implicit_import_hooks.yaml')
 patch = Patch(implicit_hooks_file)
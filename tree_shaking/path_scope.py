@@ -1,9 +1,17 @@
+import os
+import typing as tp
+
 from lk_utils import fs
 
 
 class T:
     Anypath = str
     Dirpath = str
+    Snapshot = tp.Tuple[
+        tp.Dict[str, tp.Tuple[Anypath, bool]], tp.Dict[Anypath, str]
+    ]
+    #   (module_2_path, path_2_module) of a single scope.
+    #   see also `PathScope.__init__`.
 
 
 class PathScope:
@@ -20,16 +28,61 @@ class PathScope:
         #           path: absolute, could be filepath or dirpath.
         self.path_2_module = {}
         #   {path: module_name, ...}
-        #       path: absolute filepath.
+        #       path: absolute filepath or dirpath.
+        #       it is unordered, use `find_top` for longest-prefix lookups.
     
     def add_scope(self, scope: T.Dirpath) -> None:
         """
         notice: if a module name both exists in `<scope>/<module>` and
         `self.module_2_path`, the former one takes effect.
         """
+        self.add_snapshot(self.scan_scope(scope))
+    
+    def add_snapshot(self, snapshot: T.Snapshot) -> None:
+        """
+        add a scope by its snapshot (the result of `scan_scope`). it has the
+        same effect as `add_scope`, but doesn't touch the disk.
+        """
+        module_2_path, path_2_module = snapshot
+        self.module_2_path.update(module_2_path)
+        self.path_2_module.update(path_2_module)
+        # print(self.path_2_module, ':vl')
+    
+    @staticmethod
+    def scan_scope(
+        scope: T.Dirpath, known: tp.Optional[tp.Dict[str, bool]] = None
+    ) -> T.Snapshot:
+        """
+        params:
+            known: optional. {name: isdir, ...}
+                the top level names whose kinds are known in advance, e.g.
+                from RECORD files (see `dist_info.DistIndex.get_tops`). if
+                given, the scope is listed once by names, only the unknown
+                names are checked on disk.
+        """
         module_2_path = {}
         path_2_module = {}
         scope = fs.abspath(scope)
+        if known is not None:
+            kinds = {}
+            for name in os.listdir(scope):
+                if (isdir := known.get(name)) is None:
+                    isdir = os.path.isdir('{}/{}'.format(scope, name))
+                kinds[name] = isdir
+            for name, isdir in kinds.items():
+                path = '{}/{}'.format(scope, name)
+                if isdir and '.' not in name:
+                    if not fs.default_filter.filter_dir(path, name):
+                        module_2_path[name] = (path, True)
+                        path_2_module[path] = name
+            for name, isdir in kinds.items():
+                path = '{}/{}'.format(scope, name)
+                if not isdir and name.endswith(('.py', '.pyc', '.pyd')):
+                    if not fs.default_filter.filter_file(path, name):
+                        module_name = name.split('.', 1)[0]
+                        module_2_path[module_name] = (path, False)
+                        path_2_module[path] = module_name
+            return module_2_path, path_2_module
         for d in fs.find_dirs(scope, filter=True):
             if '.' not in d.name:
                 module_name = d.name
@@ -41,27 +94,56 @@ class PathScope:
             #   '_cffi_backend.cp312-win_amd64.pyd' -> '_cffi_backend'
             module_2_path[module_name] = (f.path, False)
             path_2_module[f.path] = module_name
-        self.module_2_path.update(module_2_path)
-        self.path_2_module.update(path_2_module)
-        # sort paths from long to short
-        self.path_2_module = dict(sorted(
-            self.path_2_module.items(),
-            key=lambda x: x[0],
-            reverse=True
-        ))
-        # print(self.path_2_module, ':vl')
+        return module_2_path, path_2_module
     
     def add_path(self, path: T.Anypath) -> None:
         path = fs.abspath(path)
         module_name = fs.barename(path)
         self.module_2_path[module_name] = (path, fs.isdir(path))
         self.path_2_module[path] = module_name
-        # sort paths from long to short
-        self.path_2_module = dict(sorted(
-            self.path_2_module.items(),
-            key=lambda x: x[0],
-            reverse=True
-        ))
+    
+    def update_scope(
+        self, scope: T.Dirpath, known: tp.Optional[tp.Dict[str, bool]] = None
+    ) -> T.Snapshot:
+        """
+        rescan a scope which has been added, e.g. after modules are added to
+        or removed from it. the modules of other scopes are not overridden.
+        returns the new snapshot.
+        params:
+            known: see `scan_scope`.
+        """
+        scope = fs.abspath(scope)
+        module_2_path, path_2_module = snapshot = self.scan_scope(scope, known)
+        for path in tuple(self.path_2_module):
+            if path.rsplit('/', 1)[0] == scope and path not in path_2_module:
+                name = self.path_2_module.pop(path)
+                if self.module_2_path.get(name, ('',))[0] == path:
+                    self.module_2_path.pop(name)
+        for name, (path, isdir) in module_2_path.items():
+            if (
+                name not in self.module_2_path
+                or self.module_2_path[name][0].rsplit('/', 1)[0] == scope
+            ):
+                self.module_2_path[name] = (path, isdir)
+            self.path_2_module[path] = name
+        return snapshot
+    
+    def find_top(
+        self, path: T.Anypath
+    ) -> tp.Optional[tp.Tuple[T.Anypath, str]]:
+        """
+        find the longest registered path which is `path` itself or one of its
+        ancestors, by walking up from `path`. it costs O(depth).
+        returns `(top_path, module_name)` or None if not found.
+        """
+        while path:
+            if path in self.path_2_module:
+                return path, self.path_2_module[path]
+            parent = path.rsplit('/', 1)[0]
+            if parent == path:
+                break
+            path = parent
+        return None
 
 
 path_scope = PathScope()
@@ -0,0 +1,561 @@
+import ast
+import io
+import keyword
+import os
+import re
+import token
+import tokenize
+import typing as tp
+from collections import deque
+
+from lk_utils import fs
+
+
+class T:
+    AstNode = tp.Union[ast.Import, ast.ImportFrom]
+    Backend = tp.Literal['ast', 'fast', 'check']
+    #   ast: full `ast.parse` + `ast.walk`.
+    #   fast: bytes prefilter + tokenize based extractor, falls back to `ast`
+    #       when the token stream is ambiguous.
+    #   check: run both and report differences. the `ast` result wins.
+    Oversize = tp.Literal['flag', 'skip']
+    Context = tp.Literal['hard', 'lazy', 'optional', 'type_checking']
+    #   where an import statement is.
+    #   hard: executed when the module is imported.
+    #   lazy: in a function body.
+    #   optional: in a `try` body whose handlers catch `ImportError` (or
+    #       its bases).
+    #   type_checking: in an `if TYPE_CHECKING:` body.
+    #   if several apply, the later one in this list wins.
+    ScanResult = tp.List[tp.Tuple[AstNode, str, Context]]
+    #   [(node, line, context), ...]
+    #       node: `ast.Import` or `ast.ImportFrom`, in `ast.walk` order.
+    #       line: the source line where the node starts.
+
+
+class Scanner:
+    def __init__(
+        self,
+        backend: T.Backend = 'ast',
+        size_limit: int = 0,
+        oversize: T.Oversize = 'flag',
+    ) -> None:
+        """
+        params:
+            size_limit: in bytes. 0 means no limit.
+            oversize: what to do with files larger than `size_limit`.
+                flag: print a warning, then scan as usual.
+                skip: treat it as a file without imports.
+        """
+        self.configure(backend, size_limit, oversize)
+
+    def configure(
+        self,
+        backend: T.Backend = 'ast',
+        size_limit: int = 0,
+        oversize: T.Oversize = 'flag',
+    ) -> None:
+        assert backend in ('ast', 'fast', 'check'), backend
+        assert oversize in ('flag', 'skip'), oversize
+        self.backend = backend
+        self.oversize = oversize
+        self.size_limit = size_limit
+
+    def should_skip(self, file: str) -> bool:
+        return bool(
+            self.size_limit
+            and self.oversize == 'skip'
+            and os.path.getsize(file) > self.size_limit
+        )
+
+    def scan(self, file: str) -> T.ScanResult:
+        """
+        notice: this method runs in worker processes as well (see
+        `Finder.prefetch`), it must not depend on any global state.
+        """
+        if self.size_limit and (size := os.path.getsize(file)) > (
+            self.size_limit
+        ):
+            if self.oversize == 'skip':
+                return []
+            print(':v6', 'oversized file', file, size)
+        data = fs.load(file, 'binary')
+        if self.backend == 'ast':
+            return _scan_by_ast(file, data)
+        elif self.backend == 'fast':
+            return _scan_by_tokens(file, data)
+        else:
+            a = _scan_by_ast(file, data)
+            b = _scan_by_tokens(file, data)
+            if (x := tuple(_dump_node(n, c) for n, _, c in a)) != (
+                y := tuple(_dump_node(n, c) for n, _, c in b)
+            ):
+                print(
+                    ':v8l',
+                    'scanner backends disagree',
+                    file,
+                    {'ast_only': sorted(set(x) - set(y))},
+                    {'fast_only': sorted(set(y) - set(x))},
+                    {'same_items_but_order_differs': set(x) == set(y)},
+                )
+            return a
+
+
+def _dump_node(node: T.AstNode, context: T.Context) -> tuple:
+    return (
+        node.lineno,
+        getattr(node, 'module', None) or '',
+        getattr(node, 'level', 0) or 0,
+        tuple((x.name, x.asname) for x in node.names),
+        context,
+    )
+
+
+_CONTEXTS = ('hard', 'lazy', 'optional', 'type_checking')
+_IMPORT_ERRORS = frozenset(
+    ('BaseException', 'Exception', 'ImportError', 'ModuleNotFoundError')
+)
+
+
+def _merge_context(a: T.Context, b: T.Context) -> T.Context:
+    return a if _CONTEXTS.index(a) >= _CONTEXTS.index(b) else b
+
+
+def _scan_by_ast(file: str, data: bytes) -> T.ScanResult:
+    source_text = data.decode('utf-8')
+    source_lines = source_text.splitlines()
+    try:
+        tree = ast.parse(source_text, file)
+    except SyntaxError:
+        print(':v8', 'syntax error when parsing file', file)
+        return []
+    out = []
+    for node, context in _walk_statements(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            line = source_lines[node.lineno - 1]
+            out.append((node, line, context))
+    return out
+
+
+def _walk_statements(
+    tree: ast.AST,
+) -> tp.Iterator[tp.Tuple[ast.AST, T.Context]]:
+    """
+    same as `ast.walk`, but only steps into fields that hold statements.
+    imports are statements, expressions never contain them, so the yielded
+    imports and their order are the same as `ast.walk`, while most of the
+    nodes are skipped.
+    yields: ((node, context), ...)
+    """
+    todo = deque(((tree, 'hard'),))
+    while todo:
+        node, context = todo.popleft()
+        for field in node._fields:
+            if field in _STATEMENT_FIELDS:
+                x = _get_body_context(node, field, context)
+                todo.extend((y, x) for y in getattr(node, field))
+        yield node, context
+
+
+def _get_body_context(
+    node: ast.AST, field: str, context: T.Context
+) -> T.Context:
+    if field == 'body':
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            return _merge_context(context, 'lazy')
+        if isinstance(node, (ast.Try, ast.TryStar)) and any(
+            _catches_import_error(x.type) for x in node.handlers
+        ):
+            return _merge_context(context, 'optional')
+        if isinstance(node, ast.If) and _is_type_checking(node.test):
+            return 'type_checking'
+    return context
+
+
+def _catches_import_error(type_: tp.Optional[ast.expr]) -> bool:
+    if type_ is None:
+        return True
+    if isinstance(type_, ast.Tuple):
+        return any(map(_catches_import_error, type_.elts))
+    if isinstance(type_, ast.Attribute):
+        return type_.attr in _IMPORT_ERRORS
+    return isinstance(type_, ast.Name) and type_.id in _IMPORT_ERRORS
+
+
+def _is_type_checking(test: ast.expr) -> bool:
+    # `TYPE_CHECKING` or `typing.TYPE_CHECKING`.
+    if isinstance(test, ast.Attribute):
+        return test.attr == 'TYPE_CHECKING'
+    return isinstance(test, ast.Name) and test.id == 'TYPE_CHECKING'
+
+
+_STATEMENT_FIELDS = frozenset(
+    ('body', 'orelse', 'handlers', 'finalbody', 'cases')
+)
+
+
+# ------------------------------------------------------------------------------
+
+
+class _Ambiguous(Exception):
+    pass
+
+
+_IMPORT_WORD = re.compile(rb'\bimport\b')
+
+
+def _scan_by_tokens(file: str, data: bytes) -> T.ScanResult:
+    if b'import' not in data:
+        return []
+    # no import statement starts after the last "import" word, so the token
+    # stream can be cut there (or after the handlers of the `try` around it).
+    # usually imports sit at the top of a module, only a small part of the
+    # file is tokenized.
+    last = None
+    for last in _IMPORT_WORD.finditer(data):
+        pass
+    if last is None:
+        return []
+    last_row = data.count(b'\n', 0, last.start()) + 1
+    try:
+        nodes = _TokenScanner(data, last_row).scan()
+    except (_Ambiguous, tokenize.TokenError, SyntaxError):
+        # SyntaxError includes IndentationError.
+        return _scan_by_ast(file, data)
+    source_lines = data.decode('utf-8').splitlines()
+    return [
+        (node, source_lines[node.lineno - 1], context)
+        for node, context in nodes
+    ]
+
+
+class _TokenScanner:
+    """
+    extract import statements from the token stream, without building the
+    syntax tree.
+    to return nodes in the same order as `ast.walk` (breadth first, i.e.
+    sorted by tree depth, then by source position), it tracks the ast depth
+    of every block. the rules:
+        - a statement in module body has depth 1.
+        - the body of a compound statement is 1 deeper than the statement.
+        - an `except` body is 2 deeper (`Try -> ExceptHandler -> stmt`).
+        - the nth `elif` body is 1 + n deeper, so is the `else` after it
+            (`If -> If(orelse) -> ... -> stmt`).
+        - `case` is a compound statement in the body of `match`.
+    the context (see `T.Context`) of a block is decided by its header, except
+    for `try`, whose handlers come after the body. so the imports in a `try`
+    body are collected, and upgraded to 'optional' when a handler catching
+    `ImportError` shows up.
+    """
+
+    _HEADERS = frozenset((
+        'async', 'case', 'class', 'def', 'elif', 'else', 'except', 'finally',
+        'for', 'if', 'match', 'try', 'while', 'with',
+    ))  # fmt: skip
+
+    def __init__(self, data: bytes, last_row: int) -> None:
+        self._data = data
+        self._last_row = last_row
+
+    def _iter_tokens(self) -> tp.Iterator[tokenize.TokenInfo]:
+        for x in tokenize.tokenize(io.BytesIO(self._data).readline):
+            if x.type in (token.COMMENT, token.NL, token.ENCODING):
+                continue
+            yield x
+
+    def scan(self) -> tp.List[tp.Tuple[T.AstNode, T.Context]]:
+        out = []  # [[depth, lineno, col, node, context], ...]
+        levels = [{'depth': 1, 'chain': None, 'context': 'hard', 'tries': ()}]
+        #   chain: the open `if/elif`, `try` or loop at this level, which
+        #   an `else` (`elif`, `except`, `finally`) continues.
+        #       None | ('if', elif_count) | ('try', imports) | ('loop',)
+        #       imports: the imports in the `try` body, see `tries`.
+        #   tries: the `imports` lists of the enclosing `try` bodies.
+        body = None  # (depth, context, tries) of the last header line.
+        line = []
+        for tok in self._iter_tokens():
+            if tok.type == token.INDENT:
+                if not body:
+                    raise _Ambiguous(tok)
+                levels.append(
+                    {
+                        'depth': body[0],
+                        'chain': None,
+                        'context': body[1],
+                        'tries': body[2],
+                    }
+                )
+                body = None
+            elif tok.type == token.DEDENT:
+                levels.pop()
+            elif tok.type in (token.NEWLINE, token.ENDMARKER):
+                if line:
+                    body = self._scan_line(line, levels[-1], out)
+                    line = []
+                # the handlers of an open `try` may still upgrade its imports.
+                if tok.start[0] >= self._last_row and not self._has_open_try(
+                    levels
+                ):
+                    break
+            else:
+                line.append(tok)
+        out.sort(key=lambda x: x[:3])
+        return [(x[3], x[4]) for x in out]
+
+    def _scan_line(
+        self, line: tp.List[tokenize.TokenInfo], level: dict, out: tp.List[list]
+    ) -> tp.Optional[tp.Tuple[int, T.Context, tuple]]:
+        """
+        returns (depth, context, tries) of the body if this is a header line,
+        otherwise None.
+        """
+        first = line[0]
+        depth = level['depth']
+        context = level['context']
+        tries = level['tries']
+        body = None
+        if (
+            first.type == token.NAME
+            and first.string in self._HEADERS
+            and (
+                len(line) > 1  # e.g. `match = 1` or `match(x)` is not a header.
+                and (colon := self._find_header_colon(line)) is not None
+            )
+        ):
+            kind = line[1].string if first.string == 'async' else first.string
+            body = (self._open_header(level, kind), context, tries)
+            if kind == 'def':
+                body = (body[0], _merge_context(context, 'lazy'), tries)
+            elif kind in ('if', 'elif') and self._is_type_checking(
+                line[1:colon]
+            ):
+                body = (body[0], 'type_checking', tries)
+            elif kind == 'try':
+                level['chain'] = ('try', [])
+                body = (body[0], context, (*tries, level['chain'][1]))
+            elif kind == 'except' and self._catches_import_error(line[1:colon]):
+                for x in level['chain'][1]:
+                    x[4] = _merge_context(x[4], 'optional')
+            if colon == len(line) - 1:
+                return body
+            # a one-liner body follows, e.g. `if x: import y`.
+            line = line[colon + 1 :]
+            depth, context, tries = body
+            body = None
+        elif not (first.type == token.OP and first.string == '@'):
+            level['chain'] = None
+
+        for stmt in self._split_statements(line):
+            head = stmt[0]
+            if head.type == token.NAME and head.string == 'import':
+                node = self._parse_import(stmt)
+            elif head.type == token.NAME and head.string == 'from':
+                node = self._parse_import_from(stmt)
+            else:
+                # `import` is a hard keyword, it cannot appear elsewhere.
+                if any(
+                    x.type == token.NAME and x.string == 'import' for x in stmt
+                ):
+                    raise _Ambiguous(head)
+                continue
+            out.append(x := [depth, *head.start, node, context])
+            for imports in tries:
+                imports.append(x)
+        return body
+
+    @staticmethod
+    def _catches_import_error(header: tp.List[tokenize.TokenInfo]) -> bool:
+        """
+        header: tokens between `except` and the colon.
+        """
+        for tok in header:
+            if tok.type == token.NAME:
+                if tok.string == 'as':
+                    return False
+                if tok.string in _IMPORT_ERRORS:
+                    return True
+        return not header
+
+    @staticmethod
+    def _find_header_colon(
+        line: tp.List[tokenize.TokenInfo],
+    ) -> tp.Optional[int]:
+        paren_level = 0
+        for i, tok in enumerate(line):
+            if tok.type == token.OP:
+                if tok.string in '([{':
+                    paren_level += 1
+                elif tok.string in ')]}':
+                    paren_level -= 1
+                elif tok.string == ':' and paren_level == 0:
+                    return i
+            elif tok.type == token.NAME and tok.string == 'lambda':
+                if paren_level == 0:
+                    raise _Ambiguous(tok)
+        return None
+
+    @staticmethod
+    def _split_statements(
+        line: tp.List[tokenize.TokenInfo],
+    ) -> tp.Iterator[tp.List[tokenize.TokenInfo]]:
+        stmt = []
+        for tok in line:
+            if tok.type == token.OP and tok.string == ';':
+                if stmt:
+                    yield stmt
+                stmt = []
+            else:
+                stmt.append(tok)
+        if stmt:
+            yield stmt
+
+    @staticmethod
+    def _has_open_try(levels: tp.List[dict]) -> bool:
+        return any(map(any, levels[-1]['tries'])) or any(
+            x['chain'] and x['chain'][0] == 'try' and x['chain'][1]
+            for x in levels
+        )
+
+    @staticmethod
+    def _is_type_checking(test: tp.List[tokenize.TokenInfo]) -> bool:
+        # `TYPE_CHECKING` or `typing.TYPE_CHECKING`, the same as the ast rule.
+        #   names and dots alternate, keywords (`not`, `and`, ...) are NAME
+        #   tokens as well, they must not pass.
+        return (
+            len(test) % 2 == 1
+            and test[-1].string == 'TYPE_CHECKING'
+            and all(
+                x.string == '.'
+                if i % 2
+                else x.type == token.NAME and not keyword.iskeyword(x.string)
+                for i, x in enumerate(test)
+            )
+        )
+
+    @staticmethod
+    def _open_header(level: dict, kind: str) -> int:
+        depth = level['depth']
+        chain = level['chain']
+        if kind == 'if':
+            level['chain'] = ('if', 0)
+            return depth + 1
+        if kind == 'elif':
+            if not chain or chain[0] != 'if':
+                raise _Ambiguous(kind)
+            level['chain'] = ('if', chain[1] + 1)
+            return depth + 1 + chain[1] + 1
+        if kind == 'else':
+            if not chain:
+                raise _Ambiguous(kind)
+            if chain[0] == 'if':
+                return depth + 1 + chain[1]
+            return depth + 1
+        if kind == 'try':
+            level['chain'] = ('try',)
+            return depth + 1
+        if kind == 'except':
+            if not chain or chain[0] != 'try':
+                raise _Ambiguous(kind)
+            return depth + 2
+        if kind == 'finally':
+            return depth + 1
+        if kind in ('for', 'while'):
+            level['chain'] = ('loop',)
+            return depth + 1
+        # class, def, with, match, case.
+        level['chain'] = None
+        return depth + 1
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _parse_import(stmt: tp.List[tokenize.TokenInfo]) -> ast.Import:
+        reader = _Reader(stmt[1:])
+        names = [reader.alias(True)]
+        while reader.take_op(','):
+            names.append(reader.alias(True))
+        reader.end()
+        return ast.Import(
+            names=names, lineno=stmt[0].start[0], col_offset=stmt[0].start[1]
+        )
+
+    @staticmethod
+    def _parse_import_from(stmt: tp.List[tokenize.TokenInfo]) -> ast.ImportFrom:
+        reader = _Reader(stmt[1:])
+        level = 0
+        while x := (reader.take_op('.') or reader.take_op('...')):
+            level += len(x)
+        module = None
+        if not reader.take_name('import'):
+            module = reader.dotted_name()
+            if not reader.take_name('import'):
+                raise _Ambiguous(stmt[0])
+        names = []
+        if reader.take_op('*'):
+            names.append(ast.alias(name='*', asname=None))
+        else:
+            parenthesized = bool(reader.take_op('('))
+            names.append(reader.alias(False))
+            while reader.take_op(','):
+                if parenthesized and reader.take_op(')'):
+                    parenthesized = False  # trailing comma
+                    break
+                names.append(reader.alias(False))
+            if parenthesized and not reader.take_op(')'):
+                raise _Ambiguous(stmt[0])
+        reader.end()
+        return ast.ImportFrom(
+            module=module,
+            names=names,
+            level=level,
+            lineno=stmt[0].start[0],
+            col_offset=stmt[0].start[1],
+        )
+
+
+class _Reader:
+    def __init__(self, tokens: tp.List[tokenize.TokenInfo]) -> None:
+        self._tokens = tokens
+        self._index = 0
+
+    def alias(self, dotted: bool) -> ast.alias:
+        name = self.dotted_name() if dotted else self.name()
+        asname = self.name() if self.take_name('as') else None
+        return ast.alias(name=name, asname=asname)
+
+    def dotted_name(self) -> str:
+        name = self.name()
+        while self.take_op('.'):
+            name += '.' + self.name()
+        return name
+
+    def end(self) -> None:
+        if self._index != len(self._tokens):
+            raise _Ambiguous(self._tokens[self._index])
+
+    def name(self) -> str:
+        if self._index < len(self._tokens):
+            tok = self._tokens[self._index]
+            if tok.type == token.NAME:
+                self._index += 1
+                return tok.string
+        raise _Ambiguous(self._tokens)
+
+    def take_name(self, name: str) -> bool:
+        if self._index < len(self._tokens):
+            tok = self._tokens[self._index]
+            if tok.type == token.NAME and tok.string == name:
+                self._index += 1
+                return True
+        return False
+
+    def take_op(self, op: str) -> str:
+        if self._index < len(self._tokens):
+            tok = self._tokens[self._index]
+            if tok.type == token.OP and tok.string == op:
+                self._index += 1
+                return op
+        return ''
+
+
+scanner = Scanner()
@@ -0,0 +1,642 @@
+"""
+symbol level dead code elimination.
+the module graph tells which files are needed, but a file is needed as a
+whole: `from big_pkg.utils import one_helper` ships all of "utils.py" and
+everything it imports at module level. this module tracks the names imported
+from each module (`ImportFrom.names`) across the graph, and removes the unused
+top level functions and classes, and the imports only they needed, from the
+exported modules. removed statements are replaced by blank lines, so the line
+numbers in tracebacks still match the original sources.
+"""
+
+import ast
+import builtins
+import io
+import re
+import tokenize
+import typing as tp
+from collections import defaultdict
+from dataclasses import dataclass
+
+from lk_utils import fs
+
+from .cache import cache_maker
+from .dir_index import dir_index
+from .file_parser import FileParser
+from .finder import _patched_imports
+from .graph import T as T1
+from .instrument import instrument
+from .module import ModuleInfo
+from .module import ModuleNotFound
+from .module import PathNotFound
+from .path_typing import T as T0
+
+
+class T(T0):
+    Config = T1.Config
+    DumpedModuleGraph = T1.DumpedModuleGraph
+    Mode = tp.Literal['', 'conservative', 'aggressive']
+    #   '': disabled.
+    #   'conservative': a module is left untouched if it uses `getattr`,
+    #       `globals`, `vars`, `locals`, `eval`, `exec`, `__import__`,
+    #       `sys.modules` or defines `__all__`. decorated functions (except
+    #       well-known decorators) and classes with a metaclass, keywords or
+    #       unknown bases are kept. an import is removed only if all its
+    #       references are removed, module imports (`import x`,
+    #       `from . import submodule`) are kept.
+    #   'aggressive': a module is left untouched only if it uses `globals`,
+    #       `vars`, `locals`, `eval` or `exec`. any unreferenced function,
+    #       class or import is removed.
+    #   in both modes, a module is left untouched if it defines a module
+    #   level `__getattr__` or `__dir__`, or if it is imported by `import x`
+    #   or `from x import *` anywhere in the graph.
+    Alias = tp.Tuple[str, tp.Optional[str], str, tp.Optional[str], int]
+    #   (kind, module, name, asname, level)
+    #       kind: 'import' or 'from'.
+    #       module: `ImportFrom.module`, None for 'import'.
+    Keep = tp.Optional[tp.FrozenSet[tp.Union[int, tp.Tuple[int, int]]]]
+    #   None: keep all statements.
+    #   frozenset: {index, (index, alias_index), ...}
+    #       the kept statements, and the kept aliases of import statements.
+    Overrides = tp.Dict[T0.RelFilePath, bytes]
+    #   {relpath: content, ...}
+    #       rewritten sources, to be written instead of linked.
+
+
+@dataclass(slots=True)
+class Statement:
+    kind: str
+    #   'def': a top level function or class definition.
+    #   'import': a top level import statement.
+    #   'other': any other statement, or a definition / import that shares
+    #       its lines with other statements. it is always kept.
+    names: tp.Tuple[str, ...]
+    #   bound names. for 'import', one name per alias.
+    refs: tp.FrozenSet[str]
+    #   names referenced in the statement, including string annotations.
+    imports: tp.Tuple[T.Alias, ...]
+    #   for 'import', its own aliases. otherwise the imports nested in it.
+    span: tp.Tuple[int, int]
+    #   first and last line numbers, decorators included.
+    plain: bool
+    #   for 'def', whether it can be removed in 'conservative' mode.
+
+
+@dataclass(slots=True)
+class SymbolTable:
+    bailout: tp.Tuple[str, str]
+    #   the reason to leave the module untouched, for 'conservative' and
+    #   'aggressive' modes respectively. empty string if not.
+    refs: tp.FrozenSet[str]
+    #   names referenced in the whole module.
+    statements: tp.Tuple[Statement, ...]
+
+
+_BAILOUT_NAMES = (
+    (
+        '__all__',
+        '__import__',
+        'getattr',
+        'globals',
+        'vars',
+        'locals',
+        'eval',
+        'exec',
+    ),
+    ('globals', 'vars', 'locals', 'eval', 'exec'),
+)
+_PLAIN_BASES = frozenset(
+    ('ABC', 'Enum', 'Generic', 'IntEnum', 'NamedTuple', 'Protocol')
+) | frozenset(k for k, v in vars(builtins).items() if isinstance(v, type))
+_PLAIN_DECORATORS = frozenset(
+    (
+        'abstractmethod',
+        'asynccontextmanager',
+        'cache',
+        'cached_property',
+        'classmethod',
+        'contextmanager',
+        'dataclass',
+        'final',
+        'lru_cache',
+        'no_type_check',
+        'overload',
+        'property',
+        'runtime_checkable',
+        'staticmethod',
+        'total_ordering',
+        'wraps',
+    )
+)
+_IDENTIFIER = re.compile(r'[A-Za-z_]\w*')
+
+
+@instrument.timed('dce')
+def shake_symbols(
+    config: T.Config,
+    source_root: T.AbsDirPath,
+    files: tp.Set[T.RelFilePath],
+    mode: T.Mode,
+) -> tp.Tuple[tp.Set[T.RelFilePath], T.Overrides]:
+    """
+    params:
+        files: the file resources to export, under `source_root`. the files
+            covered by directory resources should not be included, they are
+            exported as is.
+    returns: (files, overrides)
+        files: `files` without the modules that are no longer imported.
+        overrides: see `T.Overrides`.
+    """
+    assert mode in ('conservative', 'aggressive'), mode
+    universe = set(config['entries'])
+    for entry in config['entries']:
+        graph: T.DumpedModuleGraph = cache_maker.get_cache(  # type: ignore
+            entry + ':0', 'module_graphs', persistent=True
+        )
+        assert graph
+        for shortpath in graph['modules'].values():
+            uid, relpath = shortpath.split('/', 1)
+            universe.add(
+                '{}/{}'.format(graph['source_roots'][uid[1:-1]], relpath)
+            )
+    candidates = {
+        '{}/{}'.format(source_root, r) for r in files if r.endswith('.py')
+    }
+
+    shaker = SymbolShaker(mode, universe, candidates)
+    reached, keeps = shaker.shake(config['entries'])
+
+    files_out = set()
+    overrides = {}
+    removed = [0, 0]
+    for r in files:
+        path = '{}/{}'.format(source_root, r)
+        if path in universe and path not in reached:
+            continue
+        files_out.add(r)
+        if (keep := keeps.get(path)) is not None:
+            overrides[r] = shaker.rewrite(path, keep, removed)
+    print(
+        ':v2',
+        'dead code elimination ({}): {} definitions and {} imports removed '
+        'from {} modules, {} modules dropped'.format(
+            mode,
+            removed[0],
+            removed[1],
+            len(overrides),
+            len(files) - len(files_out),
+        ),
+    )
+    return files_out, overrides
+
+
+class SymbolShaker:
+    def __init__(
+        self,
+        mode: T.Mode,
+        universe: tp.Set[T.AbsFilePath],
+        candidates: tp.Set[T.AbsFilePath],
+    ) -> None:
+        """
+        params:
+            universe: all files in the module graphs. a file outside it is
+                never walked into.
+            candidates: the files that can be rewritten.
+        """
+        self._candidates = candidates
+        self._conservative = mode == 'conservative'
+        self._resolved = {}
+        #   {file: ((module_info, path) | None, ...), ...}
+        #       one item per alias of `SymbolTable.statements[*].imports`.
+        self._tables = {}
+        #   {file: SymbolTable | None, ...}
+        #       None if the file cannot be parsed.
+        self._universe = universe
+
+    def shake(
+        self, entries: tp.Iterable[T.AbsFilePath]
+    ) -> tp.Tuple[tp.Set[T.AbsFilePath], tp.Dict[T.AbsFilePath, T.Keep]]:
+        """
+        returns: (reached_files, {file: keep, ...})
+            only the candidates that are partially kept are in the dict.
+        it starts with all statements kept. each round walks the graph along
+        the imports of the kept statements, collects the names used from
+        each module, then decides what to keep. removing a statement may
+        remove more usages, so it repeats until nothing changes.
+        """
+        entries = tuple(entries)
+        keeps = {}
+        while True:
+            reached, used, whole = self._walk(entries, keeps)
+            new_keeps = {}
+            for f in reached:
+                if f in self._candidates and f not in whole:
+                    if (x := self._get_keep(f, used[f])) is not None:
+                        new_keeps[f] = x
+            if new_keeps == keeps:
+                return reached, keeps
+            keeps = new_keeps
+
+    def rewrite(
+        self, file: T.AbsFilePath, keep: T.Keep, counter: tp.List[int]
+    ) -> bytes:
+        """
+        params:
+            counter: [removed_definitions, removed_imports]
+                increased in place.
+        """
+        assert keep is not None
+        with open(file, 'rb') as f:
+            data = f.read()
+        encoding = tokenize.detect_encoding(io.BytesIO(data).readline)[0]
+        lines = data.decode(encoding).splitlines(keepends=True)
+        for i, s in enumerate(self._tables[file].statements):
+            if s.kind == 'other' or i in keep:
+                continue
+            if s.kind == 'import':
+                kept = [a for j, a in enumerate(s.imports) if (i, j) in keep]
+                counter[1] += len(s.imports) - len(kept)
+                text = _unparse_import(kept) if kept else ''
+            else:
+                counter[0] += 1
+                text = ''
+            a, b = s.span
+            for k in range(a - 1, b):
+                lines[k] = '\n'
+            if text:
+                lines[a - 1] = text + '\n'
+        return ''.join(lines).encode(encoding)
+
+    # -------------------------------------------------------------------------
+
+    def _contribute(
+        self,
+        module: ModuleInfo,
+        path: T.AbsFilePath,
+        used: tp.Dict[T.AbsFilePath, tp.Set[str]],
+        whole: tp.Set[T.AbsFilePath],
+    ) -> None:
+        if module.name2 == '*':
+            whole.add(path)
+        elif module.name2:
+            if _is_submodule(path, module.name2):
+                whole.add(path)
+                parent = '{}/__init__.py'.format(
+                    path.removesuffix('/__init__.py').rsplit('/', 1)[0]
+                )
+                used[parent].add(module.name2)
+            else:
+                used[path].add(module.name2)
+        else:
+            # `import a.b.c` binds `a`, all of `a`, `a.b` and `a.b.c` may be
+            # accessed by attributes.
+            whole.add(path)
+            whole.update(self._get_parents(path))
+
+    def _get_imports(
+        self, file: T.AbsFilePath, keep: T.Keep
+    ) -> tp.Iterator[tp.Tuple[ModuleInfo, T.AbsFilePath]]:
+        if not file.endswith('.py'):
+            return
+        if (table := self._get_table(file)) is None:
+            yield from FileParser(file).parse_imports()
+            return
+        resolved = iter(self._get_resolved(file))
+        for i, s in enumerate(table.statements):
+            for j in range(len(s.imports)):
+                x = next(resolved)
+                if x is None:
+                    continue
+                if keep is None or s.kind == 'other':
+                    yield x
+                elif ((i, j) if s.kind == 'import' else i) in keep:
+                    yield x
+
+    def _get_keep(self, file: T.AbsFilePath, used: tp.Set[str]) -> T.Keep:
+        table = self._get_table(file)
+        if table is None or table.bailout[0 if self._conservative else 1]:
+            return None
+        statements = table.statements
+        needed = set(used)
+        kept = set()
+        defs = defaultdict(list)
+        #   {name: [index, ...], ...}
+        for i, s in enumerate(statements):
+            if s.kind == 'other' or (
+                s.kind == 'def' and self._conservative and not s.plain
+            ):
+                kept.add(i)
+                needed.update(s.refs)
+            elif s.kind == 'def':
+                defs[s.names[0]].append(i)
+
+        todo = list(needed)
+        while todo:
+            for i in defs.pop(todo.pop(), ()):
+                kept.add(i)
+                new = statements[i].refs - needed
+                needed.update(new)
+                todo.extend(new)
+
+        resolved = iter(self._get_resolved(file))
+        removed = False
+        for i, s in enumerate(statements):
+            if s.kind == 'import':
+                for j, (alias, name) in enumerate(zip(s.imports, s.names)):
+                    x = next(resolved)
+                    if (
+                        name in needed
+                        or self._conservative
+                        and (
+                            name not in table.refs
+                            or alias[0] == 'import'
+                            or (x and _is_submodule(x[1], alias[2]))
+                        )
+                    ):
+                        kept.add((i, j))
+                    else:
+                        removed = True
+            else:
+                for _ in s.imports:
+                    next(resolved)
+                if s.kind == 'def' and i not in kept:
+                    removed = True
+        return frozenset(kept) if removed else None
+
+    def _get_parents(self, file: T.AbsFilePath) -> tp.Iterator[T.AbsFilePath]:
+        """
+        the `__init__.py` of the packages containing `file`, inner first.
+        """
+        d = fs.parent(file)
+        if file.endswith('/__init__.py'):
+            d = fs.parent(d)
+        while (x := '{}/__init__.py'.format(d)) in self._universe:
+            yield x
+            d = fs.parent(d)
+
+    def _get_resolved(
+        self, file: T.AbsFilePath
+    ) -> tp.List[tp.Optional[tp.Tuple[ModuleInfo, T.AbsFilePath]]]:
+        if (out := self._resolved.get(file)) is not None:
+            return out
+        out = []
+        parser = FileParser(file)
+        for s in self._get_table(file).statements:
+            for kind, module, name, asname, level in s.imports:
+                alias = ast.alias(name, asname)
+                if kind == 'import':
+                    node = ast.Import([alias])
+                    line = 'import {}'.format(name)
+                else:
+                    node = ast.ImportFrom(module, [alias], level)
+                    line = 'from {}{} import {}'.format(
+                        '.' * level, module or '', name
+                    )
+                x = None
+                for m in parser._get_module_info(node, line):
+                    try:
+                        path = parser._get_module_path(m)
+                    except (ModuleNotFound, PathNotFound):
+                        break
+                    if path in self._universe:
+                        x = (m, path)
+                out.append(x)
+        self._resolved[file] = out
+        return out
+
+    def _get_table(self, file: T.AbsFilePath) -> tp.Optional[SymbolTable]:
+        if file not in self._tables:
+            self._tables[file] = get_symbol_table(file)
+        return self._tables[file]
+
+    def _walk(
+        self, entries: tp.Iterable[T.AbsFilePath], keeps: tp.Dict[str, T.Keep]
+    ) -> tp.Tuple[
+        tp.Set[T.AbsFilePath],
+        tp.Dict[T.AbsFilePath, tp.Set[str]],
+        tp.Set[T.AbsFilePath],
+    ]:
+        """
+        returns: (reached, used, whole)
+            used: {file: {name, ...}, ...}
+                the names imported from each file.
+            whole: the files that are used as a whole.
+        """
+        reached = set()
+        used = defaultdict(set)
+        whole = set()
+        patched = set()
+        stack = list(entries)
+        while stack:
+            f = stack.pop()
+            if f in reached:
+                continue
+            reached.add(f)
+            for module, path in self._get_imports(f, keeps.get(f)):
+                if path in self._universe:
+                    self._contribute(module, path, used, whole)
+                    stack.append(path)
+            stack.extend(self._get_parents(f))
+            if f not in entries and f.endswith('.py'):
+                info = FileParser(f).module_info
+                if info.top not in patched:
+                    patched.add(info.top)
+                    for path in _patched_imports(info):
+                        if dir_index.exists(path):
+                            whole.add(path)
+                            stack.append(path)
+        return reached, used, whole
+
+
+# -----------------------------------------------------------------------------
+
+
+def get_symbol_table(file: T.AbsFilePath) -> tp.Optional[SymbolTable]:
+    """
+    returns None if the file cannot be parsed (e.g. python 2 syntax).
+    the table is cached by the file revision.
+    """
+    if (x := cache_maker.get_cache(file + ':1', 'symbol_tables')) is not None:
+        return x
+    try:
+        with open(file, 'rb') as f:
+            tree = ast.parse(f.read(), file)
+    except (SyntaxError, ValueError):
+        return None
+
+    top_names = set()
+    all_refs = set()
+    statements = []
+    for node in tree.body:
+        refs = _get_refs(node)
+        all_refs.update(refs)
+        start = min(
+            (
+                node.lineno,
+                *(x.lineno for x in getattr(node, 'decorator_list', ())),
+            )
+        )
+        span = (start, node.end_lineno or node.lineno)
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            aliases = tuple(_get_aliases(node))
+            if isinstance(node, ast.ImportFrom) and (
+                node.module == '__future__' or node.names[0].name == '*'
+            ):
+                kind, names = 'other', ()
+            else:
+                kind = 'import'
+                names = tuple(
+                    a.asname or a.name.split('.', 1)[0] for a in node.names
+                )
+            top_names.update(names)
+            statements.append(
+                Statement(kind, names, frozenset(refs), aliases, span, False)
+            )
+        elif isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+        ):
+            top_names.add(node.name)
+            is_dunder = node.name.startswith('__') and node.name.endswith('__')
+            statements.append(
+                Statement(
+                    'other' if is_dunder else 'def',
+                    (node.name,),
+                    frozenset(refs),
+                    tuple(_get_aliases(node)),
+                    span,
+                    _is_plain(node),
+                )
+            )
+        else:
+            statements.append(
+                Statement(
+                    'other',
+                    (),
+                    frozenset(refs),
+                    tuple(_get_aliases(node)),
+                    span,
+                    False,
+                )
+            )
+
+    # a statement sharing lines with its neighbours (`import a; import b`)
+    # cannot be blanked out alone.
+    for i, s in enumerate(statements):
+        if s.kind != 'other' and (
+            (i > 0 and statements[i - 1].span[1] >= s.span[0])
+            or (
+                i + 1 < len(statements)
+                and statements[i + 1].span[0] <= s.span[1]
+            )
+        ):
+            s.kind = 'other'
+
+    bailout = ['', '']
+    for k in (0, 1):
+        for name in _BAILOUT_NAMES[k]:
+            if name in all_refs:
+                bailout[k] = name
+                break
+    if '__getattr__' in top_names or '__dir__' in top_names:
+        bailout = ['module __getattr__', 'module __getattr__']
+    if not bailout[0] and _uses_sys_modules(tree):
+        bailout[0] = 'sys.modules'
+
+    out = SymbolTable(
+        (bailout[0], bailout[1]), frozenset(all_refs), tuple(statements)
+    )
+    cache_maker.save_cache(file + ':1', 'symbol_tables', out)
+    return out
+
+
+def _get_aliases(node: ast.AST) -> tp.Iterator[T.Alias]:
+    for x in ast.walk(node):
+        if isinstance(x, ast.Import):
+            for a in x.names:
+                yield 'import', None, a.name, a.asname, 0
+        elif isinstance(x, ast.ImportFrom):
+            for a in x.names:
+                yield 'from', x.module, a.name, a.asname, x.level
+
+
+def _get_refs(node: ast.AST) -> tp.Set[str]:
+    out = set()
+    for x in ast.walk(node):
+        if isinstance(x, ast.Name):
+            out.add(x.id)
+        elif isinstance(x, (ast.Global, ast.Nonlocal)):
+            out.update(x.names)
+        elif isinstance(x, ast.arg) and x.annotation:
+            out.update(_get_string_refs(x.annotation))
+        elif isinstance(x, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if x.returns:
+                out.update(_get_string_refs(x.returns))
+        elif isinstance(x, ast.AnnAssign):
+            out.update(_get_string_refs(x.annotation))
+    return out
+
+
+def _get_string_refs(annotation: ast.AST) -> tp.Iterator[str]:
+    for x in ast.walk(annotation):
+        if isinstance(x, ast.Constant) and isinstance(x.value, str):
+            yield from _IDENTIFIER.findall(x.value)
+
+
+def _get_dotted_name(node: ast.AST) -> str:
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    return ''
+
+
+def _is_plain(node: ast.AST) -> bool:
+    """
+    whether a definition has no side effects other than binding its name.
+    """
+    for x in node.decorator_list:
+        if _get_dotted_name(x) not in _PLAIN_DECORATORS:
+            return False
+    if isinstance(node, ast.ClassDef):
+        if node.keywords:
+            return False
+        for x in node.bases:
+            if isinstance(x, ast.Subscript):
+                x = x.value
+            if _get_dotted_name(x) not in _PLAIN_BASES or isinstance(
+                x, ast.Call
+            ):
+                return False
+    return True
+
+
+def _is_submodule(path: T.AbsFilePath, name: str) -> bool:
+    """
+    for `from x import name`, whether `path` is the submodule `x.name`
+    rather than `x` itself.
+    """
+    if path.endswith('/__init__.py'):
+        return path[:-12].rsplit('/', 1)[-1] == name
+    return path.rsplit('/', 1)[-1].split('.', 1)[0] == name
+
+
+def _unparse_import(aliases: tp.Sequence[T.Alias]) -> str:
+    kind, module, _, _, level = aliases[0]
+    names = [ast.alias(a[2], a[3]) for a in aliases]
+    if kind == 'import':
+        return ast.unparse(ast.Import(names))
+    return ast.unparse(ast.ImportFrom(module, names, level))
+
+
+def _uses_sys_modules(tree: ast.AST) -> bool:
+    for x in ast.walk(tree):
+        if (
+            isinstance(x, ast.Attribute)
+            and x.attr == 'modules'
+            and isinstance(x.value, ast.Name)
+            and x.value.id == 'sys'
+        ):
+            return True
+    return False
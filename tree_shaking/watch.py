@@ -0,0 +1,536 @@
+"""
+watch mode: keep the module graphs in memory, and bring them and the export
+target up to date on file changes.
+"""
+
+import ctypes
+import os
+import select
+import struct
+import sys
+import time
+import typing as tp
+
+from lk_utils import fs
+
+from . import dist_info
+from .cache import cache_maker
+from .config import parse_config
+from .dag import ModuleDag
+from .dependency import DependencyIndex
+from .dir_index import dir_index
+from .dist_info import dist_index
+from .export import T as T0
+from .export import dump_tree_from_config
+from .file_parser import module_inspector
+from .graph import T as T1
+from .graph import _get_dependency_factors
+from .graph import _reformat_paths
+from .manifest import get_manifest
+from .path_scope import path_scope
+from .scanner import scanner
+
+
+class T(T0):
+    Backend = tp.Literal['auto', 'inotify', 'poll']
+    #   auto: 'inotify' on linux, otherwise 'poll'.
+    #   inotify: subscribe to the watched directories.
+    #   poll: list the watched directories every `interval` seconds.
+    DumpedModuleGraph = T1.DumpedModuleGraph
+    EventKind = tp.Literal['modified', 'created', 'removed', 'overflow']
+    #   created, removed: also for the two sides of a rename.
+    #   overflow: some events are lost, everything should be checked again.
+    #       the path is empty.
+    Event = tp.Tuple[EventKind, T0.AbsPath]
+    ScannerBackend = T1.ScannerBackend
+
+
+def watch(
+    config_file: str,
+    backend: T.Backend = 'auto',
+    interval: float = 0.5,
+    debounce: float = 0.05,
+    workers: int = 0,
+    scanner_backend: T.ScannerBackend = 'ast',
+    content_hash: bool = False,
+    precompile: T.Precompile = '',
+    optimize: int = 0,
+    dce: T.DeadCode = '',
+    minify: T.Minify = '',
+    materialize: T.Materialize = 'symlink',
+) -> None:
+    """
+    build the module graphs and export them, then keep both up to date on
+    file changes, until interrupted.
+    params:
+        backend (-b): 'auto', 'inotify' or 'poll'. see `T.Backend`.
+        interval (-i): seconds between two polls, for 'poll' backend.
+        debounce: seconds to wait for more events after the first one, a
+            burst of changes (e.g. a branch checkout) is handled at once.
+        workers (-w): see `build_module_graphs` and `dump_tree_from_config`.
+        scanner_backend (-s): see `build_module_graphs`.
+        content_hash: see `dump_tree_from_config`.
+        precompile (-c): see `dump_tree_from_config`.
+        optimize (-O): see `dump_tree_from_config`.
+        dce: see `dump_tree_from_config`.
+        minify (-m): see `dump_tree_from_config`.
+        materialize: see `dump_tree_from_config`.
+    """
+    watcher = Watcher(
+        config_file,
+        workers,
+        scanner_backend,
+        content_hash=content_hash,
+        precompile=precompile,
+        optimize=optimize,
+        dce=dce,
+        minify=minify,
+        materialize=materialize,
+    )
+    watcher.build()
+    source = _open_source(backend, interval)
+    try:
+        source.set_dirs(watcher.get_watched_dirs())
+        print(
+            'watching {} directories ({}), press ctrl+c to stop'.format(
+                len(source.dirs), type(source).__name__.strip('_').lower()
+            ),
+            ':v2',
+        )
+        while True:
+            if not (events := source.read(None)):
+                continue
+            while more := source.read(debounce):
+                events.extend(more)
+            if watcher.update(events):
+                source.set_dirs(watcher.get_watched_dirs())
+    except KeyboardInterrupt:
+        print('stopped', ':v4')
+    finally:
+        source.close()
+
+
+class Watcher:
+    """
+    a resident build: the path scopes, the module resolutions (see
+    `module.ModuleInspector`), the directory index and the module graph
+    (`dag.ModuleDag`) stay in memory between updates.
+    an update drops the nodes (and cached parsing results) of the touched
+    files, and of the files resolved against the touched directories, then
+    walks the graphs again, only the dropped nodes are parsed. the export
+    uses a resident source manifest, only the touched resources are stated
+    again, and only the difference is applied to the target.
+    """
+
+    def __init__(
+        self,
+        config_file: str,
+        workers: int = 0,
+        scanner_backend: T.ScannerBackend = 'ast',
+        **export_options,
+    ) -> None:
+        """
+        params:
+            workers: for the first build, and the exports.
+            export_options: see `dump_tree_from_config`.
+        """
+        self.config_file = fs.abspath(config_file)
+        self._cfg: tp.Optional[T.Config] = None
+        self._dag: tp.Optional[ModuleDag] = None
+        self._deps = DependencyIndex()
+        self._export_options = export_options
+        self._graphs = {}
+        #   {entry: dumped_module_graph, ...}
+        self._workers = workers
+        scanner.configure(scanner_backend)
+
+    def build(self) -> None:
+        """
+        build everything from the cache, as `build_module_graphs` does. it is
+        called again if the config file changed.
+        """
+        start = time.perf_counter()
+        dir_index.clear()
+        dist_index.clear()
+        module_inspector.clear()
+        cfg = self._cfg = parse_config(self.config_file)
+        self._dag = ModuleDag(cfg['ignores'], cfg['exclude_imports'])
+        self._deps.load(cfg['entries'])
+        outdated = self._deps.check(cfg['entries'])
+        self._deps.invalidate_parsing_results(outdated)
+        if self._workers > 0:
+            self._dag.prefetch(cfg['entries'], self._workers)
+        self._graphs = {
+            e: cache_maker.get_cache(e + ':0', 'module_graphs', persistent=True)
+            for e in cfg['entries']
+        }
+        self._update_graphs()
+        self._export(())
+        print(
+            'built {} modules in {:.3f}s'.format(
+                len(self._dag.nodes), time.perf_counter() - start
+            ),
+            ':v2',
+        )
+
+    def get_watched_dirs(self) -> tp.Set[T.AbsDirPath]:
+        """
+        the directory of the config file, the search paths, and the
+        directories (up to the search path) of the files in the graphs and
+        of the exported resources.
+        """
+        assert self._cfg and self._dag
+        roots = tuple(self._cfg['search_paths'])
+        out = {fs.parent(self.config_file), *roots}
+
+        def add(path: T.AbsPath) -> None:
+            d = path.rsplit('/', 1)[0]
+            inside = path.startswith(tuple(r + '/' for r in roots))
+            while d not in out:
+                out.add(d)
+                if not inside:
+                    break
+                d = d.rsplit('/', 1)[0]
+
+        for node in self._dag.nodes.values():
+            add(node.file)
+            for _, path in node.imports:
+                add(path)
+        if source := self._export_source():
+            for r in get_manifest(source, self._content_hash).last_entries:
+                add('{}/{}'.format(source, r))
+        return {d for d in out if os.path.isdir(d)}
+
+    def update(self, events: tp.Iterable[T.Event]) -> bool:
+        """
+        returns True if the module graphs changed, the watched directories
+        should be updated then.
+        """
+        assert self._cfg and self._dag
+        start = time.perf_counter()
+        target = self._cfg['export']['target']
+        modified = set()
+        moved = set()
+        for kind, path in events:
+            if kind == 'overflow' or path == self.config_file:
+                print(
+                    'config file changed' if path else 'events overflowed',
+                    'build again',
+                    ':v6',
+                )
+                cache_maker.delete_cache(self.config_file + ':1', 'config')
+                self.build()
+                return True
+            if '/__pycache__' in path or (
+                target and (path == target or path.startswith(target + '/'))
+            ):
+                continue
+            (moved if kind in ('created', 'removed') else modified).add(path)
+        if not (modified or moved):
+            return False
+        touched = modified | moved
+
+        # the cached results of a file are validated by its revision, which
+        # may not tell the changes within the same second.
+        for f in touched:
+            if f.endswith('.py'):
+                for thread in (
+                    'ast_parsing_results',
+                    'symbol_tables',
+                    'minified_sources',
+                ):
+                    cache_maker.delete_cache(f + ':1', thread)
+        nodes = self._dag.nodes
+        stale = {f for f in touched if f in nodes}
+        if moved:
+            dir_index.forget(moved)
+            module_inspector.clear()
+            dirs = {p.rsplit('/', 1)[0] for p in moved}
+            for p in self._cfg['search_paths']:
+                if p in dirs:
+                    dist_index.forget(p)
+                    cache_maker.save_cache(
+                        p + ':1',
+                        'path_scope',
+                        path_scope.update_scope(
+                            p,
+                            dist_index.get_tops(p)
+                            if dist_info.enabled
+                            else None,
+                        ),
+                    )
+            # see also `DependencyIndex.invalidate_parsing_results`.
+            prefixes = tuple(p + '/' for p in moved)
+            for node in nodes.values():
+                if any(
+                    p.rsplit('/', 1)[0] in dirs or p.startswith(prefixes)
+                    for p in (node.file, *(x for _, x in node.imports))
+                ):
+                    stale.add(node.file)
+            for f in stale:
+                cache_maker.delete_cache(f + ':1', 'ast_parsing_results')
+        self._dag.forget(stale)
+
+        changed = bool(stale or moved) and self._update_graphs()
+        if changed or any(self._is_exported(p) for p in touched):
+            self._export(touched)
+        print(
+            ':v4',
+            'updated in {:.1f}ms: {} paths touched, {} files parsed again, '
+            'graphs {}'.format(
+                (time.perf_counter() - start) * 1000,
+                len(touched),
+                len(stale),
+                'changed' if changed else 'unchanged',
+            ),
+        )
+        return changed
+
+    @property
+    def _content_hash(self) -> bool:
+        return self._export_options.get('content_hash', False)
+
+    def _export(self, touched: tp.Iterable[T.AbsPath]) -> None:
+        if not (source := self._export_source()):
+            return
+        manifest = get_manifest(source, self._content_hash)
+        manifest.touch(
+            p[len(source) + 1 :] for p in touched if p.startswith(source + '/')
+        )
+        dump_tree_from_config(
+            self._cfg, workers=self._workers, **self._export_options
+        )
+        manifest.keep()
+
+    def _is_exported(self, path: T.AbsPath) -> bool:
+        """
+        if `path` is under the export source. (it may not be exported.)
+        """
+        source = self._export_source()
+        return bool(source) and path.startswith(source + '/')
+
+    def _export_source(self) -> T.AbsDirPath:
+        assert self._cfg
+        x = self._cfg['export']
+        return x['source'] if x['source'] and x['target'] else ''
+
+    def _update_graphs(self) -> bool:
+        """
+        walk all entries, save the graphs that changed. returns True if any
+        graph changed.
+        """
+        assert self._cfg and self._dag
+        changed = False
+        for e in self._cfg['entries']:
+            result = _reformat_paths(
+                sorted(self._dag.walk(e).items()), self._cfg
+            )
+            if result != self._graphs.get(e):
+                changed = True
+                self._graphs[e] = result
+                cache_maker.save_cache(
+                    e + ':0', 'module_graphs', result, persistent=True
+                )
+            self._deps.update(
+                e,
+                _get_dependency_factors(
+                    self._dag.closure(e), self._cfg, self.config_file
+                ),
+            )
+        return changed
+
+
+# ------------------------------------------------------------------------------
+
+
+class _Inotify:
+    """
+    linux inotify, called through ctypes.
+    """
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    mask = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+        | IN_ONLYDIR
+    )
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._wds = {}
+        #   {dirpath: wd, ...}
+        self._dirs = {}
+        #   {wd: dirpath, ...}
+
+    @property
+    def dirs(self) -> tp.Collection[T.AbsDirPath]:
+        return self._wds.keys()
+
+    def set_dirs(self, dirs: tp.Set[T.AbsDirPath]) -> None:
+        for d in self._wds.keys() - dirs:
+            wd = self._wds.pop(d)
+            self._dirs.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+        for d in sorted(dirs - self._wds.keys()):
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(d), self.mask
+            )
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if errno == 28:  # ENOSPC
+                    raise OSError(
+                        errno,
+                        'inotify watches are used up, increase '
+                        '"fs.inotify.max_user_watches" or use the "poll" '
+                        'backend',
+                    )
+                continue  # removed in the meantime.
+            self._wds[d] = wd
+            self._dirs[wd] = d
+
+    def read(self, timeout: tp.Optional[float]) -> tp.List[T.Event]:
+        out = []
+        if not select.select((self._fd,), (), (), timeout)[0]:
+            return out
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                break
+            i = 0
+            while i < len(data):
+                wd, mask, _, size = struct.unpack_from('iIII', data, i)
+                name = os.fsdecode(data[i + 16 : i + 16 + size].rstrip(b'\0'))
+                i += 16 + size
+                if mask & self.IN_Q_OVERFLOW:
+                    out.append(('overflow', ''))
+                    continue
+                if (d := self._dirs.get(wd)) is None:
+                    continue
+                if mask & self.IN_IGNORED:
+                    # the directory is removed, or unwatched.
+                    self._dirs.pop(wd)
+                    if self._wds.get(d) == wd:
+                        self._wds.pop(d)
+                    continue
+                path = '{}/{}'.format(d, name) if name else d
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    out.append(('created', path))
+                elif mask & (
+                    self.IN_DELETE
+                    | self.IN_MOVED_FROM
+                    | self.IN_DELETE_SELF
+                    | self.IN_MOVE_SELF
+                ):
+                    out.append(('removed', path))
+                else:
+                    out.append(('modified', path))
+        return out
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _Poller:
+    """
+    lists the watched directories periodically, and tells the differences.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._listings = {}
+        #   {dirpath: {name: (isdir, size, mtime_ns), ...}, ...}
+
+    @property
+    def dirs(self) -> tp.Collection[T.AbsDirPath]:
+        return self._listings.keys()
+
+    def set_dirs(self, dirs: tp.Set[T.AbsDirPath]) -> None:
+        for d in self._listings.keys() - dirs:
+            self._listings.pop(d)
+        for d in dirs - self._listings.keys():
+            self._listings[d] = self._list(d)
+
+    def read(self, timeout: tp.Optional[float]) -> tp.List[T.Event]:
+        time.sleep(self._interval if timeout is None else timeout)
+        out = []
+        for d, old in self._listings.items():
+            if (new := self._list(d)) is None:
+                if old is not None:
+                    out.append(('removed', d))
+                new = {}
+            for name in (old or {}).keys() | new.keys():
+                a = old.get(name) if old else None
+                b = new.get(name)
+                if a == b:
+                    continue
+                path = '{}/{}'.format(d, name)
+                if a is None:
+                    out.append(('created', path))
+                elif b is None or a[0] != b[0]:
+                    out.append(('removed', path))
+                    if b is not None:
+                        out.append(('created', path))
+                else:
+                    out.append(('modified', path))
+            self._listings[d] = new
+        return out
+
+    def close(self) -> None:
+        self._listings.clear()
+
+    @staticmethod
+    def _list(
+        dirpath: T.AbsDirPath,
+    ) -> tp.Optional[tp.Dict[str, tp.Tuple[bool, int, int]]]:
+        out = {}
+        try:
+            with os.scandir(dirpath) as it:
+                for e in it:
+                    try:
+                        if e.is_dir():
+                            # its own changes are told by its listing.
+                            out[e.name] = (True, 0, 0)
+                        else:
+                            st = e.stat()
+                            out[e.name] = (False, st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return out
+
+
+def _open_source(
+    backend: T.Backend, interval: float
+) -> tp.Union[_Inotify, _Poller]:
+    assert backend in ('auto', 'inotify', 'poll'), backend
+    if backend == 'auto':
+        backend = 'inotify' if sys.platform.startswith('linux') else 'poll'
+    if backend == 'inotify':
+        try:
+            return _Inotify()
+        except (AttributeError, OSError) as e:
+            print('inotify is not available, fall back to polling', e, ':v6')
+    return _Poller(interval)